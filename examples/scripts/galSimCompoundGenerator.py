@@ -60,6 +60,10 @@ print('done with stars')
 bulges = CatalogDBObject.from_objid('galaxyBulge')
 bulge_galSim = testGalSimGalaxies(bulges, obs_metadata=obs_metadata)
 
+#Setting composite_galaxies = True on the galaxy catalogs would instead
+#collect the bulge and disk of each galaxy and draw them together as one
+#object when write_images is called (see GalSimBase.composite_galaxies).
+
 #This will make sure that the galaxies are drawn to the same images
 #as the stars were.  It copies the GalSimInterpreter from the star
 #catalog.  It also copies the camera.  The PSF in the GalSimInterpreter
@@ -3,6 +3,11 @@ from .galSimDetector import *
 from .galSimCelestialObject import *
 from .galSimNoiseAndBackground import *
 from .galSimPSF import *
+from .galSimImageStorage import *
+from .galSimImageWriter import *
 from .galSimInterpreter import *
+from .galSimObjectSpool import *
+from .galSimParallel import *
 from .galSimCatalogs import *
+from .galSimCatalogMultiplexer import *
 from .galSimPhoSimCatalogs import *
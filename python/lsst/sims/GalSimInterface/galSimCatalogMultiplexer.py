@@ -0,0 +1,137 @@
+"""
+This file defines GalSimCatalogMultiplexer, which draws the objects of several
+GalSimBase catalogs (e.g. stars, galaxy bulges, galaxy disks and AGN) onto the
+same images in a single pass over their database queries and then draws and
+writes them detector by detector, so that only a few detectors' images are held
+in memory at a time.
+"""
+from __future__ import print_function
+
+from builtins import object
+import tempfile
+from lsst.sims.GalSimInterface import GalSimObjectSpool
+
+__all__ = ["GalSimCatalogMultiplexer"]
+
+
+class GalSimCatalogMultiplexer(object):
+    """
+    This class replaces the chain of write_catalog and copyGalSimInterpreter
+    calls used to draw several GalSimBase catalogs onto the same images
+    (see galSimCompoundGenerator.py in the examples/ directory).
+
+    The database queries of all of the catalogs are consumed together, chunk
+    by chunk.  Rather than being drawn as they are read, the objects are routed
+    to sky regions, one per detector, by a GalSimObjectSpool.  Once the catalogs
+    are exhausted, the objects of all types assigned to each region are drawn
+    together, after which the region's FITS files are written and its images
+    freed before moving on to the next region.
+
+    No detector is written before all of the queries are exhausted, since
+    an object read later may still land on it; in the meantime the objects
+    are spooled to disk (see GalSimObjectSpool), unless hold_in_memory is True.
+    Each object is routed with the footprint with which it will be drawn
+    (including GalSimInterpreter.flux_adaptive_footprints), so that it is drawn
+    before any of the detectors it illumines is written.  The InstanceCatalog text output of the catalogs is not written.
+    Composite galaxies (GalSimBase.composite_galaxies) are supported;
+    GalSimParallelRenderer (GalSimBase.n_render_processes) is not.
+    """
+
+    def __init__(self, catalogs, spool_dir=None, hold_in_memory=False):
+        """
+        @param [in] catalogs is a list of GalSimBase catalogs.  They all draw onto the
+        GalSimInterpreter of the first one to be initialized (as if copyGalSimInterpreter
+        had been called), and so share its camera, PSF and noise model.
+
+        @param [in] spool_dir is the directory in which the objects are spooled between
+        the two steps (default: the system's temporary directory; see GalSimObjectSpool)
+
+        @param [in] hold_in_memory is a boolean.  If True, the objects are held in
+        memory between the two steps instead of being spooled to disk.
+        """
+        if len(catalogs) == 0:
+            raise RuntimeError("You passed no catalogs to the GalSimCatalogMultiplexer")
+        self.catalogs = catalogs
+        if hold_in_memory:
+            self.spool_dir = None
+        elif spool_dir is None:
+            self.spool_dir = tempfile.gettempdir()
+        else:
+            self.spool_dir = spool_dir
+        self._spool = None  # the GalSimObjectSpool holding the objects routed to each region
+
+    @property
+    def galSimInterpreter(self):
+        """
+        The GalSimInterpreter shared by the catalogs (None before any of them
+        has been initialized)
+        """
+        for catalog in self.catalogs:
+            if catalog.galSimInterpreter is not None:
+                return catalog.galSimInterpreter
+        return None
+
+    def _shareInterpreter(self, catalog):
+        """
+        Make catalog draw with the GalSimInterpreter of the catalogs which
+        have already been initialized
+        """
+        for other in self.catalogs:
+            if other is not catalog and other.hasBeenInitialized:
+                catalog.copyGalSimInterpreter(other)
+                return
+
+    def _routeObject(self, gsObject):
+        """
+        Assign an object to the region of the first (in the order of the regions)
+        detector it illumines.  This is the object_sink of the catalogs.
+
+        @param [out] outputString is a string denoting which detectors the object
+        illumines (see GalSimInterpreter.findAllDetectors)
+        """
+        if self._spool is None:
+            self._spool = GalSimObjectSpool(self.galSimInterpreter, spool_dir=self.spool_dir)
+        return self._spool.add(gsObject)
+
+    def writeImages(self, nameRoot=None, chunk_size=10000):
+        """
+        Read the catalogs and draw and write the FITS images of every detector.
+
+        @param [in] nameRoot is a string that will be prepended to the names of
+        the output FITS files (see GalSimInterpreter.writeImages)
+
+        @param [in] chunk_size is the number of rows read from the database of
+        each catalog at a time
+
+        @param [out] namesWritten is a list of the names of the FITS files written
+        """
+        iterators = [None]*len(self.catalogs)
+        for catalog in self.catalogs:
+            catalog.object_sink = self._routeObject
+
+        try:
+            # Take one chunk from each catalog in turn.
+            active = list(range(len(self.catalogs)))
+            while len(active) > 0:
+                for icat in list(active):
+                    catalog = self.catalogs[icat]
+                    if iterators[icat] is None:
+                        self._shareInterpreter(catalog)
+                        iterators[icat] = catalog.iter_catalog_chunks(chunk_size=chunk_size)
+                    try:
+                        next(iterators[icat])
+                    except StopIteration:
+                        active.remove(icat)
+
+            for catalog in self.catalogs:
+                catalog.draw_composite_galaxies()
+        finally:
+            for catalog in self.catalogs:
+                catalog.object_sink = None
+
+        if self._spool is None:
+            return []
+
+        namesWritten = self._spool.render(nameRoot=nameRoot)
+        self._spool = None
+        return namesWritten
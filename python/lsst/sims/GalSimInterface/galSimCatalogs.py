@@ -15,6 +15,7 @@ from builtins import str
 import numpy as np
 import os
 import copy
+from collections import OrderedDict
 
 import lsst.utils
 from lsst.sims.utils import arcsecFromRadians
@@ -23,6 +24,9 @@ from lsst.sims.catalogs.decorators import cached
 from lsst.sims.catUtils.mixins import (CameraCoords, AstrometryGalaxies, AstrometryStars,
                                        EBVmixin)
 from lsst.sims.GalSimInterface import GalSimInterpreter, GalSimDetector, GalSimCelestialObject
+from lsst.sims.GalSimInterface import GalSimSiliconInterpeter
+from lsst.sims.GalSimInterface import GalSimCelestialObjectBatch, GalSimCompositeObject
+from lsst.sims.GalSimInterface import GalSimParallelRenderer, GalSimObjectSpool, GalSimImageWriter
 from lsst.sims.GalSimInterface import GalSimCameraWrapper
 from lsst.sims.GalSimInterface import make_galsim_detector
 from lsst.sims.photUtils import (Sed, Bandpass, BandpassDict,
@@ -140,6 +144,11 @@ class GalSimBase(InstanceCatalog, CameraCoords):
 
     seed = 42
 
+    # If True, the random numbers used to draw each object are seeded by
+    # (seed, uniqueId, bandpass, detector), so that the images do not depend
+    # on the order in which objects are drawn (see GalSimInterpreter).
+    seed_per_object = False
+
     # This is sort of a hack; it prevents findChipName in coordUtils from dying
     # if an object lands on multiple science chips.
     allow_multiple_chips = True
@@ -198,6 +207,79 @@ class GalSimBase(InstanceCatalog, CameraCoords):
 
     galSimInterpreter = None  # the GalSimInterpreter instantiation for this catalog
 
+    # If True, each chunk of the catalog is passed to the GalSimInterpreter
+    # as a GalSimCelestialObjectBatch (see GalSimInterpreter.drawObjects)
+    # rather than one object at a time.
+    draw_in_batches = False
+
+    # If not None, the detectors are split across this many worker processes
+    # which draw and write their images in parallel when write_images is
+    # called (see GalSimParallelRenderer).  The random numbers are then always
+    # seeded object by object, as if seed_per_object were True.
+    n_render_processes = None
+
+    # If True, the objects of this catalog are galaxy components (bulges, disks,
+    # knots, ...) which are not drawn as they are read.  Instead, the components
+    # of all of the catalogs sharing this catalog's GalSimInterpreter (see
+    # copyGalSimInterpreter) are joined on their galaxy id and each galaxy is
+    # drawn as a single GalSimCompositeObject once all of its components have
+    # been read (see composite_component_count), or else when
+    # draw_composite_galaxies (or write_images) is called.  Until then, the
+    # components are held as compact records without their SEDs.  The fitsFiles
+    # column of the components read in the chunk in which their galaxy is drawn
+    # holds the detectors of the galaxy; that of the other components holds the
+    # detectors of the component itself.
+    composite_galaxies = False
+
+    # If not None, the number of components of every galaxy (e.g. 2 for a bulge
+    # and a disk).  A galaxy is drawn at the end of the chunk in which that many
+    # of its components have been read.
+    composite_component_count = None
+
+    # The uniqueIds of the components are (galaxy id << composite_id_shift) +
+    # objectTypeId.  The composite galaxy is given the uniqueId of a component
+    # with objectTypeId = 0.
+    composite_id_shift = 10
+
+    _compositeComponents = None  # galaxy uniqueId -> list of the spool records of its components
+
+    # If not None, a function which is handed each GalSimCelestialObject (or
+    # GalSimCompositeObject) instead of the GalSimInterpreter, and which returns
+    # the string denoting the detectors illumined by the object, as
+    # GalSimInterpreter.drawObject does (see GalSimCatalogMultiplexer).
+    object_sink = None
+
+    # If not None, the images are drawn in two passes, so that only the images of
+    # one detector (and of the neighbours onto which its objects spill) are held in
+    # memory at a time.  While the catalog is read, the objects are only routed to
+    # the detectors and spooled to files in this directory; write_images then draws
+    # and writes the images detector by detector (see GalSimObjectSpool).
+    streaming_spool_dir = None
+
+    _objectSpool = None  # the GalSimObjectSpool shared by the catalogs drawing on the same images
+
+    # If not None, a function called as detector_callback(detector, namesWritten)
+    # each time the images of a detector are written and released, e.g. by
+    # galSimInterpreter.finishDetector or in the second pass of the streaming mode
+    # (see GalSimInterpreter.detector_callback).
+    detector_callback = None
+
+    # If not None, the FITS files are written by this many background threads
+    # (see GalSimImageWriter), so that several files are written at once and,
+    # in the streaming mode, the next detector is drawn while the last one is
+    # being written.
+    image_writer_threads = None
+
+    # If not None, 'rice' or 'gzip': the FITS images are tile-compressed, as by
+    # fpack, and named *.fits.fz (see GalSimInterpreter.image_compression).  The
+    # files are compressed in parallel by the threads of image_writer_threads, or
+    # by the workers of n_render_processes.
+    image_compression = None
+
+    # If not None, 'int16' or 'int32': the pixels are rounded to integer ADU and
+    # written as unsigned integers with BZERO (see GalSimInterpreter.image_quantization).
+    image_quantization = None
+
     totalDrawings = 0
     totalObjects = 0
 
@@ -220,7 +302,14 @@ class GalSimBase(InstanceCatalog, CameraCoords):
         Objects are stored based on their uniqueId values.
         """
         self.objectHasBeenDrawn = set()
+        if self._compositeComponents is None:
+            self._compositeComponents = OrderedDict()
         self._initializeGalSimInterpreter()
+        if (self.streaming_spool_dir is not None and self._objectSpool is None and
+                self.n_render_processes is None):
+            # (the workers of a GalSimParallelRenderer spool their own objects)
+            self._objectSpool = GalSimObjectSpool(self.galSimInterpreter,
+                                                  spool_dir=self.streaming_spool_dir)
         self.hasBeenInitialized = True
 
     @cached
@@ -351,6 +440,9 @@ class GalSimBase(InstanceCatalog, CameraCoords):
                                                       epoch=self.db_obj.epoch)
 
         output = []
+        batchRows = []
+        batchSeds = []
+        compositeRows = OrderedDict()  # galaxy uniqueId -> [(row, component)]
         for (name, xp, yp, hlr, minor, major, pa, ss, sn, npo, gam1, gam2, kap) in \
             zip(objectNames, xPupil, yPupil, halfLight,
                  minorAxis, majorAxis, positionAngle, sedList, sindex, npoints,
@@ -364,7 +456,36 @@ class GalSimBase(InstanceCatalog, CameraCoords):
 
                 self.objectHasBeenDrawn.add(name)
 
-                if name not in self.galSimInterpreter.drawn_objects:
+                galaxyId = None
+                if self.composite_galaxies:
+                    galaxyId = (int(name) >> self.composite_id_shift) << self.composite_id_shift
+
+                if galaxyId is not None:
+                    # The object will be drawn along with the other components
+                    # of its galaxy (see composite_galaxies); its detectors
+                    # are filled in below.
+                    if galaxyId not in self.galSimInterpreter.drawn_objects:
+                        gsObj = GalSimCelestialObject(self.galsim_type, xp, yp,
+                                                      hlr, minor, major, pa, sn,
+                                                      ss, self.bandpassDict, self.photParams,
+                                                      npo, None, None, None,
+                                                      gam1, gam2, kap, uniqueId=name)
+                        record = gsObj.spoolRecord(list(self.bandpassDict),
+                                                   keep_sed=isinstance(self.galSimInterpreter,
+                                                                       GalSimSiliconInterpeter))
+                        self._compositeComponents.setdefault(galaxyId, []).append(record)
+                        compositeRows.setdefault(galaxyId, []).append((len(output), gsObj))
+                    detectorsString = ''
+
+                elif (name not in self.galSimInterpreter.drawn_objects and self.draw_in_batches and
+                      self.object_sink is None and self._objectSpool is None):
+                    # The object will be drawn below along with the
+                    # rest of the chunk.
+                    batchRows.append(len(output))
+                    batchSeds.append(ss)
+                    detectorsString = None
+
+                elif name not in self.galSimInterpreter.drawn_objects:
 
                     gsObj = GalSimCelestialObject(self.galsim_type, xp, yp,
                                                   hlr, minor, major, pa, sn,
@@ -373,7 +494,7 @@ class GalSimBase(InstanceCatalog, CameraCoords):
                                                   gam1, gam2, kap, uniqueId=name)
 
                     # actually draw the object
-                    detectorsString = self.galSimInterpreter.drawObject(gsObj)
+                    detectorsString = self._drawObject(gsObj)
                 else:
                     # For objects that have already been drawn in the
                     # checkpointed data, use a blank string.
@@ -381,11 +502,66 @@ class GalSimBase(InstanceCatalog, CameraCoords):
 
                 output.append(detectorsString)
 
+        if len(batchRows) > 0:
+            rows = np.array(batchRows)
+            gsObjBatch = GalSimCelestialObjectBatch(self.galsim_type, xPupil[rows], yPupil[rows],
+                                                    halfLight[rows], minorAxis[rows], majorAxis[rows],
+                                                    positionAngle[rows], sindex[rows],
+                                                    batchSeds, self.bandpassDict, self.photParams,
+                                                    npoints[rows], None, None, None,
+                                                    gamma1[rows], gamma2[rows], kappa[rows],
+                                                    uniqueId=objectNames[rows])
+
+            # actually draw the objects
+            for row, detectorsString in zip(batchRows,
+                                            self.galSimInterpreter.drawObjects(gsObjBatch)):
+                output[row] = detectorsString
+
+        for galaxyId, rows in compositeRows.items():
+            if (self.composite_component_count is not None and
+                    len(self._compositeComponents[galaxyId]) >= self.composite_component_count):
+                detectorsString = self._drawCompositeGalaxy(galaxyId)
+                for row, gsObj in rows:
+                    output[row] = detectorsString
+            else:
+                # The galaxy is drawn later, so report the detectors
+                # on which the component itself might cast light.
+                for row, gsObj in rows:
+                    output[row] = self.galSimInterpreter.findAllDetectors(gsObj,
+                                                                          create_object=False)[0]
+
         # Force checkpoint at the end (if a checkpoint file has been specified).
         if self.galSimInterpreter is not None:
             self.galSimInterpreter.write_checkpoint(force=True)
         return np.array(output)
 
+    def _drawCompositeGalaxy(self, galaxyId):
+        """
+        Draw the galaxy galaxyId from the components collected in
+        self._compositeComponents (see composite_galaxies) and forget them
+
+        @param [out] detectorsString is a string denoting which detectors the
+        galaxy illumines
+        """
+        components = [GalSimCelestialObject.fromSpoolRecord(record, self.bandpassDict, self.photParams)
+                      for record in self._compositeComponents.pop(galaxyId)]
+        return self._drawObject(GalSimCompositeObject(components, uniqueId=galaxyId))
+
+    def _drawObject(self, gsObj):
+        """
+        Draw an object with the GalSimInterpreter, or hand it to self.object_sink
+        if there is one, or spool it if the images are drawn in two passes (see
+        streaming_spool_dir).
+
+        @param [out] detectorsString is a string denoting which detectors the
+        object illumines
+        """
+        if self.object_sink is not None:
+            return self.object_sink(gsObj)
+        if self._objectSpool is not None:
+            return self._objectSpool.add(gsObj)
+        return self.galSimInterpreter.drawObject(gsObj)
+
     def setPSF(self, PSF):
         """
         Set the PSF of this GalSimCatalog after instantiation.
@@ -415,6 +591,8 @@ class GalSimBase(InstanceCatalog, CameraCoords):
         if otherCatalog.hasBeenInitialized:
             self.bandpassDict = otherCatalog.bandpassDict
             self.galSimInterpreter = otherCatalog.galSimInterpreter
+            self._compositeComponents = otherCatalog._compositeComponents
+            self._objectSpool = otherCatalog._objectSpool
 
     def _initializeGalSimInterpreter(self):
         """
@@ -484,22 +662,69 @@ class GalSimBase(InstanceCatalog, CameraCoords):
                                                                       atmoTransmission=os.path.join(self.bandpassDir,
                                                                                                     self.atmoTransmissionName))
 
-            self.galSimInterpreter = GalSimInterpreter(obs_metadata=self.obs_metadata,
-                                                       epoch=self.db_obj.epoch,
-                                                       detectors=detectors,
-                                                       bandpassDict=self.bandpassDict,
-                                                       noiseWrapper=self.noise_and_background,
-                                                       seed=self.seed)
+            if self.n_render_processes is None:
+                self.galSimInterpreter = GalSimInterpreter(obs_metadata=self.obs_metadata,
+                                                           epoch=self.db_obj.epoch,
+                                                           detectors=detectors,
+                                                           bandpassDict=self.bandpassDict,
+                                                           noiseWrapper=self.noise_and_background,
+                                                           seed=self.seed,
+                                                           seed_per_object=self.seed_per_object)
+                self.galSimInterpreter.detector_callback = self.detector_callback
+                self.galSimInterpreter.image_compression = self.image_compression
+                self.galSimInterpreter.image_quantization = self.image_quantization
+                if self.image_writer_threads is not None:
+                    self.galSimInterpreter.image_writer = GalSimImageWriter(nthreads=self.image_writer_threads)
+            else:
+                self.galSimInterpreter = GalSimParallelRenderer(obs_metadata=self.obs_metadata,
+                                                                epoch=self.db_obj.epoch,
+                                                                detectors=detectors,
+                                                                bandpassDict=self.bandpassDict,
+                                                                noiseWrapper=self.noise_and_background,
+                                                                seed=self.seed,
+                                                                nproc=self.n_render_processes,
+                                                                spool_dir=self.streaming_spool_dir)
+                # each worker writes and compresses the files of its own detectors
+                # (and calls detector_callback in its own process)
+                self.galSimInterpreter.interpreter_attributes['detector_callback'] = self.detector_callback
+                self.galSimInterpreter.interpreter_attributes['image_compression'] = self.image_compression
+                self.galSimInterpreter.interpreter_attributes['image_quantization'] = self.image_quantization
+                self.galSimInterpreter.image_writer_threads = self.image_writer_threads
 
             self.galSimInterpreter.setPSF(PSF=self.PSF)
 
+    def draw_composite_galaxies(self):
+        """
+        Draw the galaxies whose components have been collected by the catalogs
+        sharing this catalog's GalSimInterpreter (see composite_galaxies).  All
+        of the components of a galaxy go through detector finding, flux
+        realization and coordinate transformation together and are drawn as a
+        galsim.Sum of the components, each with its own SED.
+
+        @param [out] outputDict is a dict mapping the uniqueId of each composite
+        galaxy to the string denoting which detectors it illumines
+        """
+        outputDict = OrderedDict()
+        if not self._compositeComponents:
+            return outputDict
+
+        for galaxyId in list(self._compositeComponents):
+            if galaxyId not in self.galSimInterpreter.drawn_objects:
+                outputDict[galaxyId] = self._drawCompositeGalaxy(galaxyId)
+        self._compositeComponents.clear()
 
+        self.galSimInterpreter.write_checkpoint(force=True)
+        return outputDict
 
     def write_images(self, nameRoot=None):
         """
         Writes the FITS images associated with this InstanceCatalog.
 
-        Cannot be called before write_catalog is called.
+        Cannot be called before write_catalog is called.  Any composite galaxies
+        which have not been drawn yet are drawn first (see draw_composite_galaxies).
+        If the objects have been spooled (see streaming_spool_dir), they are drawn
+        now, one detector at a time, and the images of each detector are written
+        and released before the next one is drawn.
 
         @param [in] nameRoot is an optional string prepended to the names
         of the FITS images.  The FITS images will be named
@@ -511,6 +736,9 @@ class GalSimBase(InstanceCatalog, CameraCoords):
         (e.g. myImages_R_0_0_S_1_1_y.fits for an LSST-like camera with
         nameRoot = 'myImages')
         """
+        self.draw_composite_galaxies()
+        if self._objectSpool is not None:
+            return self._objectSpool.render(nameRoot=nameRoot)
         namesWritten = self.galSimInterpreter.writeImages(nameRoot=nameRoot)
 
         return namesWritten
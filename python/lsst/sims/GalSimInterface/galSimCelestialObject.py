@@ -2,7 +2,7 @@ from builtins import object
 import numpy as np
 from lsst.sims.utils import arcsecFromRadians
 
-__all__ = ["GalSimCelestialObject"]
+__all__ = ["GalSimCelestialObject", "GalSimCelestialObjectBatch", "GalSimCompositeObject"]
 
 class GalSimCelestialObject(object):
     """
@@ -17,7 +17,7 @@ class GalSimCelestialObject(object):
                  halfLightRadius, minorAxis, majorAxis, positionAngle,
                  sindex, sed, bp_dict, photParams, npoints,
                  fits_image_file, pixel_scale, rotation_angle,
-                 gamma1=0, gamma2=0, kappa=0, uniqueId=None):
+                 gamma1=0, gamma2=0, kappa=0, uniqueId=None, fluxDict=None):
         """
         @param [in] galSimType is a string, either 'pointSource', 'sersic',
         'RandomWalk', or 'FitsImage' denoting the shape of the object
@@ -67,6 +67,10 @@ class GalSimCelestialObject(object):
         @param [in] kappa is the WL convergence parameter
 
         @param [in] uniqueId is an int storing a unique identifier for this object
+
+        @param [in] fluxDict is an optional dict mapping bandpass name to electron
+        counts for this object.  Fluxes for bands that are not in fluxDict will be
+        computed from sed, bp_dict, and photParams.
         """
         self._uniqueId = uniqueId
         self._galSimType = galSimType
@@ -81,7 +85,7 @@ class GalSimCelestialObject(object):
         g2 = gamma2/(1. - kappa)   # imaginary part of reduced shear
         mu = 1./((1. - kappa)**2 - (gamma1**2 + gamma2**2)) # magnification
 
-        self._fluxDict = {}
+        self._fluxDict = {} if fluxDict is None else dict(fluxDict)
         self._sed = sed
         self._bp_dict = bp_dict
         self._photParams = photParams
@@ -327,3 +331,250 @@ class GalSimCelestialObject(object):
             self._fluxDict[band] = adu*self._photParams.gain
 
         return self._fluxDict[band]
+
+    def spoolRecord(self, bandpassNames, keep_sed=True):
+        """
+        Return a compact, picklable tuple describing this object, from which
+        fromSpoolRecord recreates it (see GalSimObjectSpool).  The bandpasses
+        are not stored; the fluxes in bandpassNames are stored instead.
+
+        @param [in] bandpassNames is a list of the names of the bandpasses
+        in which the object will be drawn
+
+        @param [in] keep_sed is a boolean.  If False, the SED is not stored
+        (it is only needed to compute fluxes and to sample wavelengths).
+        """
+        fluxDict = dict((band, self.flux(band)) for band in bandpassNames)
+        return (self._galSimType, self._uniqueId, self._fits_image_file,
+                self._float_values, fluxDict, self._sed if keep_sed else None)
+
+    @classmethod
+    def fromSpoolRecord(cls, record, bp_dict, photParams):
+        """
+        Recreate a GalSimCelestialObject from the tuple returned by spoolRecord
+
+        @param [in] bp_dict and photParams are as in __init__
+        """
+        obj = cls.__new__(cls)
+        (obj._galSimType, obj._uniqueId, obj._fits_image_file,
+         obj._float_values, obj._fluxDict, obj._sed) = record
+        obj._bp_dict = bp_dict
+        obj._photParams = photParams
+        return obj
+
+
+class GalSimCelestialObjectBatch(object):
+    """
+    This is the column-oriented counterpart of GalSimCelestialObject.  It
+    carries the data for a whole chunk of objects as numpy arrays so that
+    GalSimInterpreter.drawObjects can do its bookkeeping (detector lookup,
+    pixel coordinates, flux realization) for the chunk at once.  Individual
+    objects are served up as GalSimCelestialObjects by indexing the batch.
+    """
+
+    def __init__(self, galSimType, xPupil, yPupil,
+                 halfLightRadius, minorAxis, majorAxis, positionAngle,
+                 sindex, sedList, bp_dict, photParams, npoints,
+                 fits_image_file=None, pixel_scale=0.0, rotation_angle=0.0,
+                 gamma1=0, gamma2=0, kappa=0, uniqueId=None, fluxes=None):
+        """
+        All of the parameters have the same meaning as in the constructor of
+        GalSimCelestialObject, except that, apart from bp_dict and photParams,
+        they may be numpy arrays with one entry per object.  Scalar values are
+        broadcast across the whole batch.
+
+        @param [in] sedList is a list of lsst.sims.photUtils.Sed instantiations,
+        one per object
+
+        @param [in] fluxes is an optional dict mapping bandpass name to a numpy
+        array of electron counts for each object.  Fluxes for bands not in this
+        dict will be computed from the SEDs.
+        """
+        self._nobj = len(sedList)
+        self._sedList = sedList
+        self._bp_dict = bp_dict
+        self._photParams = photParams
+
+        self._galSimType = self._column(galSimType, object)
+        self._fits_image_file = self._column(fits_image_file, object)
+        if uniqueId is None:
+            self._uniqueId = np.array([None]*self._nobj, dtype=object)
+        else:
+            self._uniqueId = self._column(uniqueId, object)
+
+        self._xPupil = self._column(xPupil, float)
+        self._yPupil = self._column(yPupil, float)
+        self._halfLightRadius = self._column(halfLightRadius, float)
+        self._minorAxis = self._column(minorAxis, float)
+        self._majorAxis = self._column(majorAxis, float)
+        self._positionAngle = self._column(positionAngle, float)
+        self._sindex = self._column(sindex, float)
+        self._npoints = self._column(npoints, float)
+        self._pixel_scale = self._column(pixel_scale, float)
+        self._rotation_angle = self._column(rotation_angle, float)
+        self._gamma1 = self._column(gamma1, float)
+        self._gamma2 = self._column(gamma2, float)
+        self._kappa = self._column(kappa, float)
+
+        self._fluxDict = {}
+        if fluxes is not None:
+            for band in fluxes:
+                self._fluxDict[band] = self._column(fluxes[band], float)
+
+    def _column(self, value, dtype):
+        """
+        Return value as a numpy array of length len(self), broadcasting scalars.
+        """
+        if dtype is object and (value is None or isinstance(value, str)):
+            return np.array([value]*self._nobj, dtype=object)
+        column = np.asarray(value, dtype=dtype)
+        if column.ndim == 0:
+            column = np.array([column.item()]*self._nobj, dtype=dtype)
+        if len(column) != self._nobj:
+            raise RuntimeError("GalSimCelestialObjectBatch was given a column with %d "
+                               "entries; expected %d" % (len(column), self._nobj))
+        return column
+
+    def __len__(self):
+        return self._nobj
+
+    def __getitem__(self, ii):
+        """
+        Return the ii-th object of the batch as a GalSimCelestialObject
+        """
+        fluxDict = dict((band, self._fluxDict[band][ii]) for band in self._fluxDict)
+        return GalSimCelestialObject(self._galSimType[ii], self._xPupil[ii], self._yPupil[ii],
+                                     self._halfLightRadius[ii], self._minorAxis[ii],
+                                     self._majorAxis[ii], self._positionAngle[ii],
+                                     self._sindex[ii], self._sedList[ii], self._bp_dict,
+                                     self._photParams, self._npoints[ii],
+                                     self._fits_image_file[ii], self._pixel_scale[ii],
+                                     self._rotation_angle[ii],
+                                     gamma1=self._gamma1[ii], gamma2=self._gamma2[ii],
+                                     kappa=self._kappa[ii], uniqueId=self._uniqueId[ii],
+                                     fluxDict=fluxDict)
+
+    @property
+    def uniqueId(self):
+        return self._uniqueId
+
+    @property
+    def galSimType(self):
+        return self._galSimType
+
+    @property
+    def sedList(self):
+        return self._sedList
+
+    @property
+    def xPupilRadians(self):
+        return self._xPupil
+
+    @property
+    def xPupilArcsec(self):
+        return arcsecFromRadians(self._xPupil)
+
+    @property
+    def yPupilRadians(self):
+        return self._yPupil
+
+    @property
+    def yPupilArcsec(self):
+        return arcsecFromRadians(self._yPupil)
+
+    def flux(self, band):
+        """
+        @param [in] band is the name of a bandpass
+
+        @param [out] a numpy array of the ADU of each object in that bandpass
+        """
+        if band not in self._bp_dict:
+            raise RuntimeError("Asked GalSimCelestialObjectBatch for flux in %s; that band does not exist" % band)
+
+        if band not in self._fluxDict:
+            adu = np.array([sed.calcADU(self._bp_dict[band], self._photParams)
+                            for sed in self._sedList], dtype=float)
+            self._fluxDict[band] = adu*self._photParams.gain
+
+        return self._fluxDict[band]
+
+
+class GalSimCompositeObject(object):
+    """
+    This class carries the components (e.g. the bulge, disk and knots) of one
+    galaxy, each a GalSimCelestialObject with its own profile and SED, so that
+    the GalSimInterpreter can draw them as a single object (a galsim.Sum of the
+    components).  The components are taken to share the position of the first
+    one.
+    """
+
+    def __init__(self, components, uniqueId=None):
+        """
+        @param [in] components is a list of GalSimCelestialObjects
+
+        @param [in] uniqueId is the unique identifier of the galaxy
+        """
+        if len(components) == 0:
+            raise RuntimeError("Cannot create a GalSimCompositeObject with no components")
+        self._components = list(components)
+        self._uniqueId = uniqueId
+
+    @property
+    def components(self):
+        return self._components
+
+    @property
+    def uniqueId(self):
+        return self._uniqueId
+
+    @property
+    def galSimType(self):
+        return 'composite'
+
+    @property
+    def sed(self):
+        """
+        The components have their own SEDs (see components)
+        """
+        return None
+
+    @property
+    def xPupilRadians(self):
+        return self._components[0].xPupilRadians
+
+    @property
+    def xPupilArcsec(self):
+        return self._components[0].xPupilArcsec
+
+    @property
+    def yPupilRadians(self):
+        return self._components[0].yPupilRadians
+
+    @property
+    def yPupilArcsec(self):
+        return self._components[0].yPupilArcsec
+
+    def flux(self, band):
+        """
+        @param [in] band is the name of a bandpass
+
+        @param [out] the ADU in that bandpass, summed over the components
+        """
+        return sum(component.flux(band) for component in self._components)
+
+    def spoolRecord(self, bandpassNames, keep_sed=True):
+        """
+        Return a compact, picklable tuple describing this object and its
+        components (see GalSimCelestialObject.spoolRecord)
+        """
+        return ('composite', self._uniqueId,
+                [component.spoolRecord(bandpassNames, keep_sed=keep_sed)
+                 for component in self._components])
+
+    @classmethod
+    def fromSpoolRecord(cls, record, bp_dict, photParams):
+        """
+        Recreate a GalSimCompositeObject from the tuple returned by spoolRecord
+        """
+        return cls([GalSimCelestialObject.fromSpoolRecord(component, bp_dict, photParams)
+                    for component in record[2]], uniqueId=record[1])
@@ -12,7 +12,7 @@ from lsst.sims.GalSimInterface.wcsUtils import tanSipWcsFromDetector
 from lsst.sims.GalSimInterface import GalSimCameraWrapper
 from lsst.sims.photUtils import PhotometricParameters
 
-__all__ = ["GalSimDetector", "make_galsim_detector"]
+__all__ = ["GalSimDetector", "make_galsim_detector", "GalSimDetectorIndex"]
 
 
 class GalSim_afw_TanSipWCS(galsim.wcs.CelestialWCS):
@@ -644,3 +644,142 @@ def make_galsim_detector(camera_wrapper, detname, phot_params,
     return GalSimDetector(detname, camera_wrapper,
                           obs_metadata=obs_metadata, epoch=epoch,
                           photParams=params)
+
+
+class GalSimDetectorIndex(object):
+    """
+    This class is a uniform grid index over the bounding boxes (in arcseconds
+    on the pupil) of a list of GalSimDetectors.  It is used by the
+    GalSimInterpreter to find the detectors which a box around an object
+    might overlap without comparing the box to every detector.
+
+    Each cell of the grid stores the indices of the detectors whose bounding
+    boxes overlap it, so that a query only tests the detectors listed in the
+    cells covered by the box.
+    """
+
+    def __init__(self, detectors, cell_size=None):
+        """
+        @param [in] detectors is a list of GalSimDetectors (or of any objects with
+        xMinArcsec, xMaxArcsec, yMinArcsec and yMaxArcsec attributes)
+
+        @param [in] cell_size is the side length of the grid cells in arcseconds.
+        If None, the median width of the detectors is used, so that each cell
+        is overlapped by a handful of detectors.
+        """
+        self._ndet = len(detectors)
+        self._xMin = np.array([dd.xMinArcsec for dd in detectors], dtype=float)
+        self._xMax = np.array([dd.xMaxArcsec for dd in detectors], dtype=float)
+        self._yMin = np.array([dd.yMinArcsec for dd in detectors], dtype=float)
+        self._yMax = np.array([dd.yMaxArcsec for dd in detectors], dtype=float)
+
+        if self._ndet == 0:
+            self._x0 = self._y0 = 0.0
+            self._cell_size = 1.0
+            self._nx = self._ny = 1
+            self._cellStart = np.zeros(2, dtype=int)
+            self._cellDetectors = np.zeros(0, dtype=int)
+            return
+
+        if cell_size is None:
+            cell_size = np.median(np.maximum(self._xMax - self._xMin,
+                                             self._yMax - self._yMin))
+        if not cell_size > 0.0:
+            raise RuntimeError("GalSimDetectorIndex needs a positive cell_size; "
+                               "you gave %s" % str(cell_size))
+        self._cell_size = float(cell_size)
+
+        self._x0 = self._xMin.min()
+        self._y0 = self._yMin.min()
+        self._nx = int(np.floor((self._xMax.max() - self._x0)/self._cell_size)) + 1
+        self._ny = int(np.floor((self._yMax.max() - self._y0)/self._cell_size)) + 1
+
+        # Store the detectors of each cell in compressed sparse row form:
+        # the detectors overlapping cell ic are
+        # self._cellDetectors[self._cellStart[ic]:self._cellStart[ic+1]]
+        ix0, ix1 = self._cellRange(self._xMin, self._xMax, self._x0, self._nx)
+        iy0, iy1 = self._cellRange(self._yMin, self._yMax, self._y0, self._ny)
+        idet, cells = self._expandCells(ix0, ix1, iy0, iy1)
+        order = np.argsort(cells, kind='mergesort')
+        self._cellDetectors = idet[order]
+        self._cellStart = np.zeros(self._nx*self._ny + 1, dtype=int)
+        np.cumsum(np.bincount(cells, minlength=self._nx*self._ny), out=self._cellStart[1:])
+
+    def _cellRange(self, minVal, maxVal, origin, ncells):
+        """
+        Return the (inclusive) ranges of grid cell indices along one axis
+        covered by the intervals [minVal, maxVal], clipped to the grid
+        """
+        i0 = np.floor((minVal - origin)/self._cell_size).astype(int)
+        i1 = np.floor((maxVal - origin)/self._cell_size).astype(int)
+        return np.clip(i0, 0, ncells-1), np.clip(i1, 0, ncells-1)
+
+    def _expandCells(self, ix0, ix1, iy0, iy1):
+        """
+        Given the ranges of cells covered by a set of boxes, return the index of
+        the box and the index of the cell for every (box, cell) pair
+        """
+        nx = ix1 - ix0 + 1
+        ny = iy1 - iy0 + 1
+        ncells = nx*ny
+        ibox = np.repeat(np.arange(len(ix0)), ncells)
+        # the position of each pair within the cells of its box
+        offset = np.arange(ncells.sum()) - np.repeat(np.cumsum(ncells) - ncells, ncells)
+        ix = ix0[ibox] + offset % nx[ibox]
+        iy = iy0[ibox] + offset // nx[ibox]
+        return ibox, iy*self._nx + ix
+
+    def findOverlaps(self, xmin, xmax, ymin, ymax):
+        """
+        Find the detectors overlapped by each of a set of boxes.
+
+        Parameters
+        ----------
+        xmin, xmax, ymin, ymax: numpy arrays
+            The bounds of the boxes in arcseconds on the pupil
+
+        Returns
+        -------
+        iBox, iDetector: numpy arrays of ints
+            For each (box, detector) pair that overlaps, the index of the box and
+            the index of the detector in the list passed to the constructor, sorted
+            by box and then by detector
+        """
+        xmin = np.atleast_1d(np.asarray(xmin, dtype=float))
+        xmax = np.atleast_1d(np.asarray(xmax, dtype=float))
+        ymin = np.atleast_1d(np.asarray(ymin, dtype=float))
+        ymax = np.atleast_1d(np.asarray(ymax, dtype=float))
+
+        empty = np.zeros(0, dtype=int)
+        if self._ndet == 0 or len(xmin) == 0:
+            return empty, empty
+
+        ix0, ix1 = self._cellRange(xmin, xmax, self._x0, self._nx)
+        iy0, iy1 = self._cellRange(ymin, ymax, self._y0, self._ny)
+        ibox, cells = self._expandCells(ix0, ix1, iy0, iy1)
+
+        # the candidate detectors listed in each (box, cell) pair
+        ncand = self._cellStart[cells+1] - self._cellStart[cells]
+        ibox = np.repeat(ibox, ncand)
+        offset = np.arange(ncand.sum()) - np.repeat(np.cumsum(ncand) - ncand, ncand)
+        idet = self._cellDetectors[np.repeat(self._cellStart[cells], ncand) + offset]
+
+        overlaps = ((np.minimum(xmax[ibox], self._xMax[idet]) >
+                     np.maximum(xmin[ibox], self._xMin[idet])) &
+                    (np.minimum(ymax[ibox], self._yMax[idet]) >
+                     np.maximum(ymin[ibox], self._yMin[idet])))
+
+        # a detector spanning several cells covered by a box is listed once per cell
+        pairs = np.unique(ibox[overlaps]*self._ndet + idet[overlaps])
+        return pairs // self._ndet, pairs % self._ndet
+
+    def findDetectors(self, xmin, xmax, ymin, ymax):
+        """
+        Find the detectors overlapped by a single box.
+
+        @param [in] xmin, xmax, ymin, ymax are the bounds of the box in arcseconds
+
+        @param [out] a sorted numpy array of the indices of the overlapping detectors
+        in the list passed to the constructor
+        """
+        return self.findOverlaps(xmin, xmax, ymin, ymax)[1]
@@ -0,0 +1,223 @@
+"""
+This file defines alternatives to the in-memory, full-frame galsim.Images in
+which GalSimInterpreter accumulates the detector images:
+
+GalSimTiledImage -- a sparse image made of tiles allocated where photons land.
+
+memmapImage -- a galsim.Image whose pixels are memory-mapped from a file.
+"""
+from __future__ import print_function
+
+from builtins import range
+from builtins import object
+import numpy as np
+import galsim
+
+__all__ = ["GalSimTiledImage", "memmapImage"]
+
+
+class GalSimTiledImage(object):
+    """
+    A detector image stored as a grid of square tiles, where a tile is only
+    allocated once a non-zero value is written to it.  The image of a sparse
+    field (a few hundred objects on a chip) then occupies a small fraction of
+    the memory of the full frame.
+
+    The drawing code does not draw on the tiles directly.  It takes a copy of
+    the region it draws on as a galsim.Image (getRegion or image[bounds]) and
+    puts it back (setRegion), or adds photons by pixel (accumulate).  The full
+    frame is only assembled by toImage, when the image is written.
+    """
+
+    def __init__(self, bounds, wcs=None, tile_size=256, dtype=np.float32):
+        """
+        @param [in] bounds is the galsim.BoundsI of the full image
+
+        @param [in] wcs is the WCS of the image (as in galsim.Image)
+
+        @param [in] tile_size is the length in pixels of the side of the tiles
+        (the tiles at the upper edges of the image are cut short by its bounds)
+
+        @param [in] dtype is the numpy data type of the pixels
+        """
+        if tile_size < 1:
+            raise RuntimeError("The tiles of a GalSimTiledImage must be at least one pixel "
+                               "on a side; you asked for %s" % str(tile_size))
+        self.bounds = bounds
+        self.wcs = wcs
+        self.tile_size = int(tile_size)
+        self.dtype = dtype
+        self.tiles = {}  # (column, row) of the tile -> numpy array of its pixels
+
+    @property
+    def true_center(self):
+        """
+        The galsim.PositionD of the center of the full image
+        """
+        return self.bounds.true_center
+
+    @property
+    def nbytes(self):
+        """
+        The number of bytes occupied by the allocated tiles
+        """
+        return sum(tile.nbytes for tile in self.tiles.values())
+
+    def copy(self):
+        """
+        Return a deep copy of the image
+        """
+        other = GalSimTiledImage(self.bounds, wcs=self.wcs, tile_size=self.tile_size,
+                                 dtype=self.dtype)
+        other.tiles = dict((key, tile.copy()) for key, tile in self.tiles.items())
+        return other
+
+    def tileBounds(self, key):
+        """
+        Return the galsim.BoundsI of the tile at (column, row) key
+        """
+        xmin = self.bounds.xmin + key[0]*self.tile_size
+        ymin = self.bounds.ymin + key[1]*self.tile_size
+        return galsim.BoundsI(xmin, min(xmin + self.tile_size - 1, self.bounds.xmax),
+                              ymin, min(ymin + self.tile_size - 1, self.bounds.ymax))
+
+    def tileKeys(self, bounds=None):
+        """
+        Return a list of the (column, row) keys of the tiles overlapping
+        bounds (by default, of every tile of the image, allocated or not)
+        """
+        if bounds is None:
+            bounds = self.bounds
+        bounds = bounds & self.bounds
+        if not bounds.isDefined():
+            return []
+        ts = self.tile_size
+        columns = range((bounds.xmin - self.bounds.xmin)//ts, (bounds.xmax - self.bounds.xmin)//ts + 1)
+        rows = range((bounds.ymin - self.bounds.ymin)//ts, (bounds.ymax - self.bounds.ymin)//ts + 1)
+        return [(column, row) for row in rows for column in columns]
+
+    def _tile(self, key):
+        """
+        Return the pixels of the tile at key, allocating it if need be
+        """
+        if key not in self.tiles:
+            bounds = self.tileBounds(key)
+            self.tiles[key] = np.zeros((bounds.ymax - bounds.ymin + 1,
+                                        bounds.xmax - bounds.xmin + 1), dtype=self.dtype)
+        return self.tiles[key]
+
+    def _tileSlice(self, key, bounds):
+        """
+        Return the numpy index of the part of the tile at key within bounds
+        """
+        tile_bounds = self.tileBounds(key)
+        return (slice(bounds.ymin - tile_bounds.ymin, bounds.ymax - tile_bounds.ymin + 1),
+                slice(bounds.xmin - tile_bounds.xmin, bounds.xmax - tile_bounds.xmin + 1))
+
+    def getRegion(self, bounds):
+        """
+        Return a copy of the part of the image within bounds, as a galsim.Image
+        (unallocated tiles read as zero)
+        """
+        bounds = bounds & self.bounds
+        image = galsim.Image(bounds, wcs=self.wcs, dtype=self.dtype)
+        for key in self.tileKeys(bounds):
+            if key in self.tiles:
+                overlap = self.tileBounds(key) & bounds
+                image[overlap].array[:] = self.tiles[key][self._tileSlice(key, overlap)]
+        return image
+
+    def __getitem__(self, bounds):
+        return self.getRegion(bounds)
+
+    def setRegion(self, image):
+        """
+        Copy the pixels of the galsim.Image image (as returned by getRegion)
+        back into the tiles.  Tiles which are not allocated yet are only
+        allocated if image has non-zero pixels in them.
+        """
+        bounds = image.bounds & self.bounds
+        for key in self.tileKeys(bounds):
+            overlap = self.tileBounds(key) & bounds
+            values = image[overlap].array
+            if key in self.tiles or values.any():
+                self._tile(key)[self._tileSlice(key, overlap)] = values
+
+    def accumulate(self, x, y, values):
+        """
+        Add values to the pixels at the integer coordinates (x, y) of the image.
+        Pixels outside of the image are ignored.
+
+        @param [in] x, y are numpy arrays of the pixel coordinates
+
+        @param [in] values is a number or a numpy array of the values to add
+        """
+        values = np.broadcast_to(values, np.shape(x))
+        inside = np.where((x >= self.bounds.xmin) & (x <= self.bounds.xmax) &
+                          (y >= self.bounds.ymin) & (y <= self.bounds.ymax))
+        x = x[inside] - self.bounds.xmin
+        y = y[inside] - self.bounds.ymin
+        values = values[inside]
+
+        column = x//self.tile_size
+        row = y//self.tile_size
+        for key in set(zip(column.tolist(), row.tolist())):
+            onTile = np.where((column == key[0]) & (row == key[1]))
+            np.add.at(self._tile(key), (y[onTile] - key[1]*self.tile_size,
+                                        x[onTile] - key[0]*self.tile_size), values[onTile])
+
+    def toImage(self, tile_function=None):
+        """
+        Assemble the full image.
+
+        @param [in] tile_function is an optional function called with a blank
+        galsim.Image covering each tile of the image (allocated or not), and
+        returning the image to which the pixels of the tile are added, e.g. to
+        add sky background and noise tile by tile.
+
+        @param [out] the full galsim.Image
+        """
+        image = galsim.Image(self.bounds, wcs=self.wcs, dtype=self.dtype)
+        if tile_function is not None:
+            for key in self.tileKeys():
+                tile_bounds = self.tileBounds(key)
+                tile = tile_function(galsim.Image(tile_bounds, wcs=self.wcs, dtype=self.dtype))
+                image[tile_bounds].array[:] = tile.array
+        for key, tile in self.tiles.items():
+            image[self.tileBounds(key)].array[:] += tile
+        return image
+
+    def write(self, file_name=None):
+        """
+        Write the full image to a FITS file
+        """
+        self.toImage().write(file_name=file_name)
+
+
+def memmapImage(file_name, ncol, nrow, wcs=None, dtype=np.float32, mode='w+'):
+    """
+    Create a galsim.Image whose pixels are held in a numpy.memmap of a file
+    rather than in memory, so that the operating system can page them out.
+
+    Parameters
+    ----------
+    file_name: str
+        The file holding the pixels.
+    ncol, nrow: int
+        The size of the image; its bounds start at (1, 1), as those of the
+        images made by GalSimInterpreter.blankImage.
+    wcs: galsim.BaseWCS [None]
+        The WCS of the image.
+    dtype: numpy data type [numpy.float32]
+        The data type of the pixels.
+    mode: str ['w+']
+        The numpy.memmap mode: 'w+' creates a blank image (overwriting
+        file_name), 'r+' opens the pixels already in file_name.
+
+    Returns
+    -------
+    (galsim.Image, numpy.memmap): the image and the memmap of its pixels,
+    whose flush method writes them to the file.
+    """
+    array = np.memmap(file_name, dtype=dtype, mode=mode, shape=(nrow, ncol))
+    return galsim.Image(array, xmin=1, ymin=1, wcs=wcs), array
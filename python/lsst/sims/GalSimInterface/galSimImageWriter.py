@@ -0,0 +1,244 @@
+"""
+This file defines:
+
+GalSimImageWriter -- writes FITS images in background threads so that many
+files are written (and compressed) concurrently, and so that drawing can go on
+while they are written.
+
+writeFitsImage -- writes a FITS image, optionally tile-compressed and with its
+pixels quantized to integers.
+"""
+from __future__ import print_function
+
+from builtins import range
+from builtins import object
+import atexit
+import threading
+import queue
+import weakref
+import numpy as np
+import galsim
+
+__all__ = ["GalSimImageWriter", "writeFitsImage", "fitsFileName"]
+
+# the galsim.fits compression of each image_compression option
+_compressions = {'rice': 'rice', 'gzip': 'gzip_tile'}
+
+# the unsigned type (stored as the signed type with BZERO) of each image_quantization option
+_quantizations = {'int16': np.uint16, 'int32': np.uint32}
+
+# the GalSimImageWriters whose threads are running (see _closeRunningWriters)
+_running_writers = weakref.WeakSet()
+
+
+def _closeRunningWriters():
+    """
+    Write the images still queued on the GalSimImageWriters which were not
+    closed before the Python interpreter exits.  Their threads are daemon
+    threads, which would otherwise be killed with the files half written.
+    """
+    errors = []
+    for writer in list(_running_writers):
+        try:
+            writer.close()
+        except Exception as error:
+            errors.append(error)
+    if len(errors) > 0:
+        raise errors[0]
+
+
+atexit.register(_closeRunningWriters)
+
+
+def _checkOptions(compression, quantization):
+    if compression is not None and compression not in _compressions:
+        raise RuntimeError("Unknown FITS compression %s; the options are %s"
+                           % (str(compression), str(sorted(_compressions))))
+    if quantization is not None and quantization not in _quantizations:
+        raise RuntimeError("Unknown FITS quantization %s; the options are %s"
+                           % (str(quantization), str(sorted(_quantizations))))
+
+
+def fitsFileName(file_name, compression=None):
+    """
+    Return the name of the FITS file written by writeFitsImage.
+
+    Parameters
+    ----------
+    file_name: str
+        The name of the uncompressed file.
+    compression: str [None]
+        The compression (see writeFitsImage).
+
+    Returns
+    -------
+    str: file_name, with '.fz' appended (as by fpack) if the file is compressed.
+    """
+    _checkOptions(compression, None)
+    if compression is None:
+        return file_name
+    return file_name + '.fz'
+
+
+def writeFitsImage(image, file_name, compression=None, quantization=None):
+    """
+    Write a galsim.Image to a FITS file.
+
+    Parameters
+    ----------
+    image: galsim.Image
+        The image to write.  It is not modified.
+    file_name: str
+        The name of the file (see fitsFileName).
+    compression: str [None]
+        None to write an uncompressed image, or 'rice' or 'gzip' to write a
+        tile-compressed image (one row of pixels per tile, as fpack does) with
+        the RICE_1 or GZIP_1 algorithm.  Floating-point pixels are quantized by
+        astropy before they are compressed, so that only the bits above the
+        noise are kept.
+    quantization: str [None]
+        None to keep the pixels as they are, or 'int16' or 'int32' to round
+        them to the nearest integer (in ADU), clip them to the range of the
+        unsigned type and store them as 16 or 32 bit integers with BZERO
+        (32768 or 2147483648), the FITS convention for unsigned integers.
+    """
+    _checkOptions(compression, quantization)
+    if quantization is not None:
+        dtype = _quantizations[quantization]
+        info = np.iinfo(dtype)
+        pixels = np.clip(np.rint(image.array), info.min, info.max).astype(dtype)
+        image = galsim.Image(pixels, xmin=image.xmin, ymin=image.ymin, wcs=image.wcs)
+    if compression is None:
+        image.write(file_name=file_name)
+    else:
+        image.write(file_name=file_name, compression=_compressions[compression])
+
+
+class GalSimImageWriter(object):
+    """
+    Images handed to write are put on a bounded queue, from which a pool of
+    threads writes them (with writeFitsImage).  Threads rather than processes
+    are used because the images carry WCSs wrapping afw objects, which cannot
+    be pickled.  Most of the time spent writing a FITS file is spent in I/O or
+    in the compression of its tiles, during both of which the threads run
+    concurrently.
+
+    Errors raised while writing, and the callbacks of the writes, are passed
+    back to the calling thread by the next call to write, poll or flush.
+    close waits for every pending write and stops the threads; they are
+    started again by the next call to write.
+
+    Callers must call close (or use the writer as a context manager) once
+    they have queued their last image, so that the errors are raised and the
+    callbacks called.  A writer which was not closed is closed when the
+    Python interpreter exits, so that the queued files are still written,
+    but its errors are then only printed.
+    """
+
+    def __init__(self, nthreads=4, max_pending=8):
+        """
+        @param [in] nthreads is the number of writing threads
+
+        @param [in] max_pending is the maximum number of images waiting to be
+        written (which are held in memory); write blocks while the queue is full
+        """
+        if nthreads < 1:
+            raise RuntimeError("GalSimImageWriter needs at least one thread; "
+                               "you asked for %s" % str(nthreads))
+        self.nthreads = nthreads
+        self.max_pending = max_pending
+        self.nwritten = 0  # the number of files written
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._completed = []  # (callback, file name) of the writes done since the last poll
+        self._errors = []  # the exceptions raised by the writes since the last poll
+        self._threads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _work(self):
+        """
+        The loop run by each writing thread
+        """
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                image, file_name, callback, compression, quantization = job
+                try:
+                    writeFitsImage(image, file_name, compression=compression,
+                                   quantization=quantization)
+                except Exception as error:
+                    with self._lock:
+                        self._errors.append(error)
+                else:
+                    with self._lock:
+                        self.nwritten += 1
+                        if callback is not None:
+                            self._completed.append((callback, file_name))
+            finally:
+                self._queue.task_done()
+
+    def write(self, image, file_name, callback=None, compression=None, quantization=None):
+        """
+        Queue an image to be written
+
+        @param [in] image is the galsim.Image to write.  It must not be
+        modified until it has been written.
+
+        @param [in] file_name is the name of the FITS file
+
+        @param [in] callback is an optional function, called as callback(file_name)
+        on the calling thread (by a later call to write, poll or flush) once the
+        file has been written
+
+        @param [in] compression and quantization are the options of writeFitsImage
+        """
+        _checkOptions(compression, quantization)
+        self.poll()
+        if len(self._threads) == 0:
+            self._threads = [threading.Thread(target=self._work) for ii in range(self.nthreads)]
+            for thread in self._threads:
+                thread.daemon = True
+                thread.start()
+            _running_writers.add(self)
+        self._queue.put((image, file_name, callback, compression, quantization))
+
+    def poll(self):
+        """
+        Call the callbacks of the files written so far, then raise the first
+        error (if any) raised while writing them
+        """
+        with self._lock:
+            completed, self._completed = self._completed, []
+            errors, self._errors = self._errors, []
+        for callback, file_name in completed:
+            callback(file_name)
+        if len(errors) > 0:
+            raise errors[0]
+
+    def flush(self):
+        """
+        Wait until every queued image has been written (see poll)
+        """
+        self._queue.join()
+        self.poll()
+
+    def close(self):
+        """
+        Wait until every queued image has been written and stop the threads
+        """
+        try:
+            self.flush()
+        finally:
+            for thread in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+            _running_writers.discard(self)
@@ -12,31 +12,39 @@ from __future__ import print_function
 import math
 from builtins import object
 import os
+import copy
 import pickle
+import shutil
 import tempfile
 import gzip
+import hashlib
+from collections import OrderedDict
 import numpy as np
 import astropy
 import galsim
 from lsst.obs.lsstSim import LsstSimMapper
 from lsst.sims.utils import radiansFromArcsec, observedFromPupilCoords
+from lsst.sims.photUtils import calcSkyCountsPerPixelForM5
 from lsst.sims.GalSimInterface import make_galsim_detector, SNRdocumentPSF, \
-    Kolmogorov_and_Gaussian_PSF
+    Kolmogorov_and_Gaussian_PSF, GalSimDetectorIndex, GalSimTiledImage, memmapImage, \
+    GalSimImageWriter, writeFitsImage, fitsFileName
 
-__all__ = ["make_gs_interpreter", "GalSimInterpreter", "GalSimSiliconInterpeter"]
+__all__ = ["make_gs_interpreter", "GalSimInterpreter", "GalSimSiliconInterpeter",
+           "InterpolatedImageCache"]
 
 
 def make_gs_interpreter(obs_md, detectors, bandpassDict, noiseWrapper,
                         epoch=None, seed=None, apply_sensor_model=False,
-                        bf_strength=1):
+                        bf_strength=1, seed_per_object=False):
     if apply_sensor_model:
         return GalSimSiliconInterpeter(obs_metadata=obs_md, detectors=detectors,
                                        bandpassDict=bandpassDict, noiseWrapper=noiseWrapper,
-                                       epoch=epoch, seed=seed, bf_strength=bf_strength)
+                                       epoch=epoch, seed=seed, bf_strength=bf_strength,
+                                       seed_per_object=seed_per_object)
 
     return GalSimInterpreter(obs_metadata=obs_md, detectors=detectors,
                              bandpassDict=bandpassDict, noiseWrapper=noiseWrapper,
-                             epoch=epoch, seed=seed)
+                             epoch=epoch, seed=seed, seed_per_object=seed_per_object)
 
 class GalSimInterpreter(object):
     """
@@ -46,7 +54,7 @@ class GalSimInterpreter(object):
 
     def __init__(self, obs_metadata=None, detectors=None,
                  bandpassDict=None, noiseWrapper=None,
-                 epoch=None, seed=None):
+                 epoch=None, seed=None, seed_per_object=False):
 
         """
         @param [in] obs_metadata is an instantiation of the ObservationMetaData class which
@@ -62,7 +70,16 @@ class GalSimInterpreter(object):
 
         @param [in] seed is an integer that will use to seed the random number generator
         used when drawing images (if None, GalSim will automatically create a random number
-        generator seeded with the system clock)
+        generator seeded with the system clock).  The realized fluxes of the objects are
+        drawn from a numpy generator seeded by all of the bits of a hash of the seed (it
+        used to be seeded by the seed modulo 2**32, so that a given seed now realizes
+        different fluxes than it did before).
+
+        @param [in] seed_per_object is a boolean.  If True, the random numbers used for each
+        object are drawn from generators seeded by (seed, uniqueId, bandpass, detector) rather
+        than from a single generator consumed in the order in which objects are drawn, so that
+        the images do not depend on that order (the sky noise of each detector image is
+        likewise seeded by (seed, detector, bandpass)).  This requires a seed.
         """
 
         self.obs_metadata = obs_metadata
@@ -70,26 +87,162 @@ class GalSimInterpreter(object):
         self.PSF = None
         self.noiseWrapper = noiseWrapper
 
+        if seed_per_object and seed is None:
+            raise RuntimeError("The GalSimInterpreter needs a seed in order to seed "
+                               "the random numbers of each object")
+        self._seed = seed
+        self.seed_per_object = seed_per_object
+
+        # The fluxes are realized from a generator seeded by all of the bits of the seed.
         if seed is not None:
             self._rng = galsim.UniformDeviate(seed)
+            self._fluxRng = self._objectNumpyRng('fluxes')
         else:
             self._rng = None
+            self._fluxRng = np.random.RandomState()
+
+        # The photons of faint objects and photon reservoirs are sampled from
+        # their own generator, so that the fluxes realized from self._fluxRng
+        # do not depend on how many photons were sampled in between.
+        if seed is not None:
+            self._photonRng = self._objectNumpyRng('photons')
+        else:
+            self._photonRng = np.random.RandomState()
 
         if detectors is None:
             raise RuntimeError("Will not create images; you passed no detectors to the GalSimInterpreter")
 
         self.detectors = detectors
+        self._detectorIndex = GalSimDetectorIndex(detectors)  # grid index over the arcsec
+                                                              # bounding boxes of the detectors
 
         self.detectorImages = {}  # this dict will contain the FITS images (as GalSim images)
+        self.released_detectors = set()  # the names of the detectors whose images have been
+                                         # written and released (see writeDetectorImages)
+        self.detector_callback = None  # If not None, a function called as
+                                       # detector_callback(detector, namesWritten) each time
+                                       # the images of a detector have been written and
+                                       # released (see finishDetector).
         self.bandpassDict = bandpassDict
         self.blankImageCache = {}  # this dict will cache blank images associated with specific detectors.
                                    # It turns out that calling the image's constructor is more
                                    # time-consuming than returning a deep copy
+        self.tile_size = None  # If not None, the detector images are GalSimTiledImages made of
+                               # tiles this many pixels on a side, allocated only where
+                               # photons land.  The photons shot from the objects are added
+                               # to the tiles wherever they land, as on a full frame, and the
+                               # sky background and noise are added tile by tile when the
+                               # images are written.  Not supported by GalSimSiliconInterpeter.
+        self._deferredNoise = {}  # the (detector, bandpass name) of the tiled images,
+                                  # keyed on file name, to which the sky background
+                                  # and noise have yet to be added
+        self.image_scratch_dir = None  # If not None (and self.tile_size is None), the pixels of
+                                       # the detector images are held in numpy.memmap files in
+                                       # this directory rather than in memory, and checkpoints
+                                       # copy those files instead of pickling the pixels.
+        self._memmaps = {}  # the numpy.memmaps of those images, keyed on file name
+        self._snapshots = {}  # the copies of those files made by the last checkpoint, keyed on
+                              # file name, of the images which have not been drawn on since
+        self._retiredFiles = set()  # the scratch files no longer in use, deleted once
+                                    # the next checkpoint no longer refers to them
+        self.image_memory_limit = None  # If not None, the number of bytes the (in-memory)
+                                        # detector images may occupy.  Beyond it, the least
+                                        # recently drawn images are spilled to compressed files
+                                        # (in self.image_scratch_dir, or else in a temporary
+                                        # directory) and reloaded when drawn on again.
+        self.image_memory_stats = {'hits': 0, 'misses': 0, 'spills': 0}  # The number of times
+                                                                         # an image was drawn on
+                                                                         # while in memory, was
+                                                                         # reloaded, was spilled.
+        self._imageUsage = OrderedDict()  # the detector of each image in memory, keyed on
+                                          # file name, least recently drawn first
+        self._spilledImages = {}  # the (file name, detector) of each spilled image
+        self._spillDir = None  # the temporary directory of the scratch files (if
+                               # self.image_scratch_dir is None)
+        self._releasedImages = set()  # the file names of the images which have been
+                                      # written and released by writeImages
+        self.image_writer = None  # If not None, a GalSimImageWriter by which the FITS files
+                                  # are written in background threads (writeImages waits
+                                  # for them; writeDetectorImages does not, and calls
+                                  # self.detector_callback once they have been written,
+                                  # so callers must call image_writer.close() once
+                                  # the last detector has been written).
+        self.image_compression = None  # If not None, 'rice' or 'gzip': the FITS files are
+                                       # tile-compressed, and '.fz' is appended to their
+                                       # names (see writeFitsImage).
+        self.image_quantization = None  # If not None, 'int16' or 'int32': the pixels are
+                                        # rounded to integer ADU and written as unsigned
+                                        # integers (with BZERO) of that size.
         self.checkpoint_file = None
         self.drawn_objects = set()
         self.nobj_checkpoint = 1000
         self._observatory = None
 
+        self.draw_stamps = False  # If True, drawObject renders each object onto a
+                                  # postage stamp sub-image of the detector image
+                                  # rather than onto the full frame.
+        self.stamp_keep_sb_level = 1.0  # The minimum surface brightness (photons/pixel)
+                                        # out to which postage stamps for bright objects
+                                        # are extended.  Unlike the sqrt(sky)/3 used by
+                                        # GalSimSiliconInterpeter, this does not depend on
+                                        # the sky level, which the non-sensor interpreter
+                                        # may not add at all (noiseWrapper is None), so the
+                                        # stamps are the same with or without sky noise.
+                                        # It is below sqrt(sky)/3 for any sky brighter
+                                        # than 9 photons/pixel, i.e. more conservative.
+
+        self.flux_adaptive_footprints = False  # If True, the detectors an object is drawn on are
+                                               # found using the radius at which its surface
+                                               # brightness falls below a fraction of the sky
+                                               # noise, rather than conservative_factor.
+        self.footprint_sky_noise_fraction = 1./3.  # That fraction of the sky noise per pixel.
+        self.sky_bg_per_pixel = None  # The sky background (photons/pixel); if None, it is
+                                      # computed for each band from self.obs_metadata.
+        self._skyLevels = {}
+        self._psfProfiles = OrderedDict()  # the tabulated PSF profiles (see _psfCached)
+        self.psf_cache_size = 64  # The number of PSFs whose tabulated properties are kept.
+
+        self.faint_flux_threshold = None  # If not None, objects whose realized fluxes are below
+                                          # this value in every band are drawn by sampling a
+                                          # table of photons shot from the PSF (see
+                                          # _drawFaintObject) instead of by GalSim, provided
+                                          # that the PSF is position-independent.
+        self.faint_photon_table_size = 100000  # The number of photons in that table.
+        self.faint_object_stats = {'objects': 0, 'photons': 0}  # The number of objects and
+                                                                # photons drawn that way
+                                                                # (see faintObjectReport).
+        self._psfPhotonTables = OrderedDict()  # the PSF photon tables (see _psfCached)
+        self._inverseJacobians = {}  # the inverse local WCS jacobians, keyed on the detector
+                                     # name and the cell of the image containing the object
+        self.jacobian_cell_size = 128  # The size in pixels of those cells.
+        self._pointSourceTemplate = None  # the (PSF wrapper, GSObject) drawn for point
+                                          # sources when the PSF is position-independent
+
+        self.point_source_hlr_fraction = None  # If not None, sersic and RandomWalk objects whose
+                                               # half light radius is below this fraction of the
+                                               # FWHM of the PSF are drawn as point sources.
+        self.demoted_object_count = 0  # The number of objects drawn as point sources that way.
+        self._psfFWHMs = OrderedDict()  # the FWHM of each PSF (see _psfCached)
+
+        self.interpolatedImageCache = InterpolatedImageCache()  # the InterpolatedImage profiles
+                                                                # of FitsImage objects
+        self.sersic_index_step = None  # If not None, Sersic indices are rounded to a multiple
+                                       # of this step so that the unit Sersic profiles (and
+                                       # GalSim's tables) can be reused (see unitSersicProfile).
+
+        self.photon_reservoir_size = None  # If not None, point sources drawn from that shared
+                                           # profile sample their photons from a reservoir of
+                                           # this many photons shot once per (PSF, band)
+                                           # (see photonReservoirReport).
+        self._photonReservoirs = {}
+
+        self.fft_flux_threshold = None  # If not None, objects whose realized flux in a band
+                                        # exceeds this value are drawn with
+                                        # self.bright_draw_method on a postage stamp, followed
+                                        # by Poisson noise, instead of by photon shooting.
+        self.bright_draw_method = 'fft'  # The GalSim drawing method ('fft' or 'auto') used
+                                         # for those objects.
+
         self.centroid_base_name = None
         self.centroid_handles = {}  # This dict will contain the file handles for each
                                     # centroid file where sources are found.
@@ -158,14 +311,18 @@ class GalSimInterpreter(object):
         else:
             return False
 
-    def findAllDetectors(self, gsObject, conservative_factor=10.):
+    def findAllDetectors(self, gsObject, conservative_factor=10., realized_fluxes=None,
+                         create_object=True, profiles=None):
         """
         Find all of the detectors on which a given astronomical object might cast light.
 
         Note: This is a bit conservative.  Later, once we actually have the real flux, we
         can figure out a better estimate for the stamp size to use, at which point some objects
         might not get drawn.  For now, we just use the nominal stamp size from GalSim, scaled
-        up by the factor `conservative_factor` (default=10).
+        up by the factor `conservative_factor` (default=10).  If self.flux_adaptive_footprints
+        is True and realized_fluxes are given, the footprint is instead sized by the radius at
+        which the surface brightness of the object falls below a fraction of the sky noise
+        (see fluxAdaptiveFootprintSize).
 
         @param [in] gsObject is an instantiation of the GalSimCelestialObject class
         carrying information about the object whose image is to be drawn
@@ -175,23 +332,33 @@ class GalSimInterpreter(object):
         of 10 should be fairly conservative and not waste too many cycles on things off the
         edges of detectors.
 
+        @param [in] realized_fluxes is a list of the realized fluxes of the object, one for
+        each bandpass in self.bandpassDict (optional)
+
+        @param [in] create_object is a boolean.  If False, the GalSim GSObject centered on
+        the chip is not created unless it is needed to find the size of the footprint.
+
+        @param [in] profiles is an ObjectProfiles instance holding the profiles of gsObject
+        (optional).  If given, the GSObject centered on the chip is taken from it.
+
         @param [out] outputString is a string indicating which chips the object illumines
         (suitable for the GalSim InstanceCatalog classes)
 
         @param [out] outputList is a list of detector instantiations indicating which
         detectors the object illumines
 
-        @param [out] centeredObj is a GalSim GSObject centered on the chip
+        @param [out] centeredObj is a GalSim GSObject centered on the chip (None if the
+        object illumines no detectors or create_object is False)
 
         Note: parameters that only apply to Sersic profiles will be ignored in the case of
         pointSources, etc.
         """
 
-        # create a GalSim Object centered on the chip.
-        centeredObj = self.createCenteredObject(gsObject)
+        if profiles is None:
+            profiles = ObjectProfiles(self, gsObject)
 
-        sizeArcsec = centeredObj.getGoodImageSize(1.0)  # pixel_scale = 1.0 means size is in arcsec.
-        sizeArcsec *= conservative_factor
+        sizeArcsec, centeredObj = self._footprintSize(gsObject, conservative_factor,
+                                                      realized_fluxes, profiles=profiles)
         xmax = gsObject.xPupilArcsec + sizeArcsec/2.
         xmin = gsObject.xPupilArcsec - sizeArcsec/2.
         ymax = gsObject.yPupilArcsec + sizeArcsec/2.
@@ -202,30 +369,255 @@ class GalSimInterpreter(object):
 
         # first assemble a list of detectors which have any hope
         # of overlapping the test image
-        viableDetectors = []
-        for dd in self.detectors:
-            xOverLaps = min(xmax, dd.xMaxArcsec) > max(xmin, dd.xMinArcsec)
-            yOverLaps = min(ymax, dd.yMaxArcsec) > max(ymin, dd.yMinArcsec)
-
-            if xOverLaps and yOverLaps:
-                if outputString != '':
-                    outputString += '//'
-                outputString += dd.name
-                outputList.append(dd)
+        for idet in self._detectorIndex.findDetectors(xmin, xmax, ymin, ymax):
+            dd = self.detectors[idet]
+            if outputString != '':
+                outputString += '//'
+            outputString += dd.name
+            outputList.append(dd)
 
         if outputString == '':
             outputString = None
+        elif centeredObj is None and create_object:
+            # the (expensive) PSF-convolved profile is only needed
+            # for objects which land on a detector
+            centeredObj = profiles.centeredObject()
 
         return outputString, outputList, centeredObj
 
+    def _footprintSize(self, gsObject, conservative_factor, realized_fluxes, profiles=None):
+        """
+        Return the size in arcseconds of the box around an object within which
+        to look for detectors, and the GalSim Object centered on the chip if it
+        had to be created in order to find that size (None otherwise).
+        See findAllDetectors for the parameters.
+        """
+        centeredObj = None
+        sizeArcsec = self.estimateFootprintSize(gsObject)
+        if sizeArcsec is None:
+            # create a GalSim Object centered on the chip.
+            if profiles is None:
+                centeredObj = self.createCenteredObject(gsObject)
+            else:
+                centeredObj = profiles.centeredObject()
+            sizeArcsec = centeredObj.getGoodImageSize(1.0)  # pixel_scale = 1.0 means size is in arcsec.
+
+        adaptiveSize = None
+        if self.flux_adaptive_footprints and realized_fluxes is not None:
+            adaptiveSize = self.fluxAdaptiveFootprintSize(gsObject, realized_fluxes)
+
+        if adaptiveSize is None:
+            return sizeArcsec*conservative_factor, centeredObj
+        return max(sizeArcsec, adaptiveSize), centeredObj
+
+    def fluxAdaptiveFootprintSize(self, gsObject, realized_fluxes):
+        """
+        Find the size of the region outside of which the surface brightness of an
+        object falls below self.footprint_sky_noise_fraction times the sky noise
+        per pixel in every band.
+
+        The PSF-convolved profile is not constructed: the radius is the quadrature
+        sum of the radius at which the PSF (tabulated along a ray from its center)
+        falls below that level and the radius at which the analytic Sersic profile
+        of the object (stretched by its ellipticity and lensing shears) does.
+
+        @param [in] gsObject is an instantiation of the GalSimCelestialObject class
+        carrying information about the object
+
+        @param [in] realized_fluxes is a list of the realized fluxes of the object,
+        one for each bandpass in self.bandpassDict
+
+        @param [out] the diameter of the region in arcseconds, or None if it cannot
+        be computed (no PSF, no sky level or an unsupported type of object)
+        """
+        if self.PSF is None or gsObject.galSimType not in ('pointSource', 'sersic', 'RandomWalk'):
+            return None
+
+        pixel_area = self.detectors[0].photParams.platescale**2
+        radius = 0.0
+        for bandpassName, flux in zip(self.bandpassDict, realized_fluxes):
+            if flux <= 0:
+                continue
+            sky_level = self._skyLevelPerPixel(bandpassName)
+            if sky_level is None:
+                return None
+            # the threshold as a fraction of the flux per square arcsecond
+            sb_level = self.footprint_sky_noise_fraction*np.sqrt(sky_level)/(pixel_area*flux)
+
+            psfRadius = self._psfRadius(gsObject, sb_level)
+            objRadius = 0.0
+            if gsObject.galSimType != 'pointSource':
+                objRadius = self._sersicRadius(gsObject, sb_level)
+            if objRadius is None:
+                return None
+            radius = max(radius, np.sqrt(psfRadius**2 + objRadius**2))
+
+        return 2.0*radius
+
+    def _skyLevelPerPixel(self, bandpassName):
+        """
+        Return the sky background in photons per pixel in the band bandpassName
+        (self.sky_bg_per_pixel if set, otherwise computed from the m5 and seeing
+        of self.obs_metadata), or None if it is not known.
+        """
+        if self.sky_bg_per_pixel is not None:
+            return self.sky_bg_per_pixel
+
+        if bandpassName not in self._skyLevels:
+            sky_level = None
+            if (self.obs_metadata is not None and self.obs_metadata.m5 is not None and
+                    self.obs_metadata.seeing is not None and bandpassName in self.obs_metadata.m5):
+                photParams = self.detectors[0].photParams
+                sky_level = calcSkyCountsPerPixelForM5(self.obs_metadata.m5[bandpassName],
+                                                       self.bandpassDict[bandpassName],
+                                                       FWHMeff=self.obs_metadata.seeing[bandpassName],
+                                                       photParams=photParams)*photParams.gain
+            self._skyLevels[bandpassName] = sky_level
+
+        return self._skyLevels[bandpassName]
+
+    def _psfCached(self, cache, psf, gsObject, compute):
+        """
+        Return compute(psfObj) for the GalSim profile psfObj of the PSF wrapper psf
+        at the position of gsObject, cached in the OrderedDict cache.  The value is
+        computed once per wrapper if the PSF is position-independent, and otherwise
+        once per GalSim profile returned by the wrapper, keeping the most recently
+        used self.psf_cache_size of them.
+        """
+        if psf.position_independent:
+            key = psf
+        else:
+            key = psf._getPSF(xPupil=gsObject.xPupilArcsec, yPupil=gsObject.yPupilArcsec)
+
+        # The key is stored along with the value, so that its id is not reused.
+        if id(key) in cache and cache[id(key)][0] is key:
+            entry = cache.pop(id(key))
+        else:
+            if key is psf:
+                psfObj = psf._getPSF(xPupil=gsObject.xPupilArcsec, yPupil=gsObject.yPupilArcsec)
+            else:
+                psfObj = key
+            entry = (key, compute(psfObj))
+            while len(cache) >= self.psf_cache_size:
+                cache.popitem(last=False)
+        cache[id(key)] = entry
+        return entry[1]
+
+    @staticmethod
+    def _tabulatePSF(psfObj):
+        """
+        Return the radii (arcsec) and the surface brightness of the GalSim profile
+        psfObj tabulated along a ray from its center, in order of increasing
+        surface brightness
+        """
+        rr = np.logspace(-2, np.log10(400.), 200)
+        sb = np.array([psfObj.xValue(r, 0.) for r in rr])
+        # make the profile monotonic so that it can be inverted
+        sb = np.minimum.accumulate(sb)
+        return rr[::-1], sb[::-1]
+
+    def _psfRadius(self, gsObject, sb_level):
+        """
+        Return the radius in arcseconds beyond which the PSF at the position of
+        gsObject falls below sb_level (a fraction of the total flux per square
+        arcsecond).  The profile of the PSF is tabulated the first time it is seen.
+        """
+        rr, sb = self._psfCached(self._psfProfiles, self.PSF, gsObject, self._tabulatePSF)
+        return np.interp(sb_level, sb, rr, left=rr[0], right=0.)
+
+    def _sersicRadius(self, gsObject, sb_level):
+        """
+        Return the radius in arcseconds beyond which the (PSF-free) Sersic profile of
+        gsObject falls below sb_level (a fraction of the total flux per square arcsecond),
+        along the major axis of its ellipticity and lensing shears.  RandomWalk profiles
+        are treated as Gaussians (Sersic n=0.5).  Return None for unphysical shears.
+        """
+        sindex = gsObject.sindex if gsObject.galSimType == 'sersic' else 0.5
+        sindex = min(max(float(sindex), 0.3), 6.2)
+        hlr = gsObject.halfLightRadiusArcsec
+        if hlr <= 0:
+            return 0.0
+
+        q = gsObject.minorAxisRadians/gsObject.majorAxisRadians
+        g = np.sqrt(gsObject.g1**2 + gsObject.g2**2)
+        if g >= 1.0:
+            return None
+        stretch = np.sqrt(np.abs(gsObject.mu)*(1.0+g)/((1.0-g)*q))
+
+        # The Sersic profile is I(r) = I0*exp(-b*(r/hlr)**(1/n)), with b from
+        # the asymptotic expansion of Ciotti & Bertin (1999).
+        b = 2.0*sindex - 1.0/3.0 + 4.0/(405.0*sindex) + 46.0/(25515.0*sindex**2)
+        I0 = b**(2.0*sindex)/(2.0*np.pi*sindex*math.gamma(2.0*sindex)*hlr**2)
+        if I0 <= sb_level:
+            return 0.0
+        return hlr*(np.log(I0/sb_level)/b)**sindex*stretch
+
+    def estimateFootprintSize(self, gsObject):
+        """
+        Estimate the size of the image GalSim would choose for the PSF-convolved
+        profile of an object (i.e. createCenteredObject(gsObject).getGoodImageSize(1.0))
+        without constructing the convolution.
+
+        GalSim sizes images as 2*pi/stepk, and the stepk of a convolution is
+        1/sqrt(sum(1/stepk_i**2)), so the size of the convolved profile is the
+        quadrature sum of the sizes of the PSF and of the intrinsic profile.  The
+        size of the intrinsic profile is the tabulated size of a unit half light
+        radius Sersic profile (see sersicFootprintFactor) scaled by the half light
+        radius and by the largest stretch of the ellipticity and lensing shears.
+        RandomWalk profiles are treated as Gaussians (Sersic n=0.5).  The size of a
+        composite object is the largest size of its components.
+
+        @param [in] gsObject is an instantiation of the GalSimCelestialObject class
+        carrying information about the object
+
+        @param [out] the estimated size in arcseconds, or None for the types of
+        object (e.g. FitsImage) and lensing parameters whose size cannot be
+        estimated this way
+        """
+        if gsObject.galSimType == 'composite':
+            sizes = [self.estimateFootprintSize(component) for component in gsObject.components]
+            if None in sizes:
+                return None
+            return max(sizes)
+        elif gsObject.galSimType == 'pointSource':
+            intrinsicSize = 0.0
+        elif gsObject.galSimType in ('sersic', 'RandomWalk'):
+            sindex = gsObject.sindex if gsObject.galSimType == 'sersic' else 0.5
+            q = gsObject.minorAxisRadians/gsObject.majorAxisRadians
+            g = np.sqrt(gsObject.g1**2 + gsObject.g2**2)
+            if g >= 1.0:
+                return None
+            # the largest stretch of the shear with axis ratio q, times that
+            # of the lensing reduced shear g and magnification mu
+            stretch = np.sqrt(np.abs(gsObject.mu)*(1.0+g)/((1.0-g)*q))
+            intrinsicSize = (sersicFootprintFactor(sindex)*
+                             gsObject.halfLightRadiusArcsec*stretch)
+        else:
+            return None
+
+        if self.PSF is None:
+            psfSize = 0.0
+        else:
+            psf = self.PSF._getPSF(xPupil=gsObject.xPupilArcsec, yPupil=gsObject.yPupilArcsec)
+            psfSize = psf.getGoodImageSize(1.0)
+
+        return np.sqrt(psfSize**2 + intrinsicSize**2)
+
     def blankImage(self, detector=None):
         """
         Draw a blank image associated with a specific detector.  The image will have the correct size
         for the given detector.
 
         param [in] detector is an instantiation of GalSimDetector
+
+        If self.tile_size is not None, the image is an empty GalSimTiledImage.
         """
 
+        if self.tile_size is not None:
+            return GalSimTiledImage(galsim.BoundsI(1, detector.xMaxPix-detector.xMinPix+1,
+                                                   1, detector.yMaxPix-detector.yMinPix+1),
+                                    wcs=detector.wcs, tile_size=self.tile_size)
+
         # in order to speed up the code (by a factor of ~2), this method
         # only draws a new blank image the first time it is called on a
         # given detector.  It then caches the blank images it has drawn and
@@ -241,7 +633,7 @@ class GalSimInterpreter(object):
             self.blankImageCache[detector.name] = image
             return image.copy()
 
-    def drawObject(self, gsObject):
+    def drawObject(self, gsObject, realized_fluxes=None):
         """
         Draw an astronomical object on all of the relevant FITS files.
 
@@ -249,55 +641,354 @@ class GalSimInterpreter(object):
         class carrying all of the information for the object whose image
         is to be drawn
 
+        @param [in] realized_fluxes is an optional list of the realized fluxes of
+        the object, one for each bandpass in self.bandpassDict, if they have already
+        been drawn (as by GalSimObjectSpool, to find the detectors of the object
+        before it is drawn).  Otherwise they are drawn here.
+
         @param [out] outputString is a string denoting which detectors the astronomical
         object illumines, suitable for output in the GalSim InstanceCatalog
         """
 
-        # find the detectors which the astronomical object illumines
-        outputString, \
-        detectorList, \
-        centeredObj = self.findAllDetectors(gsObject)
-
         # Make sure this object is marked as "drawn" since we only
         # care that this method has been called for this object.
         self.drawn_objects.add(gsObject.uniqueId)
 
         # Compute the realized object fluxes for each band and return
-        # if all values are zero in order to save compute.
-        fluxes = [gsObject.flux(bandpassName) for bandpassName in self.bandpassDict]
-        realized_fluxes = [galsim.PoissonDeviate(self._rng, mean=f)() for f in fluxes]
+        # if all values are zero, before any GalSim objects are created,
+        # in order to save compute.
+        if realized_fluxes is None:
+            realized_fluxes = self._realizeObjectFluxes(gsObject)
         if all([f == 0 for f in realized_fluxes]):
-            return outputString
+            return self.findAllDetectors(gsObject, create_object=False)[0]
+
+        # Faint objects are not drawn by GalSim, so their profiles
+        # need not be created.
+        faint = self._isFaint(realized_fluxes)
+
+        # find the detectors which the astronomical object illumines
+        profiles = ObjectProfiles(self, gsObject)
+        outputString, \
+        detectorList, \
+        centeredObj = self.findAllDetectors(gsObject, realized_fluxes=realized_fluxes,
+                                            create_object=not faint, profiles=profiles)
 
         if len(detectorList) == 0:
             # there is nothing to draw
             return outputString
 
+        if faint:
+            self._drawFaintObject(gsObject, realized_fluxes, detectorList)
+        else:
+            self._drawOnDetectors(gsObject, centeredObj, realized_fluxes, detectorList,
+                                  profiles=profiles)
+
+        self.write_checkpoint()
+        return outputString
+
+    def drawObjects(self, gsObjectBatch, conservative_factor=10.):
+        """
+        Draw a chunk of astronomical objects on all of the relevant FITS files.
+
+        This is equivalent to calling drawObject on each object in turn, except
+        that the flux realization, the detector lookup and the pixel coordinate
+        transformations are done for the whole chunk at once with numpy, so that
+        only the GalSim drawing calls are made object-by-object.  Objects whose
+        realized fluxes are zero in every band are looked up with their nominal
+        footprint, as in drawObject, but not drawn.
+
+        @param [in] gsObjectBatch is an instantiation of the GalSimCelestialObjectBatch
+        class carrying all of the information for the objects whose images are to
+        be drawn
+
+        @param [in] conservative_factor is the factor by which the nominal stamp size
+        is scaled up when looking for overlapping detectors (see findAllDetectors)
+
+        @param [out] outputList is a list of strings (one per object) denoting which
+        detectors each astronomical object illumines, suitable for output in the
+        GalSim InstanceCatalog
+        """
+        nobj = len(gsObjectBatch)
+        outputList = [None]*nobj
+        if nobj == 0:
+            return outputList
+
+        # Compute the realized object fluxes for each band of every object at once
+        # and only consider those objects which have any flux.
+        fluxes = np.array([gsObjectBatch.flux(bandpassName)
+                           for bandpassName in self.bandpassDict]).transpose()
+        realized_fluxes = self._realizeFluxes(fluxes, uniqueIds=gsObjectBatch.uniqueId)
+        active = realized_fluxes.sum(axis=1) > 0
+
+        # Estimate the size of the footprints of the objects (the nominal one for
+        # objects without flux); the GalSim Objects centered on the chip are only
+        # created for objects whose size cannot be estimated or which are drawn.
+        gsObjects = {}
+        profiles = {}
+        centeredObjs = {}
+        sizeArcsec = np.zeros(nobj)
+        for iobj in range(nobj):
+            gsObjects[iobj] = gsObjectBatch[iobj]
+            profiles[iobj] = ObjectProfiles(self, gsObjects[iobj])
+            sizeArcsec[iobj], centeredObj = \
+                self._footprintSize(gsObjects[iobj], conservative_factor,
+                                    realized_fluxes[iobj] if active[iobj] else None,
+                                    profiles=profiles[iobj])
+            if centeredObj is not None:
+                centeredObjs[iobj] = centeredObj
+
+        xPupil = gsObjectBatch.xPupilArcsec
+        yPupil = gsObjectBatch.yPupilArcsec
+        iBox, iDetector = self._detectorIndex.findOverlaps(xPupil - sizeArcsec/2.,
+                                                           xPupil + sizeArcsec/2.,
+                                                           yPupil - sizeArcsec/2.,
+                                                           yPupil + sizeArcsec/2.)
+
+        # Transform the pupil coordinates of all the objects to be drawn
+        # on each detector in one call.
+        pixelCoords = dict((iobj, {}) for iobj in range(nobj))
+        for idet in np.unique(iDetector):
+            detector = self.detectors[idet]
+            onDetector = iBox[(iDetector == idet) & active[iBox]]
+            if len(onDetector) == 0:
+                continue
+            xPix, yPix = detector.camera_wrapper.pixelCoordsFromPupilCoords(gsObjectBatch.xPupilRadians[onDetector],
+                                                                            gsObjectBatch.yPupilRadians[onDetector],
+                                                                            detector.name,
+                                                                            self.obs_metadata)
+            for iobj, xx, yy in zip(onDetector, xPix, yPix):
+                pixelCoords[iobj][detector.name] = (xx, yy)
+
+        # iBox is sorted, so the detectors of each object are contiguous
+        detectorLists = {}
+        boxStart = np.searchsorted(iBox, np.arange(nobj+1))
+        for iobj in range(nobj):
+            detectorLists[iobj] = [self.detectors[idet]
+                                   for idet in iDetector[boxStart[iobj]:boxStart[iobj+1]]]
+            if len(detectorLists[iobj]) > 0:
+                outputList[iobj] = '//'.join([dd.name for dd in detectorLists[iobj]])
+                if (active[iobj] and iobj not in centeredObjs and
+                        not self._isFaint(realized_fluxes[iobj])):
+                    centeredObjs[iobj] = profiles[iobj].centeredObject()
+
+        # Only the GalSim drawing is left to do object-by-object.
+        for iobj in range(nobj):
+            self.drawn_objects.add(gsObjectBatch.uniqueId[iobj])
+            if outputList[iobj] is None or not active[iobj]:
+                pass
+            elif self._isFaint(realized_fluxes[iobj]):
+                self._drawFaintObject(gsObjects[iobj], list(realized_fluxes[iobj]),
+                                      detectorLists[iobj], pixelCoords=pixelCoords[iobj])
+            else:
+                self._drawOnDetectors(gsObjects[iobj], centeredObjs[iobj],
+                                      list(realized_fluxes[iobj]), detectorLists[iobj],
+                                      pixelCoords=pixelCoords[iobj], profiles=profiles[iobj])
+            self.write_checkpoint()
+
+        return outputList
+
+    def _objectSeed(self, *key):
+        """
+        Return the 128-bit md5 hash of self._seed and key (e.g. uniqueId,
+        bandpass name and detector name) as an integer.
+        """
+        key_string = '/'.join([str(self._seed)] + [str(kk) for kk in key])
+        return int(hashlib.md5(key_string.encode('utf-8')).hexdigest(), 16)
+
+    def _objectRng(self, *key):
+        """
+        Return a galsim.UniformDeviate seeded by a hash of self._seed and key
+        (see _objectSeed).  The same key always yields the same sequence of
+        random numbers, independently of the order in which objects are drawn.
+        """
+        # GalSim takes the seed as a C long, so keep 63 bits of the hash;
+        # it seeds its generators with the system clock when given 0.
+        seed = self._objectSeed(*key) >> 65
+        return galsim.UniformDeviate(seed if seed != 0 else 1)
+
+    def _objectNumpyRng(self, *key):
+        """
+        Return a numpy RandomState seeded by all 128 bits of the hash of
+        self._seed and key (see _objectSeed)
+        """
+        seed = self._objectSeed(*key)
+        return np.random.RandomState([(seed >> (32*ii)) & 0xffffffff for ii in range(4)])
+
+    def _drawRng(self, gsObject, bandpassName, detector):
+        """
+        Return the random number generator to use when drawing gsObject
+        on detector in the band bandpassName.
+        """
+        if self.seed_per_object:
+            return self._objectRng(gsObject.uniqueId, bandpassName, detector.name)
+        return self._rng
+
+    def _realizeObjectFluxes(self, gsObject):
+        """
+        Return a list of the realized fluxes of gsObject, one for each bandpass
+        in self.bandpassDict, as drawn from the corresponding Poisson distributions.
+        """
+        fluxes = np.array([[gsObject.flux(bandpassName) for bandpassName in self.bandpassDict]])
+        return list(self._realizeFluxes(fluxes, uniqueIds=[gsObject.uniqueId])[0])
+
+    def _realizeFluxes(self, fluxes, uniqueIds=None):
+        """
+        Draw realized fluxes from the Poisson distributions whose means are given
+        by the numpy array fluxes.  All of the values are drawn in one call to
+        self._fluxRng, a numpy random number generator seeded by a hash of the seed
+        of the interpreter, so that drawing a chunk of objects at once realizes the same
+        fluxes as drawing the objects one by one.
+
+        @param [in] fluxes is a numpy array of mean fluxes of shape
+        (number of objects, number of bandpasses in self.bandpassDict)
+
+        @param [in] uniqueIds is a numpy array of the uniqueIds of the objects.
+        It is required if self.seed_per_object is True, in which case each value
+        only depends on (seed, uniqueId, bandpass), so as to match drawObject.
+        The values of all of the objects are then still drawn at once, from
+        uniform random numbers obtained by hashing those keys with a counter
+        (see hashedPoisson) rather than from a generator per object.
+
+        @param [out] a numpy array of the same shape as fluxes containing the
+        realized fluxes
+        """
+        if self.seed_per_object:
+            objectKeys = np.asarray(uniqueIds).astype(np.int64).view(np.uint64)
+            realized_fluxes = np.zeros(fluxes.shape, dtype=float)
+            for iband, bandpassName in enumerate(self.bandpassDict):
+                bandKey = np.uint64(self._objectSeed('fluxes', bandpassName) & 0xffffffffffffffff)
+                realized_fluxes[:, iband] = hashedPoisson(fluxes[:, iband],
+                                                          _mix64(objectKeys ^ bandKey))
+            return realized_fluxes
+
+        return self._fluxRng.poisson(fluxes).astype(float)
+
+    def _getPixelCoords(self, gsObject, detector, pixelCoords):
+        """
+        Return the (xPix, yPix) coordinates of gsObject on detector, using
+        the dict pixelCoords (keyed on detector name) as a cache.
+        """
+        if detector.name not in pixelCoords:
+            pixelCoords[detector.name] = \
+                detector.camera_wrapper.pixelCoordsFromPupilCoords(gsObject.xPupilRadians,
+                                                                   gsObject.yPupilRadians,
+                                                                   detector.name,
+                                                                   self.obs_metadata)
+        return pixelCoords[detector.name]
+
+    def _drawOnDetectors(self, gsObject, centeredObj, realized_fluxes, detectorList,
+                         pixelCoords=None, profiles=None):
+        """
+        Draw an astronomical object, whose detectors and realized fluxes have
+        already been determined, on the relevant FITS files.
+
+        @param [in] gsObject is an instantiation of the GalSimCelestialObject
+        class carrying all of the information for the object whose image
+        is to be drawn
+
+        @param [in] centeredObj is the GalSim GSObject centered on the chip
+        (as returned by findAllDetectors)
+
+        @param [in] realized_fluxes is a list of the realized fluxes of the object,
+        one for each bandpass in self.bandpassDict
+
+        @param [in] detectorList is a list of the GalSimDetectors on which to draw the object
+
+        @param [in] pixelCoords is an optional dict mapping detector names to the
+        (xPix, yPix) coordinates of the object on that detector.  Coordinates
+        that are not in the dict are computed as needed.
+
+        @param [in] profiles is the ObjectProfiles instance from which centeredObj
+        was taken (optional; needed for composite objects, whose profile depends on
+        the band)
+        """
+        if pixelCoords is None:
+            pixelCoords = {}
+        if profiles is None:
+            profiles = ObjectProfiles(self, gsObject, centeredObj=centeredObj)
+        self._countDemotion(gsObject)
+
         self._addNoiseAndBackground(detectorList)
 
         for bandpassName, realized_flux in zip(self.bandpassDict, realized_fluxes):
+
+            # Set the object flux to the value realized from the
+            # Poisson distribution.
+            obj = profiles.bandObject(bandpassName, realized_flux)
+
+            # The postage stamp size only depends on the object and its
+            # flux, so it is computed once per band.
+            stamp_size = None
+
             for detector in detectorList:
 
                 name = self._getFileName(detector=detector, bandpassName=bandpassName)
 
-                xPix, yPix = detector.camera_wrapper.pixelCoordsFromPupilCoords(gsObject.xPupilRadians,
-                                                                                gsObject.yPupilRadians,
-                                                                                detector.name,
-                                                                                self.obs_metadata)
-
-                # Set the object flux to the value realized from the
-                # Poisson distribution.
-                obj = centeredObj.withFlux(realized_flux)
-
-                obj.drawImage(method='phot',
-                              gain=detector.photParams.gain,
-                              offset=galsim.PositionD(xPix-detector.xCenterPix,
-                                                      yPix-detector.yCenterPix),
-                              rng=self._rng,
-                              maxN=int(1e6),
-                              image=self.detectorImages[name],
-                              poisson_flux=False,
-                              add_to_image=True)
+                xPix, yPix = self._getPixelCoords(gsObject, detector, pixelCoords)
+
+                image = self.detectorImages[name]
+                offset = galsim.PositionD(xPix-detector.xCenterPix,
+                                          yPix-detector.yCenterPix)
+
+                bright = (self.fft_flux_threshold is not None and
+                          realized_flux > self.fft_flux_threshold)
+
+                # Postage stamps of tiled images are copies of their region.
+                stamp_of_tiles = False
+
+                if self.draw_stamps or bright:
+                    if stamp_size is None:
+                        stamp_size = self.getStampSize(obj, realized_flux,
+                                                       pixel_scale=detector.photParams.platescale)
+
+                    # Position of the object on the full image; the offset
+                    # above is relative to the image's true center.
+                    image_pos = image.true_center + offset
+
+                    # Ensure the bounds of the postage stamp lie within the image.
+                    bounds = self._makeStampBounds(image_pos, stamp_size) & image.bounds
+                    if not bounds.isDefined():
+                        continue
+
+                    # offset is relative to the "true" center of the postage stamp.
+                    offset = image_pos - bounds.true_center
+                    stamp_of_tiles = isinstance(image, GalSimTiledImage)
+                    image = image[bounds]
+
+                if bright and self._drawBrightObject(obj, image, offset, detector,
+                                                     self._drawRng(gsObject, bandpassName,
+                                                                   detector)):
+                    pass
+                elif (self._pointSourceTemplate is not None and
+                      centeredObj is self._pointSourceTemplate[1]):
+                    # Shoot the photons straight from the shared point source
+                    # profile, skipping the per-object setup of drawImage.
+                    if self.photon_reservoir_size is not None:
+                        self._drawFromReservoir(centeredObj, bandpassName, realized_flux, image,
+                                                image.true_center + offset, detector,
+                                                self._numpyDrawRng(gsObject, bandpassName,
+                                                                   detector))
+                    else:
+                        self._shootPhotons(centeredObj, realized_flux, image,
+                                           image.true_center + offset, detector,
+                                           self._drawRng(gsObject, bandpassName, detector))
+                elif isinstance(image, GalSimTiledImage):
+                    # Add the photons to the tiles wherever they land, so that
+                    # none is lost outside of a postage stamp.
+                    self._shootPhotons(obj, realized_flux, image, image.true_center + offset,
+                                       detector, self._drawRng(gsObject, bandpassName, detector))
+                else:
+                    obj.drawImage(method='phot',
+                                  gain=detector.photParams.gain,
+                                  offset=offset,
+                                  rng=self._drawRng(gsObject, bandpassName, detector),
+                                  maxN=int(1e6),
+                                  image=image,
+                                  poisson_flux=False,
+                                  add_to_image=True)
+
+                if stamp_of_tiles:
+                    self.detectorImages[name].setRegion(image)
 
                 # If we are writing centroid files, store the entry.
                 if self.centroid_base_name is not None:
@@ -305,33 +996,553 @@ class GalSimInterpreter(object):
                                       gsObject.flux(bandpassName), xPix, yPix)
                     self.centroid_list.append(centroid_tuple)
 
-        self.write_checkpoint()
-        return outputString
+    def _isFaint(self, realized_fluxes):
+        """
+        Return True if an object with the given realized fluxes is to be
+        drawn with _drawFaintObject
+        """
+        # A position-dependent PSF would need a new photon table for each object,
+        # which would cost more than drawing the object with GalSim.
+        return (self.faint_flux_threshold is not None and self.PSF is not None and
+                self.PSF.position_independent and
+                max(realized_fluxes) < self.faint_flux_threshold)
+
+    def _drawFaintObject(self, gsObject, realized_fluxes, detectorList, pixelCoords=None):
+        """
+        Draw a faint astronomical object by depositing its realized number of photons
+        at positions sampled from a table of photons shot from the PSF, bypassing the
+        construction and the photon shooting of its GalSim profile.  The intrinsic
+        shape of extended objects is neglected, which is a good approximation when
+        only a few photons are drawn.  The parameters are those of _drawOnDetectors.
+        """
+        if pixelCoords is None:
+            pixelCoords = {}
+
+        self._addNoiseAndBackground(detectorList)
+
+        xPhot, yPhot = self._psfCached(self._psfPhotonTables, self.PSF, gsObject,
+                                       self._shootPhotonTable)
+
+        for bandpassName, realized_flux in zip(self.bandpassDict, realized_fluxes):
+            nPhot = int(realized_flux)
+            if nPhot == 0:
+                continue
+
+            for detector in detectorList:
+
+                name = self._getFileName(detector=detector, bandpassName=bandpassName)
+
+                xPix, yPix = self._getPixelCoords(gsObject, detector, pixelCoords)
+
+                image = self.detectorImages[name]
+                image_pos = image.true_center + galsim.PositionD(xPix-detector.xCenterPix,
+                                                                 yPix-detector.yCenterPix)
+
+                np_rng = self._numpyDrawRng(gsObject, bandpassName, detector)
+                iPhot = np_rng.randint(0, len(xPhot), size=nPhot)
+                self._addPhotons(image, image_pos, detector, xPhot[iPhot], yPhot[iPhot])
+
+                # If we are writing centroid files, store the entry.
+                if self.centroid_base_name is not None:
+                    centroid_tuple = (detector.fileName, bandpassName, gsObject.uniqueId,
+                                      gsObject.flux(bandpassName), xPix, yPix)
+                    self.centroid_list.append(centroid_tuple)
+
+        self.faint_object_stats['objects'] += 1
+        self.faint_object_stats['photons'] += int(sum(realized_fluxes))
+
+    def _shootPhotonTable(self, psfObj):
+        """
+        Return the x and y positions (arcsec) of self.faint_photon_table_size photons
+        shot from the GalSim profile psfObj of the PSF (see _drawFaintObject)
+        """
+        if self._seed is not None:
+            rng = self._objectRng('faint_table')
+        else:
+            rng = galsim.BaseDeviate()
+        photons = psfObj.shoot(int(self.faint_photon_table_size), rng)
+        return np.array(photons.x), np.array(photons.y)
+
+    def _shootPhotons(self, profile, flux, image, image_pos, detector, rng, maxN=int(1e6)):
+        """
+        Draw an object by shooting flux photons from its GalSim profile (e.g. the
+        shared point source profile, see drawPointSource) and adding them to the
+        image wherever they land.  The photons are shot in batches of at most maxN,
+        as drawImage does.
+        """
+        if rng is None:
+            rng = galsim.BaseDeviate()
+        nRemaining = int(flux)
+        while nRemaining > 0:
+            nPhot = min(nRemaining, maxN)
+            photons = profile.shoot(nPhot, rng)
+            # the photon fluxes add up to the flux of the profile
+            weights = np.array(photons.flux)*nPhot/profile.flux
+            self._addPhotons(image, image_pos, detector, np.array(photons.x),
+                             np.array(photons.y), weights=weights)
+            nRemaining -= nPhot
+
+    def _drawFromReservoir(self, template, bandpassName, flux, image, image_pos, detector, np_rng):
+        """
+        Draw a point source by recycling photons from the reservoir of the shared
+        point source profile in the band bandpassName.  Each star takes a run of
+        consecutive photons starting at a random index, rotated by a random angle
+        (a new angle each time the run wraps around the reservoir).
+        """
+        if (bandpassName not in self._photonReservoirs or
+                self._photonReservoirs[bandpassName]['template'] is not template):
+            size = int(self.photon_reservoir_size)
+            # each band gets its own photons
+            if self._seed is not None:
+                rng = self._objectRng('photon_reservoir', bandpassName)
+            else:
+                rng = galsim.BaseDeviate()
+            photons = template.shoot(size, rng)
+            self._photonReservoirs[bandpassName] = \
+                {'template': template, 'x': np.array(photons.x), 'y': np.array(photons.y),
+                 'weights': np.array(photons.flux)*size/template.flux,
+                 'draws': 0, 'photons': 0, 'overlap': 0.}
+        reservoir = self._photonReservoirs[bandpassName]
+        size = len(reservoir['x'])
+
+        nRemaining = int(flux)
+        reservoir['draws'] += 1
+        reservoir['photons'] += nRemaining
+        reservoir['overlap'] += min(float(nRemaining)/size, 1.)
+        start = np_rng.randint(0, size)
+        while nRemaining > 0:
+            nPhot = min(nRemaining, size)
+            index = (start + np.arange(nPhot)) % size
+            angle = np_rng.uniform(0., 2.*np.pi)
+            cosAngle = np.cos(angle)
+            sinAngle = np.sin(angle)
+            xPhot = cosAngle*reservoir['x'][index] - sinAngle*reservoir['y'][index]
+            yPhot = sinAngle*reservoir['x'][index] + cosAngle*reservoir['y'][index]
+            self._addPhotons(image, image_pos, detector, xPhot, yPhot,
+                             weights=reservoir['weights'][index])
+            nRemaining -= nPhot
+
+    def photonReservoirReport(self):
+        """
+        Report the use of the photon reservoirs (see self.photon_reservoir_size).
+
+        Returns
+        -------
+        dict keyed on bandpass name of dicts containing
+            size: the number of photons in the reservoir
+            draws: the number of point source draws served from it
+            photons: the total number of photons drawn from it
+            reuse: the mean number of times each photon of the reservoir was used
+            correlation: the mean of min(n/size, 1) over the draws of n photons,
+            a rough approximation of the fraction of the photons of a star that
+            are shared (up to a rotation) with another star of the same flux,
+            and so of the correlation between their photon sampling noise
+        """
+        report = {}
+        for bandpassName, reservoir in self._photonReservoirs.items():
+            size = len(reservoir['x'])
+            report[bandpassName] = {'size': size,
+                                    'draws': reservoir['draws'],
+                                    'photons': reservoir['photons'],
+                                    'reuse': float(reservoir['photons'])/size,
+                                    'correlation': reservoir['overlap']/max(reservoir['draws'], 1)}
+        return report
+
+    def faintObjectReport(self):
+        """
+        Report the drawing of faint objects from the PSF photon table
+        (see self.faint_flux_threshold).
+
+        Returns
+        -------
+        dict containing
+            objects: the number of objects drawn from the table
+            photons: the total number of photons drawn from it
+            size: the number of photons in the tables (0 if none has been shot)
+            reuse: the mean number of times each photon of the tables was used
+        """
+        size = sum(len(table[0]) for key, table in self._psfPhotonTables.values())
+        return {'objects': self.faint_object_stats['objects'],
+                'photons': self.faint_object_stats['photons'],
+                'size': size,
+                'reuse': float(self.faint_object_stats['photons'])/max(size, 1)}
+
+    def _numpyDrawRng(self, gsObject, bandpassName, detector):
+        """
+        Return the numpy random number generator to use when sampling photons
+        for gsObject on detector in the band bandpassName.
+        """
+        if self.seed_per_object:
+            return self._objectNumpyRng(gsObject.uniqueId, bandpassName, detector.name)
+        return self._photonRng
+
+    def _addPhotons(self, image, image_pos, detector, xPhot, yPhot, weights=None):
+        """
+        Add photons to an image.
+
+        @param [in] image is the galsim.Image (or a view into it) or the
+        GalSimTiledImage onto which the photons are added
+
+        @param [in] image_pos is the galsim.PositionD of the object on the image
+
+        @param [in] detector is the GalSimDetector of the image
+
+        @param [in] xPhot, yPhot are numpy arrays of the positions of the photons
+        relative to the object in arcseconds (in the u, v frame of the WCS)
+
+        @param [in] weights is an optional numpy array of the number of photons
+        carried by each position (default 1)
+        """
+        # Transform the positions from arcseconds to pixels with the local WCS at
+        # the position of the object.  The jacobians are cached at the centers of
+        # cells of self.jacobian_cell_size pixels, across which the WCS varies too
+        # little to matter over the extent of a point source.
+        cell_size = self.jacobian_cell_size
+        key = (detector.name, int(image_pos.x//cell_size), int(image_pos.y//cell_size))
+        if key not in self._inverseJacobians:
+            cell_center = galsim.PositionD((key[1] + 0.5)*cell_size, (key[2] + 0.5)*cell_size)
+            self._inverseJacobians[key] = \
+                np.array(detector.wcs.jacobian(image_pos=cell_center).inverse().getMatrix())
+        jac = self._inverseJacobians[key]
+
+        xx = image_pos.x + jac[0][0]*xPhot + jac[0][1]*yPhot
+        yy = image_pos.y + jac[1][0]*xPhot + jac[1][1]*yPhot
+
+        ix = np.floor(xx + 0.5).astype(int)
+        iy = np.floor(yy + 0.5).astype(int)
+
+        values = 1.0/detector.photParams.gain
+        if isinstance(image, GalSimTiledImage):
+            if weights is not None:
+                values = weights*values
+            image.accumulate(ix, iy, values)
+            return
+
+        ix -= image.xmin
+        iy -= image.ymin
+        onImage = np.where((ix >= 0) & (ix < image.array.shape[1]) &
+                           (iy >= 0) & (iy < image.array.shape[0]))
+
+        if weights is not None:
+            values = weights[onImage]*values
+        np.add.at(image.array, (iy[onImage], ix[onImage]), values)
+
+    def _drawBrightObject(self, obj, image, offset, detector, rng):
+        """
+        Draw a bright object onto a postage stamp with self.bright_draw_method
+        rather than by photon shooting, so that the cost is set by the area of
+        the stamp rather than by the number of photons.  The photon noise is
+        restored by applying Poisson noise to the (noiseless) stamp.
+
+        @param [in] obj is the GalSim GSObject, with its realized flux
+
+        @param [in] image is the postage stamp (a view into the detector image)
+        onto which the object is added
+
+        @param [in] offset is the offset of the object from the true center of image
+
+        @param [in] detector is the GalSimDetector
+
+        @param [in] rng is the random number generator for the Poisson noise
+
+        @param [out] True if the object was drawn; False if GalSim could not draw
+        it this way (e.g. because the FFT would be too large), in which case the
+        caller should fall back to photon shooting.
+        """
+        stamp = image.copy()
+        stamp.setZero()
+        try:
+            obj.drawImage(method=self.bright_draw_method,
+                          offset=offset,
+                          image=stamp)
+        except RuntimeError:
+            return False
+
+        # FFT ringing can leave small negative values, which are not valid
+        # Poisson means.
+        stamp.array[stamp.array < 0] = 0
+        stamp.addNoise(galsim.PoissonNoise(rng))
+        image.array[:] += stamp.array/detector.photParams.gain
+        return True
+
+    def getStampSize(self, obj, flux, pixel_scale=0.2):
+        """
+        Get the size of the postage stamp onto which a (non-sensor) object
+        is drawn when self.draw_stamps is True.  GalSim's nominal image size
+        is used, except for bright objects, for which the stamp is extended
+        out to self.stamp_keep_sb_level.
+
+        Parameters
+        ----------
+        obj: galsim.GSObject
+            The PSF-convolved object to be drawn, with its flux set.
+        flux: float
+            The flux of the object in e-.
+        pixel_scale: float [0.2]
+            The CCD pixel scale in arcsec.
+
+        Returns
+        -------
+        int: The length N of the desired NxN postage stamp.
+        """
+        if flux < 10:
+            # For really faint things, don't try too hard.  Just use 32x32.
+            return 32
+
+        image_size = obj.getGoodImageSize(pixel_scale)
+
+        # For bright things, defined as having an average of at least 10 photons per
+        # pixel on average, try to be careful about not truncating the surface brightness
+        # at the edge of the box.
+        if flux > 10 * image_size**2:
+            image_size = getGoodPhotImageSize(obj, self.stamp_keep_sb_level,
+                                              pixel_scale=pixel_scale)
+
+        return image_size
+
+    @staticmethod
+    def _makeStampBounds(image_pos, image_size):
+        """
+        Return the galsim.BoundsI of a postage stamp of size image_size
+        centered on the galsim.PositionD image_pos.
+        """
+        xmin = int(math.floor(image_pos.x) - image_size/2)
+        xmax = int(math.ceil(image_pos.x) + image_size/2)
+        ymin = int(math.floor(image_pos.y) - image_size/2)
+        ymax = int(math.ceil(image_pos.y) + image_size/2)
+
+        return galsim.BoundsI(xmin, xmax, ymin, ymax)
 
     def _addNoiseAndBackground(self, detectorList):
         """
         Go through the list of detector/bandpass combinations and
         initialize all of the FITS files we will need (if they have
         not already been initialized)
+
+        The sky background and noise of tiled images (see self.tile_size)
+        are not added here, but when the images are written (see _finalImage).
         """
         for detector in detectorList:
+            if detector.name in self.released_detectors:
+                raise RuntimeError("Cannot draw on detector %s; its images have already "
+                                   "been written (see writeDetectorImages)" % detector.name)
             for bandpassName in self.bandpassDict:
                 name = self._getFileName(detector=detector, bandpassName=bandpassName)
+                if name in self._releasedImages:
+                    raise RuntimeError("Cannot draw on %s; it has already been written "
+                                       "(see writeImages)" % name)
+                if name in self._snapshots:
+                    # the image is about to differ from its checkpoint snapshot
+                    self._retireFile(self._snapshots.pop(name))
+                if self.image_memory_limit is not None:
+                    if name in self.detectorImages:
+                        self.image_memory_stats['hits'] += 1
+                    elif name in self._spilledImages:
+                        # A checkpoint may still refer to the scratch file.
+                        self.image_memory_stats['misses'] += 1
+                        self.detectorImages[name] = self._readSpilledImage(name)
+                        self._retireFile(self._spilledImages.pop(name)[0])
+                    self._imageUsage.pop(name, None)
+                    self._imageUsage[name] = detector
                 if name not in self.detectorImages:
-                    self.detectorImages[name] = self.blankImage(detector=detector)
+                    self.detectorImages[name] = self._allocateImage(detector, name)
                     if self.noiseWrapper is not None:
+                        if isinstance(self.detectorImages[name], GalSimTiledImage):
+                            self._deferredNoise[name] = (detector, bandpassName)
+                            continue
+
+                        rng = None
+                        if self.seed_per_object:
+                            rng = self._objectRng('noise', detector.name, bandpassName)
+
                         # Add sky background and noise to the image
-                        self.detectorImages[name] = \
-                            self.noiseWrapper.addNoiseAndBackground(self.detectorImages[name],
-                                                                    bandpass=self.bandpassDict[bandpassName],
-                                                                    m5=self.obs_metadata.m5[bandpassName],
-                                                                    FWHMeff=self.
-                                                                    obs_metadata.seeing[bandpassName],
-                                                                    photParams=detector.photParams,
-                                                                    detector=detector)
+                        image = self._noiseAndBackground(self.detectorImages[name], detector,
+                                                         bandpassName, rng=rng)
+                        if name in self._memmaps:
+                            self.detectorImages[name].array[:] = image.array
+                        else:
+                            self.detectorImages[name] = image
 
                         self.write_checkpoint(force=True, object_list=set())
 
+        if self.image_memory_limit is not None:
+            self._limitImageMemory(keep=set(self._getFileName(detector=detector,
+                                                              bandpassName=bandpassName)
+                                            for detector in detectorList
+                                            for bandpassName in self.bandpassDict))
+
+    def _imageBytes(self, name):
+        """
+        Return the number of bytes of memory occupied by the pixels of the
+        image of the FITS file called name (zero if they are memory-mapped)
+        """
+        image = self.detectorImages[name]
+        if name in self._memmaps:
+            return 0
+        if isinstance(image, GalSimTiledImage):
+            return image.nbytes
+        return image.array.nbytes
+
+    def _limitImageMemory(self, keep):
+        """
+        Spill the least recently drawn images to disk until the images left in memory
+        fit within self.image_memory_limit, sparing those whose file names are in keep
+        (the images being drawn on).
+        """
+        nbytes = sum(self._imageBytes(name) for name in self.detectorImages)
+        for name in list(self._imageUsage):
+            if nbytes <= self.image_memory_limit:
+                break
+            if name in keep or name in self._memmaps:
+                continue
+            nbytes -= self._imageBytes(name)
+            self._spillImage(name)
+
+    def _imagePixels(self, name):
+        """
+        Return the pixels of the image of the FITS file called name in a picklable
+        form: a numpy array, or the tile size and tiles of a GalSimTiledImage
+        """
+        image = self.detectorImages[name]
+        if isinstance(image, GalSimTiledImage):
+            return (image.tile_size, image.tiles)
+        return image.array
+
+    def _rebuildImage(self, detector, pixels):
+        """
+        Return the image of detector holding pixels (as returned by _imagePixels)
+        """
+        if isinstance(pixels, tuple):
+            tile_size, tiles = pixels
+            image = GalSimTiledImage(galsim.BoundsI(1, detector.xMaxPix-detector.xMinPix+1,
+                                                    1, detector.yMaxPix-detector.yMinPix+1),
+                                     wcs=detector.wcs, tile_size=tile_size)
+            image.tiles = tiles
+            return image
+        image = galsim.Image(detector.xMaxPix-detector.xMinPix+1, detector.yMaxPix-detector.yMinPix+1,
+                             wcs=detector.wcs, dtype=pixels.dtype)
+        image.array[:] = pixels
+        return image
+
+    def _spillImage(self, name):
+        """
+        Write the image of the FITS file called name to a new compressed scratch
+        file and remove it from memory
+        """
+        # Each spill goes to a file of its own, since a checkpoint
+        # may refer to the file of an earlier spill of the image.
+        if self.image_scratch_dir is not None:
+            spill_dir = self.image_scratch_dir
+        else:
+            if self._spillDir is None:
+                self._spillDir = tempfile.mkdtemp(prefix='galsim_images_')
+            spill_dir = self._spillDir
+        fd, file_name = tempfile.mkstemp(prefix=os.path.splitext(name)[0] + '_',
+                                         suffix='.pkl.gz', dir=spill_dir)
+        with os.fdopen(fd, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=1) as output:
+                pickle.dump(self._imagePixels(name), output, protocol=pickle.HIGHEST_PROTOCOL)
+
+        self._spilledImages[name] = (file_name, self._imageUsage.pop(name))
+        del self.detectorImages[name]
+        self.image_memory_stats['spills'] += 1
+
+    def _readSpilledImage(self, name):
+        """
+        Return the image of the FITS file called name read back from its scratch
+        file (see _spillImage)
+        """
+        file_name, detector = self._spilledImages[name]
+        with gzip.open(file_name, 'rb') as input_:
+            return self._rebuildImage(detector, pickle.load(input_))
+
+    def _allocateImage(self, detector, name):
+        """
+        Return a new blank image (see blankImage) for the FITS file called name of
+        detector.  If self.image_scratch_dir is set, its pixels are memory-mapped from
+        a new file in that directory (see memmapImage).
+        """
+        if self.image_scratch_dir is None or self.tile_size is not None:
+            return self.blankImage(detector=detector)
+
+        file_name = os.path.join(self.image_scratch_dir, os.path.splitext(name)[0] + '.dat')
+        image, self._memmaps[name] = memmapImage(file_name,
+                                                 detector.xMaxPix-detector.xMinPix+1,
+                                                 detector.yMaxPix-detector.yMinPix+1,
+                                                 wcs=detector.wcs)
+        return image
+
+    def _releaseImage(self, name):
+        """
+        Forget the image of the FITS file called name, deleting its memory-mapped
+        file or scratch file if it has one
+        """
+        self.detectorImages.pop(name, None)
+        self._deferredNoise.pop(name, None)
+        self._imageUsage.pop(name, None)
+        if name in self._spilledImages:
+            self._retireFile(self._spilledImages.pop(name)[0])
+        if name in self._memmaps:
+            file_name = self._memmaps.pop(name).filename
+            os.remove(file_name)
+        if name in self._snapshots:
+            self._retireFile(self._snapshots.pop(name))
+
+    def _retireFile(self, file_name):
+        """
+        Delete a scratch file which is no longer in use: at once if there is
+        no checkpoint file, or else once a checkpoint which does not refer to
+        it has been written (see write_checkpoint)
+        """
+        if self.checkpoint_file is not None:
+            self._retiredFiles.add(file_name)
+        elif os.path.exists(file_name):
+            os.remove(file_name)
+
+    def _noiseAndBackground(self, image, detector, bandpassName, rng=None):
+        """
+        Return a copy of image, belonging to detector in the band bandpassName,
+        with the sky background and noise of self.noiseWrapper added to it.
+        If rng is not None, the noise is drawn from it rather than from the
+        random numbers of self.noiseWrapper, which is left untouched.
+        """
+        noiseWrapper = self.noiseWrapper
+        if rng is not None:
+            noiseWrapper = copy.copy(noiseWrapper)
+            noiseWrapper.randomNumbers = rng
+        return noiseWrapper.addNoiseAndBackground(image,
+                                                       bandpass=self.bandpassDict[bandpassName],
+                                                       m5=self.obs_metadata.m5[bandpassName],
+                                                       FWHMeff=self.obs_metadata.seeing[bandpassName],
+                                                       photParams=detector.photParams,
+                                                       detector=detector)
+
+    def _finalImage(self, name):
+        """
+        Return the galsim.Image to be written to the FITS file called name.
+        Tiled images are assembled, with their sky background and noise added
+        tile by tile; the noise of each tile only depends on the sky, as if it
+        had been added before any object was drawn.  Spilled images are read
+        back, but stay spilled.
+        """
+        if name in self._spilledImages:
+            image = self._readSpilledImage(name)
+        else:
+            image = self.detectorImages[name]
+        if not isinstance(image, GalSimTiledImage):
+            return image
+
+        if name not in self._deferredNoise:
+            return image.toImage()
+
+        detector, bandpassName = self._deferredNoise[name]
+        rng = None
+        if self.seed_per_object:
+            rng = self._objectRng('noise', detector.name, bandpassName)
+        return image.toImage(tile_function=lambda tile: self._noiseAndBackground(tile, detector,
+                                                                                 bandpassName,
+                                                                                 rng=rng))
+
     def drawPointSource(self, gsObject, psf=None):
         """
         Draw an image of a point source.
@@ -346,9 +1557,16 @@ class GalSimInterpreter(object):
                 raise RuntimeError("Cannot draw a point source in GalSim without a PSF")
             psf = self.PSF
 
+        # All point sources share the same profile if the PSF does not depend
+        # on position, so build it once.
+        if psf is self.PSF and psf.position_independent:
+            if self._pointSourceTemplate is None or self._pointSourceTemplate[0] is not psf:
+                self._pointSourceTemplate = (psf, psf.applyPSF(xPupil=0., yPupil=0.))
+            return self._pointSourceTemplate[1]
+
         return psf.applyPSF(xPupil=gsObject.xPupilArcsec, yPupil=gsObject.yPupilArcsec)
 
-    def drawSersic(self, gsObject, psf=None):
+    def drawSersic(self, gsObject, psf=None, intrinsic=None):
         """
         Draw the image of a Sersic profile.
 
@@ -356,14 +1574,39 @@ class GalSimInterpreter(object):
         carrying information about the object whose image is to be drawn
 
         @param [in] psf PSF to use for the convolution.  If None, then use self.PSF.
+
+        @param [in] intrinsic is the profile of the object before the PSF is applied,
+        if it has already been built (see createIntrinsicObject)
         """
 
         if psf is None:
             psf = self.PSF
 
+        if intrinsic is None:
+            centeredObj = self._sersicProfile(gsObject)
+        else:
+            centeredObj = intrinsic
+
+        # Apply the PSF.
+        if psf is not None:
+            centeredObj = psf.applyPSF(xPupil=gsObject.xPupilArcsec,
+                                       yPupil=gsObject.yPupilArcsec,
+                                       obj=centeredObj)
+
+        return centeredObj
+
+    def _sersicProfile(self, gsObject):
+        """
+        Return the Sersic profile of gsObject before the PSF is applied
+        (see drawSersic).
+        """
         # create a Sersic profile
-        centeredObj = galsim.Sersic(n=float(gsObject.sindex),
-                                    half_light_radius=float(gsObject.halfLightRadiusArcsec))
+        if self.sersic_index_step is not None:
+            centeredObj = unitSersicProfile(gsObject.sindex, self.sersic_index_step)
+            centeredObj = centeredObj.dilate(float(gsObject.halfLightRadiusArcsec))
+        else:
+            centeredObj = galsim.Sersic(n=float(gsObject.sindex),
+                                        half_light_radius=float(gsObject.halfLightRadiusArcsec))
 
         # Turn the Sersic profile into an ellipse
         centeredObj = centeredObj.shear(q=gsObject.minorAxisRadians/gsObject.majorAxisRadians,
@@ -372,15 +1615,9 @@ class GalSimInterpreter(object):
         # Apply weak lensing distortion.
         centeredObj = centeredObj.lens(gsObject.g1, gsObject.g2, gsObject.mu)
 
-        # Apply the PSF.
-        if psf is not None:
-            centeredObj = psf.applyPSF(xPupil=gsObject.xPupilArcsec,
-                                       yPupil=gsObject.yPupilArcsec,
-                                       obj=centeredObj)
-
         return centeredObj
 
-    def drawRandomWalk(self, gsObject, psf=None):
+    def drawRandomWalk(self, gsObject, psf=None, intrinsic=None):
         """
         Draw the image of a RandomWalk light profile. In orider to allow for
         reproducibility, the specific realisation of the random walk is seeded
@@ -390,9 +1627,31 @@ class GalSimInterpreter(object):
         carrying information about the object whose image is to be drawn
 
         @param [in] psf PSF to use for the convolution.  If None, then use self.PSF.
+
+        @param [in] intrinsic is the profile of the object before the PSF is applied,
+        if it has already been built (see createIntrinsicObject)
+        """
+        if psf is None:
+            psf = self.PSF
+
+        if intrinsic is None:
+            centeredObj = self._randomWalkProfile(gsObject)
+        else:
+            centeredObj = intrinsic
+
+        # Apply the PSF.
+        if psf is not None:
+            centeredObj = psf.applyPSF(xPupil=gsObject.xPupilArcsec,
+                                       yPupil=gsObject.yPupilArcsec,
+                                       obj=centeredObj)
+
+        return centeredObj
+
+    def _randomWalkProfile(self, gsObject):
+        """
+        Return the RandomWalk profile of gsObject before the PSF is applied
+        (see drawRandomWalk).
         """
-        if psf is None:
-            psf = self.PSF
         # Seeds the random walk with the object id if available
         if gsObject.uniqueId is None:
             rng = None
@@ -411,15 +1670,9 @@ class GalSimInterpreter(object):
         # Apply weak lensing distortion.
         centeredObj = centeredObj.lens(gsObject.g1, gsObject.g2, gsObject.mu)
 
-        # Apply the PSF.
-        if psf is not None:
-            centeredObj = psf.applyPSF(xPupil=gsObject.xPupilArcsec,
-                                       yPupil=gsObject.yPupilArcsec,
-                                       obj=centeredObj)
-
         return centeredObj
 
-    def drawFitsImage(self, gsObject, psf=None):
+    def drawFitsImage(self, gsObject, psf=None, intrinsic=None):
         """
         Draw the image of a FitsImage light profile.
 
@@ -427,19 +1680,63 @@ class GalSimInterpreter(object):
         carrying information about the object whose image is to be drawn
 
         @param [in] psf PSF to use for the convolution.  If None, then use self.PSF.
+
+        @param [in] intrinsic is the profile of the object before the PSF is applied,
+        if it has already been built (see createIntrinsicObject)
         """
         if psf is None:
             psf = self.PSF
 
+        if intrinsic is None:
+            centeredObj = self._fitsImageProfile(gsObject)
+        else:
+            centeredObj = intrinsic
+
+        # Apply the PSF
+        if psf is not None:
+            centeredObj = psf.applyPSF(xPupil=gsObject.xPupilArcsec,
+                                       yPupil=gsObject.yPupilArcsec,
+                                       obj=centeredObj)
+
+        return centeredObj
+
+    def _fitsImageProfile(self, gsObject):
+        """
+        Return the InterpolatedImage profile of gsObject before the PSF is applied
+        (see drawFitsImage).
+        """
         # Create the galsim.InterpolatedImage profile from the FITS image.
-        centeredObj = galsim.InterpolatedImage(gsObject.fits_image_file,
-                                               scale=gsObject.pixel_scale)
+        centeredObj = self.interpolatedImageCache.get(gsObject.fits_image_file,
+                                                      gsObject.pixel_scale)
         if gsObject.rotation_angle != 0:
             centeredObj = centeredObj.rotate(gsObject.rotation_angle*galsim.degrees)
 
         # Apply weak lensing distortion.
         centerObject = centeredObj.lens(gsObject.g1, gsObject.g2, gsObject.mu)
 
+        return centeredObj
+
+    def drawComposite(self, gsObject, psf=None, intrinsic=None):
+        """
+        Draw the image of a composite object (e.g. the bulge, disk and knots
+        of a galaxy) as the sum of its components convolved with the PSF.
+
+        @param [in] gsObject is an instantiation of the GalSimCompositeObject class
+        carrying information about the object whose image is to be drawn
+
+        @param [in] psf PSF to use for the convolution.  If None, then use self.PSF.
+
+        @param [in] intrinsic is the profile of the object before the PSF is applied,
+        if it has already been built (see createIntrinsicObject and _compositeProfile)
+        """
+        if psf is None:
+            psf = self.PSF
+
+        if intrinsic is None:
+            centeredObj = self._compositeProfile(gsObject)
+        else:
+            centeredObj = intrinsic
+
         # Apply the PSF
         if psf is not None:
             centeredObj = psf.applyPSF(xPupil=gsObject.xPupilArcsec,
@@ -448,7 +1745,71 @@ class GalSimInterpreter(object):
 
         return centeredObj
 
-    def createCenteredObject(self, gsObject, psf=None):
+    def _compositeProfile(self, gsObject, bandpassName=None, components=None):
+        """
+        Return the galsim.Sum of the components of a composite object before the
+        PSF is applied, with unit total flux.  Each component is weighted by its
+        share of the flux of the object in bandpassName (or, if bandpassName is
+        None, of the flux summed over all of the bands).
+
+        @param [in] components is the list of the profiles of the components before
+        the PSF is applied, if they have already been built (point sources are
+        represented by a galsim.DeltaFunction)
+        """
+        if components is None:
+            components = [self._componentProfile(component)
+                          for component in gsObject.components]
+
+        if bandpassName is None:
+            fluxes = [sum([component.flux(name) for name in self.bandpassDict])
+                      for component in gsObject.components]
+        else:
+            fluxes = [component.flux(bandpassName) for component in gsObject.components]
+
+        total = float(sum(fluxes))
+        if total <= 0:
+            fluxes = [1.0]*len(components)
+            total = float(len(components))
+
+        return galsim.Sum([profile.withFlux(flux/total)
+                           for profile, flux in zip(components, fluxes)])
+
+    def _componentProfile(self, component):
+        """
+        Return the profile of one component of a composite object before the PSF
+        is applied (a galsim.DeltaFunction for point sources)
+        """
+        profile = self.createIntrinsicObject(component)
+        if profile is None:
+            profile = galsim.DeltaFunction()
+        return profile
+
+    def createIntrinsicObject(self, gsObject):
+        """
+        Create the centered GalSim Object of an extended object before the PSF is
+        applied.  It can be passed to createCenteredObject to build the PSF-convolved
+        profile for several PSFs without rebuilding it.
+
+        @param [in] gsObject is an instantiation of the GalSimCelestialObject class
+        carrying information about the object whose image is to be drawn
+
+        @param [out] the GalSim GSObject (None for point sources)
+        """
+        if gsObject.galSimType == 'composite':
+            return self._compositeProfile(gsObject)
+        elif gsObject.galSimType == 'sersic':
+            return self._sersicProfile(gsObject)
+        elif gsObject.galSimType == 'RandomWalk':
+            return self._randomWalkProfile(gsObject)
+        elif gsObject.galSimType == 'FitsImage':
+            return self._fitsImageProfile(gsObject)
+        elif gsObject.galSimType == 'pointSource':
+            return None
+
+        raise RuntimeError("Apologies: the GalSimInterpreter does not yet have a method to draw " +
+                           gsObject.galSimType + " objects")
+
+    def createCenteredObject(self, gsObject, psf=None, intrinsic=None):
         """
         Create a centered GalSim Object (i.e. if we were just to draw this object as an image,
         the object would be centered on the frame)
@@ -458,19 +1819,31 @@ class GalSimInterpreter(object):
 
         Note: parameters that obviously only apply to Sersic profiles will be ignored in the case
         of point sources
+
+        If self.point_source_hlr_fraction is set, extended objects which are much smaller
+        than the PSF are drawn as point sources (see _isPointLike).
+
+        @param [in] intrinsic is the profile of the object before the PSF is applied
+        (as returned by createIntrinsicObject), if it has already been built
         """
 
-        if gsObject.galSimType == 'sersic':
-            centeredObj = self.drawSersic(gsObject, psf=psf)
+        if gsObject.galSimType in ('sersic', 'RandomWalk') and self._isPointLike(gsObject, psf):
+            centeredObj = self.drawPointSource(gsObject, psf=psf)
+
+        elif gsObject.galSimType == 'sersic':
+            centeredObj = self.drawSersic(gsObject, psf=psf, intrinsic=intrinsic)
 
         elif gsObject.galSimType == 'pointSource':
             centeredObj = self.drawPointSource(gsObject, psf=psf)
 
         elif gsObject.galSimType == 'RandomWalk':
-            centeredObj = self.drawRandomWalk(gsObject, psf=psf)
+            centeredObj = self.drawRandomWalk(gsObject, psf=psf, intrinsic=intrinsic)
 
         elif gsObject.galSimType == 'FitsImage':
-            centeredObj = self.drawFitsImage(gsObject, psf=psf)
+            centeredObj = self.drawFitsImage(gsObject, psf=psf, intrinsic=intrinsic)
+
+        elif gsObject.galSimType == 'composite':
+            centeredObj = self.drawComposite(gsObject, psf=psf, intrinsic=intrinsic)
 
         else:
             raise RuntimeError("Apologies: the GalSimInterpreter does not yet have a method to draw " +
@@ -478,6 +1851,32 @@ class GalSimInterpreter(object):
 
         return centeredObj
 
+    def _isPointLike(self, gsObject, psf=None):
+        """
+        Return True if the half light radius of gsObject is smaller than
+        self.point_source_hlr_fraction times the FWHM of the PSF (self.PSF if
+        psf is None), in which case its PSF-convolved image is indistinguishable
+        from that of a point source.
+        """
+        if self.point_source_hlr_fraction is None:
+            return False
+        if psf is None:
+            psf = self.PSF
+        if psf is None:
+            return False
+
+        fwhm = self._psfCached(self._psfFWHMs, psf, gsObject, lambda psfObj: psfObj.calculateFWHM())
+        return gsObject.halfLightRadiusArcsec < self.point_source_hlr_fraction*fwhm
+
+    def _countDemotion(self, gsObject):
+        """
+        Count gsObject in self.demoted_object_count if it is drawn as a point
+        source (see _isPointLike).  This is called once for each object drawn,
+        whereas createCenteredObject may be called several times per object.
+        """
+        if gsObject.galSimType in ('sersic', 'RandomWalk') and self._isPointLike(gsObject):
+            self.demoted_object_count += 1
+
     def writeImages(self, nameRoot=None):
         """
         Write the FITS files to disk.
@@ -490,19 +1889,139 @@ class GalSimInterpreter(object):
         nameRoot_detectorName_bandpassName.fits
 
         myImages_R_0_0_S_1_1_y.fits is an example of an image for an LSST-like camera with
-        nameRoot = 'myImages'
+        nameRoot = 'myImages' (myImages_R_0_0_S_1_1_y.fits.fz if self.image_compression
+        is set)
+
+        Every image is released once written (deleting its memory-mapped file or
+        scratch file if it has one), however it is stored, so that no more objects
+        can be drawn on it and writing the images again writes nothing.
         """
+        names = list(self.detectorImages) + list(self._spilledImages)
         namesWritten = []
-        for name in self.detectorImages:
-            if nameRoot is not None:
-                fileName = nameRoot+'_'+name
-            else:
-                fileName = name
-            self.detectorImages[name].write(file_name=fileName)
+        for name in names:
+            fileName = self._outputFileName(name, nameRoot)
+            self._writeImage(self._finalImage(name), fileName)
             namesWritten.append(fileName)
 
+        if self.image_writer is not None:
+            self.image_writer.close()
+
+        if len(names) > 0:
+            for name in names:
+                self._releaseImage(name)
+                self._releasedImages.add(name)
+            self.write_checkpoint(force=True)
+        if self._spillDir is not None and len(os.listdir(self._spillDir)) == 0:
+            os.rmdir(self._spillDir)
+            self._spillDir = None
+        return namesWritten
+
+    def _writeImage(self, image, fileName, callback=None):
+        """
+        Write image to the FITS file fileName, through self.image_writer if
+        there is one (in which case the file may not have been written yet on
+        return), then call callback(fileName) if callback is not None
+        """
+        if self.image_writer is not None:
+            self.image_writer.write(image, fileName, callback=callback,
+                                    compression=self.image_compression,
+                                    quantization=self.image_quantization)
+            return
+        writeFitsImage(image, fileName, compression=self.image_compression,
+                       quantization=self.image_quantization)
+        if callback is not None:
+            callback(fileName)
+
+    def writeDetectorImages(self, detector, nameRoot=None):
+        """
+        Write the FITS files of one detector (in every band) to disk and release
+        its images.  No more objects can be drawn on the detector afterwards.
+        self.detector_callback is then called (see finishDetector), once the
+        files have been written if they are written by self.image_writer.
+        In that case, the files may not have been written on return: the caller
+        must call self.image_writer.close() once the last detector has been
+        written, to wait for them and raise any error met while writing them.
+
+        @param [in] detector is the GalSimDetector whose images are to be written
+
+        @param [in] nameRoot is a string that will be prepended to the names of
+        the output FITS files (see writeImages)
+
+        @param [out] namesWritten is a list of the names of the FITS files written
+        (empty if the detector had already been released)
+        """
+        namesWritten = []
+        if detector.name in self.released_detectors:
+            return namesWritten
+
+        self.blankImageCache.pop(detector.name, None)
+        self.released_detectors.add(detector.name)
+
+        names = []
+        for bandpassName in self.bandpassDict:
+            name = self._getFileName(detector=detector, bandpassName=bandpassName)
+            if name in self.detectorImages or name in self._spilledImages:
+                names.append(name)
+                namesWritten.append(self._outputFileName(name, nameRoot))
+
+        remaining = set(namesWritten)
+
+        def written(fileName):
+            remaining.discard(fileName)
+            if len(remaining) == 0 and self.detector_callback is not None:
+                self.detector_callback(detector, namesWritten)
+
+        for name, fileName in zip(names, namesWritten):
+            self._writeImage(self._finalImage(name), fileName, callback=written)
+            self._releaseImage(name)
+
+        if len(namesWritten) == 0 and self.detector_callback is not None:
+            self.detector_callback(detector, namesWritten)
+
+        if self.checkpoint_file is not None:
+            # Record at once that the detector is finished, so that a restored
+            # run neither draws on it again nor refers to its deleted files.
+            if self.image_writer is not None:
+                self.image_writer.flush()
+            self.write_checkpoint(force=True)
         return namesWritten
 
+    def finishDetector(self, detector, nameRoot=None):
+        """
+        Declare that no more objects will land on a detector (e.g. because the
+        input catalog is sorted on position, or has been routed to the detectors
+        beforehand), so that its images are finished at once rather than by
+        writeImages at the end of the run: the deferred sky background and noise
+        of tiled images are added, the FITS files are written, the images are
+        released and self.detector_callback is called.  If there is a
+        self.image_writer, the caller must call self.image_writer.close() once
+        the last detector has been finished (see writeDetectorImages).
+
+        @param [in] detector is the GalSimDetector or the name of the detector
+
+        @param [in] nameRoot is a string that will be prepended to the names of
+        the output FITS files (see writeImages)
+
+        @param [out] namesWritten is a list of the names of the FITS files written
+        (empty if no object was drawn on the detector)
+        """
+        name = getattr(detector, 'name', detector)
+        matches = [dd for dd in self.detectors if dd.name == name]
+        if len(matches) == 0:
+            raise RuntimeError("Cannot finish detector %s; it is not one of the detectors "
+                               "of the GalSimInterpreter" % str(name))
+        if name in self.released_detectors:
+            raise RuntimeError("Detector %s has already been finished" % name)
+        return self.writeDetectorImages(matches[0], nameRoot=nameRoot)
+
+    def _outputFileName(self, name, nameRoot):
+        """
+        Return the name of the FITS file to which the image called name is written
+        """
+        if nameRoot is not None:
+            name = nameRoot+'_'+name
+        return fitsFileName(name, compression=self.image_compression)
+
     def open_centroid_file(self, centroid_name):
         """
         Open a centroid file.  This file will have one line per-object and the
@@ -570,22 +2089,44 @@ class GalSimInterpreter(object):
         Write a pickle file of detector images packaged with the
         objects that have been drawn. By default, write the checkpoint
         every self.nobj_checkpoint objects.
+
+        The pixels of memory-mapped images (see self.image_scratch_dir) are
+        copied to snapshot files next to them, since the images go on being
+        drawn on after the checkpoint.  Only the images drawn on since the
+        last checkpoint are copied again.
         """
         if self.checkpoint_file is None:
             return
         if force or len(self.drawn_objects) % self.nobj_checkpoint == 0:
             # The galsim.Images in self.detectorImages cannot be
             # pickled because they contain references to unpickleable
-            # afw objects, so just save the array data and rebuild
-            # the galsim.Images from scratch, given the detector name.
-            images = {key: value.array for key, value
-                      in self.detectorImages.items()}
+            # afw objects, so just save the array data (or the tile size
+            # and tiles of GalSimTiledImages) and rebuild the galsim.Images
+            # from scratch, given the detector name.  The names of the
+            # snapshots of memory-mapped images are saved instead, as are
+            # those of the scratch files of spilled images.
+            images = {}
+            for key in self.detectorImages:
+                if key in self._memmaps:
+                    if key not in self._snapshots:
+                        self._snapshots[key] = self._snapshotMemmap(key)
+                    images[key] = self._snapshots[key]
+                else:
+                    images[key] = self._imagePixels(key)
+            spilled_images = {key: value[0] for key, value in self._spilledImages.items()}
+            deferred_noise = {key: value[1] for key, value in self._deferredNoise.items()}
             drawn_objects = self.drawn_objects if object_list is None \
                             else object_list
             image_state = dict(images=images,
+                               spilled_images=spilled_images,
+                               deferred_noise=deferred_noise,
                                rng=self._rng,
+                               flux_rng=self._fluxRng,
+                               photon_rng=self._photonRng,
                                drawn_objects=drawn_objects,
-                               centroid_objects=self.centroid_list)
+                               centroid_objects=self.centroid_list,
+                               released_detectors=self.released_detectors,
+                               released_images=self._releasedImages)
             with tempfile.NamedTemporaryFile(mode='wb', delete=False,
                                              dir='.') as tmp:
                 pickle.dump(image_state, tmp)
@@ -594,12 +2135,37 @@ class GalSimInterpreter(object):
                 os.chmod(tmp.name, 0o660)
             os.rename(tmp.name, self.checkpoint_file)
 
+            # No checkpoint refers to the retired scratch files any more.
+            for file_name in self._retiredFiles:
+                if os.path.exists(file_name):
+                    os.remove(file_name)
+            self._retiredFiles = set()
+
+    def _snapshotMemmap(self, name):
+        """
+        Copy the pixels of the memory-mapped image of the FITS file called name
+        to a new snapshot file, and return its name
+        """
+        memmap = self._memmaps[name]
+        memmap.flush()
+        fd, snapshot = tempfile.mkstemp(prefix=os.path.splitext(name)[0] + '_',
+                                        suffix='.ckpt.dat',
+                                        dir=os.path.dirname(memmap.filename))
+        os.close(fd)
+        shutil.copyfile(memmap.filename, snapshot)
+        return snapshot
+
     def restore_checkpoint(self, camera_wrapper, phot_params, obs_metadata,
                            epoch=2000.0):
         """
-        Restore self.detectorImages, self._rng, and self.drawn_objects states
+        Restore self.detectorImages, the random number generators and self.drawn_objects states
         from the checkpoint file.
 
+        Memory-mapped images (see self.image_scratch_dir) are copied from their checkpoint
+        snapshots to new memory-mapped files, and spilled images (see self.image_memory_limit)
+        are left in their scratch files.  The detectors whose images had been written and
+        released stay released.
+
         Parameters
         ----------
         camera_wrapper: lsst.sims.GalSimInterface.GalSimCameraWrapper
@@ -622,19 +2188,44 @@ class GalSimInterpreter(object):
         with open(self.checkpoint_file, 'rb') as input_:
             image_state = pickle.load(input_)
             images = image_state['images']
-            for key in images:
+            spilled_images = image_state.get('spilled_images', {})
+            deferred_noise = image_state.get('deferred_noise', {})
+            for key in list(images) + list(spilled_images):
                 # Unmangle the detector name.
                 detname = "R:{},{} S:{},{}".format(*tuple(key[1:3] + key[5:7]))
-                # Create the galsim.Image from scratch as a blank image and
-                # set the pixel data from the persisted image data array.
+                # Create the galsim.Image from scratch, given the
+                # persisted image data.
                 detector = make_galsim_detector(camera_wrapper, detname,
                                                 phot_params, obs_metadata,
                                                 epoch=epoch)
-                self.detectorImages[key] = self.blankImage(detector=detector)
-                self.detectorImages[key] += image_state['images'][key]
+                if key in deferred_noise:
+                    self._deferredNoise[key] = (detector, deferred_noise[key])
+                if key in spilled_images:
+                    self._spilledImages[key] = (spilled_images[key], detector)
+                elif isinstance(images[key], str):
+                    snapshot = images[key]
+                    file_name = os.path.join(os.path.dirname(snapshot),
+                                             os.path.splitext(key)[0] + '.dat')
+                    if snapshot != file_name:
+                        shutil.copyfile(snapshot, file_name)
+                        self._snapshots[key] = snapshot
+                    self.detectorImages[key], self._memmaps[key] = \
+                        memmapImage(file_name,
+                                    detector.xMaxPix-detector.xMinPix+1,
+                                    detector.yMaxPix-detector.yMinPix+1,
+                                    wcs=detector.wcs, mode='r+')
+                else:
+                    self.detectorImages[key] = self._rebuildImage(detector, images[key])
+                    self._imageUsage[key] = detector
             self._rng = image_state['rng']
+            if 'flux_rng' in image_state:
+                self._fluxRng = image_state['flux_rng']
+            if 'photon_rng' in image_state:
+                self._photonRng = image_state['photon_rng']
             self.drawn_objects = image_state['drawn_objects']
             self.centroid_list = image_state['centroid_objects']
+            self.released_detectors = image_state.get('released_detectors', set())
+            self._releasedImages = image_state.get('released_images', set())
 
     def getHourAngle(self, mjd, ra):
         """
@@ -677,11 +2268,12 @@ class GalSimSiliconInterpeter(GalSimInterpreter):
     model to the drawn objects.
     """
     def __init__(self, obs_metadata=None, detectors=None, bandpassDict=None,
-                 noiseWrapper=None, epoch=None, seed=None, bf_strength=1):
+                 noiseWrapper=None, epoch=None, seed=None, bf_strength=1,
+                 seed_per_object=False):
         super(GalSimSiliconInterpeter, self)\
             .__init__(obs_metadata=obs_metadata, detectors=detectors,
                       bandpassDict=bandpassDict, noiseWrapper=noiseWrapper,
-                      epoch=epoch, seed=seed)
+                      epoch=epoch, seed=seed, seed_per_object=seed_per_object)
 
         self.gs_bandpass_dict = {}
         for bandpassName in bandpassDict:
@@ -692,8 +2284,6 @@ class GalSimSiliconInterpeter(GalSimInterpreter):
             self.gs_bandpass_dict[bandpassName] \
                 = galsim.Bandpass(bp_lut, wave_type='nm')
 
-        self.sky_bg_per_pixel = None
-
         # Create a PSF that's fast to evaluate for the postage stamp
         # size calculation for extended objects in .getStampBounds.
         FWHMgeom = obs_metadata.OpsimMetaData['FWHMgeom']
@@ -720,7 +2310,27 @@ class GalSimSiliconInterpeter(GalSimInterpreter):
                                        treering_func=det.tree_rings.func,
                                        transpose=True)
 
-    def drawObject(self, gsObject):
+    def _isFaint(self, realized_fluxes):
+        """
+        Faint objects are drawn by GalSim like all others, since the sensor
+        model has to be applied to their photons.
+        """
+        return False
+
+    def _allocateImage(self, detector, name):
+        """
+        Return a new blank image for the FITS file called name of detector
+        (see GalSimInterpreter._allocateImage).  Tiled images (self.tile_size)
+        are not supported: their sky background is only added when they are
+        written, and the sensor model has to see its charge while drawing.
+        """
+        if self.tile_size is not None:
+            raise RuntimeError("GalSimSiliconInterpeter cannot draw on tiled images; "
+                               "the sensor model needs the sky background to be added "
+                               "before the objects are drawn.  Unset tile_size.")
+        return super(GalSimSiliconInterpeter, self)._allocateImage(detector, name)
+
+    def drawObject(self, gsObject, realized_fluxes=None):
         """
         Draw an astronomical object on all of the relevant FITS files.
 
@@ -728,15 +2338,15 @@ class GalSimSiliconInterpeter(GalSimInterpreter):
         class carrying all of the information for the object whose image
         is to be drawn
 
+        @param [in] realized_fluxes is an optional list of the realized fluxes of
+        the object, one for each bandpass in self.bandpassDict, if they have already
+        been drawn (as by GalSimObjectSpool, to find the detectors of the object
+        before it is drawn).  Otherwise they are drawn here.
+
         @param [out] outputString is a string denoting which detectors the astronomical
         object illumines, suitable for output in the GalSim InstanceCatalog
         """
 
-        # find the detectors which the astronomical object illumines
-        outputString, \
-        detectorList, \
-        centeredObj = self.findAllDetectors(gsObject)
-
         # Make sure this object is marked as "drawn" since we only
         # care that this method has been called for this object.
         self.drawn_objects.add(gsObject.uniqueId)
@@ -744,17 +2354,54 @@ class GalSimSiliconInterpeter(GalSimInterpreter):
         # Compute the realized object fluxes (as drawn from the
         # corresponding Poisson distribution) for each band and return
         # right away if all values are zero in order to save compute.
-        fluxes = [gsObject.flux(bandpassName) for bandpassName in self.bandpassDict]
-        realized_fluxes = [galsim.PoissonDeviate(self._rng, mean=f)() for f in fluxes]
+        if realized_fluxes is None:
+            realized_fluxes = self._realizeObjectFluxes(gsObject)
         if all([f == 0 for f in realized_fluxes]):
-            return outputString
+            return self.findAllDetectors(gsObject, create_object=False)[0]
+
+        # find the detectors which the astronomical object illumines
+        profiles = ObjectProfiles(self, gsObject)
+        outputString, \
+        detectorList, \
+        centeredObj = self.findAllDetectors(gsObject, realized_fluxes=realized_fluxes,
+                                            profiles=profiles)
 
         if len(detectorList) == 0:
             # there is nothing to draw
             return outputString
 
+        self._drawOnDetectors(gsObject, centeredObj, realized_fluxes, detectorList,
+                              profiles=profiles)
+
+        self.write_checkpoint()
+        return outputString
+
+    def _drawOnDetectors(self, gsObject, centeredObj, realized_fluxes, detectorList,
+                         pixelCoords=None, profiles=None):
+        """
+        Draw an astronomical object, whose detectors and realized fluxes have
+        already been determined, on the relevant FITS files, applying the
+        Silicon sensor model.
+
+        See GalSimInterpreter._drawOnDetectors for the parameters.
+        """
+        if pixelCoords is None:
+            pixelCoords = {}
+        if profiles is None:
+            profiles = ObjectProfiles(self, gsObject)
+        self._countDemotion(gsObject)
+
         self._addNoiseAndBackground(detectorList)
 
+        # Find the size of the postage stamps to draw onto.  Use (sky
+        # noise)/3. as the nominal minimum surface brightness for
+        # rendering an extended object.  The size is found once for
+        # the object, at its largest realized flux, and so is large
+        # enough for every band.
+        keep_sb_level = np.sqrt(self.sky_bg_per_pixel)/3.
+        image_size = self.getStampSize(gsObject, max(realized_fluxes), keep_sb_level,
+                                       3*keep_sb_level, profiles=profiles)
+
         # Create a surface operation to sample incident angles and a
         # galsim.SED object for sampling the wavelengths of the
         # incident photons.
@@ -762,10 +2409,15 @@ class GalSimSiliconInterpeter(GalSimInterpreter):
         obscuration = 0.606  # (8.4**2 - 6.68**2)**0.5 / 8.4
         angles = galsim.FRatioAngles(fratio, obscuration, self._rng)
 
-        sed_lut = galsim.LookupTable(x=gsObject.sed.wavelen,
-                                     f=gsObject.sed.flambda)
-        gs_sed = galsim.SED(sed_lut, wave_type='nm', flux_type='flambda',
-                            redshift=0.)
+        # The components of a composite object are drawn one by one, each
+        # with the wavelengths of its own SED, onto the same postage stamp.
+        if gsObject.galSimType == 'composite':
+            components = gsObject.components
+            componentObjs = profiles.componentObjects()
+        else:
+            components = [gsObject]
+            componentObjs = [centeredObj]
+        gs_seds = [self._galsimSED(component.sed) for component in components]
 
         local_hour_angle \
             = self.getHourAngle(self.obs_metadata.mjd.TAI,
@@ -778,41 +2430,47 @@ class GalSimSiliconInterpeter(GalSimInterpreter):
                                           dec_obs*galsim.degrees)
         for bandpassName, realized_flux in zip(self.bandpassDict, realized_fluxes):
             gs_bandpass = self.gs_bandpass_dict[bandpassName]
-            waves = galsim.WavelengthSampler(sed=gs_sed, bandpass=gs_bandpass,
-                                             rng=self._rng)
+            waves = [galsim.WavelengthSampler(sed=gs_sed, bandpass=gs_bandpass,
+                                              rng=self._rng)
+                     for gs_sed in gs_seds]
             dcr = galsim.PhotonDCR(base_wavelength=gs_bandpass.effective_wavelength,
                                    HA=local_hour_angle,
                                    latitude=obs_latitude,
                                    obj_coord=obj_coord)
 
             # Set the object flux to the value realized from the
-            # Poisson distribution.
-            obj = centeredObj.withFlux(realized_flux)
+            # Poisson distribution, split between the components
+            # in proportion to their fluxes in this band.
+            fluxes = np.array([component.flux(bandpassName) for component in components])
+            if fluxes.sum() > 0:
+                fluxes = realized_flux*fluxes/fluxes.sum()
+            else:
+                fluxes = np.ones(len(components))*realized_flux/len(components)
+            objs = [componentObj.withFlux(flux)
+                    for componentObj, flux in zip(componentObjs, fluxes)]
 
             for detector in detectorList:
 
                 name = self._getFileName(detector=detector,
                                          bandpassName=bandpassName)
 
-                xPix, yPix = detector.camera_wrapper\
-                   .pixelCoordsFromPupilCoords(gsObject.xPupilRadians,
-                                               gsObject.yPupilRadians,
-                                               chipName=detector.name,
-                                               obs_metadata=self.obs_metadata)
+                xPix, yPix = self._getPixelCoords(gsObject, detector, pixelCoords)
+
+                rng = self._drawRng(gsObject, bandpassName, detector)
+                if self.seed_per_object:
+                    waves = [galsim.WavelengthSampler(sed=gs_sed, bandpass=gs_bandpass,
+                                                      rng=rng)
+                             for gs_sed in gs_seds]
+                    angles = galsim.FRatioAngles(fratio, obscuration, rng)
 
                 # Ensure the rng used by the sensor object is set to the desired state.
-                self.sensor[detector.name].rng.reset(self._rng)
-                surface_ops = [waves, dcr, angles]
+                self.sensor[detector.name].rng.reset(rng)
 
                 # Desired position to draw the object.
                 image_pos = galsim.PositionD(xPix, yPix)
 
-                # Find a postage stamp region to draw onto.  Use (sky
-                # noise)/3. as the nominal minimum surface brightness
-                # for rendering an extended object.
-                keep_sb_level = np.sqrt(self.sky_bg_per_pixel)/3.
-                bounds = self.getStampBounds(gsObject, realized_flux, image_pos,
-                                             keep_sb_level, 3*keep_sb_level)
+                # Find a postage stamp region to draw onto.
+                bounds = self._makeStampBounds(image_pos, image_size)
 
                 # Ensure the bounds of the postage stamp lie within the image.
                 bounds = bounds & self.detectorImages[name].bounds
@@ -821,16 +2479,19 @@ class GalSimSiliconInterpeter(GalSimInterpreter):
                     # offset is relative to the "true" center of the postage stamp.
                     offset = image_pos - bounds.true_center
 
-                    obj.drawImage(method='phot',
-                                  offset=offset,
-                                  rng=self._rng,
-                                  maxN=int(1e6),
-                                  image=self.detectorImages[name][bounds],
-                                  sensor=self.sensor[detector.name],
-                                  surface_ops=surface_ops,
-                                  add_to_image=True,
-                                  poisson_flux=False,
-                                  gain=detector.photParams.gain)
+                    stamp = self.detectorImages[name][bounds]
+
+                    for obj, component_waves in zip(objs, waves):
+                        obj.drawImage(method='phot',
+                                      offset=offset,
+                                      rng=rng,
+                                      maxN=int(1e6),
+                                      image=stamp,
+                                      sensor=self.sensor[detector.name],
+                                      surface_ops=[component_waves, dcr, angles],
+                                      add_to_image=True,
+                                      poisson_flux=False,
+                                      gain=detector.photParams.gain)
 
                     # If we are writing centroid files,store the entry.
                     if self.centroid_base_name is not None:
@@ -838,11 +2499,17 @@ class GalSimSiliconInterpeter(GalSimInterpreter):
                                           gsObject.flux(bandpassName), xPix, yPix)
                         self.centroid_list.append(centroid_tuple)
 
-        self.write_checkpoint()
-        return outputString
+    @staticmethod
+    def _galsimSED(sed):
+        """
+        Return the galsim.SED corresponding to an lsst.sims.photUtils.Sed
+        """
+        sed_lut = galsim.LookupTable(x=sed.wavelen, f=sed.flambda)
+        return galsim.SED(sed_lut, wave_type='nm', flux_type='flambda', redshift=0.)
 
     def getStampBounds(self, gsObject, flux, image_pos, keep_sb_level,
-                       large_object_sb_level, Nmax=1400, pixel_scale=0.2):
+                       large_object_sb_level, Nmax=1400, pixel_scale=0.2,
+                       profiles=None):
         """
         Get the postage stamp bounds for drawing an object within the stamp
         to include the specified minimum surface brightness.  Use the
@@ -872,11 +2539,30 @@ class GalSimSiliconInterpeter(GalSimInterpreter):
             1400**2*72*8/1024**3 = 1GB.
         pixel_scale: float [0.2]
             The CCD pixel scale in arcsec.
+        profiles: ObjectProfiles [None]
+            The profiles of gsObject, if they have already been built.
 
         Returns
         -------
         galsim.BoundsI: The postage stamp bounds.
 
+        """
+        image_size = self.getStampSize(gsObject, flux, keep_sb_level,
+                                       large_object_sb_level, Nmax=Nmax,
+                                       pixel_scale=pixel_scale, profiles=profiles)
+
+        # Create the bounds object centered on the desired location.
+        return self._makeStampBounds(image_pos, image_size)
+
+    def getStampSize(self, gsObject, flux, keep_sb_level, large_object_sb_level,
+                     Nmax=1400, pixel_scale=0.2, profiles=None):
+        """
+        Get the size in pixels of the postage stamp for drawing an object
+        (see getStampBounds for the parameters).
+
+        Returns
+        -------
+        int: The postage stamp size.
         """
         if flux < 10:
             # For really faint things, don't try too hard.  Just use 32x32.
@@ -898,10 +2584,11 @@ class GalSimSiliconInterpeter(GalSimInterpreter):
             obj = self.drawPointSource(gsObject, psf=psf)
             image_size = obj.getGoodImageSize(pixel_scale)
         else:
-            # For extended objects, recreate the object to draw, but
+            # For extended objects, use the object to draw, but
             # convolved with the faster DoubleGaussian PSF.
-            obj = self.createCenteredObject(gsObject,
-                                            psf=self._double_gaussian_psf)
+            if profiles is None:
+                profiles = ObjectProfiles(self, gsObject)
+            obj = profiles.centeredObject(psf=self._double_gaussian_psf)
             obj = obj.withFlux(flux)
 
             # Start with GalSim's estimate of a good box size.
@@ -921,13 +2608,370 @@ class GalSimSiliconInterpeter(GalSimInterpreter):
                                                   pixel_scale=pixel_scale)
                 image_size = max(image_size, Nmax)
 
-        # Create the bounds object centered on the desired location.
-        xmin = int(math.floor(image_pos.x) - image_size/2)
-        xmax = int(math.ceil(image_pos.x) + image_size/2)
-        ymin = int(math.floor(image_pos.y) - image_size/2)
-        ymax = int(math.ceil(image_pos.y) + image_size/2)
+        return image_size
 
-        return galsim.BoundsI(xmin, xmax, ymin, ymax)
+
+class ObjectProfiles(object):
+    """
+    The GalSim profiles of one astronomical object, as needed while it is
+    drawn: the profile before the PSF is applied is built once, and the
+    PSF-convolved profiles used for finding its detectors, sizing its postage
+    stamps and drawing it are all derived from it (each at most once per PSF).
+    """
+
+    def __init__(self, interpreter, gsObject, centeredObj=None):
+        """
+        @param [in] interpreter is the GalSimInterpreter building the profiles
+
+        @param [in] gsObject is an instantiation of the GalSimCelestialObject
+        (or GalSimCompositeObject) class carrying information about the object
+
+        @param [in] centeredObj is the centered GalSim Object convolved with the
+        PSF of the interpreter, if it has already been built (optional)
+        """
+        self.interpreter = interpreter
+        self.gsObject = gsObject
+        self._intrinsic = None
+        self._components = None
+        self._componentObjs = None
+        self._centeredObjs = {}  # id(psf) -> (psf, centeredObj)
+        if centeredObj is not None:
+            self._centeredObjs[id(None)] = (None, centeredObj)
+
+    @property
+    def intrinsic(self):
+        """
+        The profile of the object before the PSF is applied
+        (None for point sources)
+        """
+        if self._intrinsic is None:
+            if self.gsObject.galSimType == 'composite':
+                self._intrinsic = self.interpreter._compositeProfile(self.gsObject,
+                                                                     components=self.components)
+            else:
+                self._intrinsic = self.interpreter.createIntrinsicObject(self.gsObject)
+        return self._intrinsic
+
+    @property
+    def components(self):
+        """
+        The profiles of the components of a composite object before the PSF
+        is applied (see GalSimInterpreter._compositeProfile)
+        """
+        if self._components is None:
+            self._components = [self.interpreter._componentProfile(component)
+                                for component in self.gsObject.components]
+        return self._components
+
+    def componentObjects(self):
+        """
+        Return the list of the centered GalSim Objects of the components of a
+        composite object, each with unit flux and convolved with the PSF of the
+        interpreter
+        """
+        if self._componentObjs is None:
+            self._componentObjs = []
+            for component, profile in zip(self.gsObject.components, self.components):
+                if component.galSimType == 'pointSource':
+                    profile = None
+                self._componentObjs.append(self.interpreter.createCenteredObject(component,
+                                                                                 intrinsic=profile))
+        return self._componentObjs
+
+    def bandObject(self, bandpassName, flux):
+        """
+        Return the centered GalSim Object to draw in one band, convolved with the
+        PSF of the interpreter and scaled to the given flux.  The components of a
+        composite object are weighted by their shares of the flux in that band.
+
+        @param [in] bandpassName is the name of the bandpass
+
+        @param [in] flux is the flux of the object in that band
+        """
+        if self.gsObject.galSimType != 'composite':
+            return self.centeredObject().withFlux(flux)
+
+        intrinsic = self.interpreter._compositeProfile(self.gsObject, bandpassName=bandpassName,
+                                                       components=self.components)
+        centeredObj = self.interpreter.createCenteredObject(self.gsObject, intrinsic=intrinsic)
+        return centeredObj.withFlux(flux)
+
+    def centeredObject(self, psf=None):
+        """
+        Return the centered GalSim Object convolved with psf
+        (see GalSimInterpreter.createCenteredObject)
+
+        @param [in] psf PSF to use for the convolution.  If None, then use
+        the PSF of the interpreter.
+        """
+        key = id(psf)
+        if key not in self._centeredObjs:
+            galSimType = self.gsObject.galSimType
+            if (galSimType == 'pointSource' or
+                    (galSimType in ('sersic', 'RandomWalk') and
+                     self.interpreter._isPointLike(self.gsObject, psf))):
+                intrinsic = None
+            else:
+                intrinsic = self.intrinsic
+            centeredObj = self.interpreter.createCenteredObject(self.gsObject, psf=psf,
+                                                                intrinsic=intrinsic)
+            # keep a reference to psf, so that its id is not reused
+            self._centeredObjs[key] = (psf, centeredObj)
+        return self._centeredObjs[key][1]
+
+
+class InterpolatedImageCache(object):
+    """
+    A least-recently-used cache of the galsim.InterpolatedImage profiles made from
+    FITS images, keyed on the path and modification time of the file and on the
+    pixel scale.  Profiles are evicted, least recently used first, once the memory
+    they occupy exceeds a budget.
+    """
+
+    # The pad_factor of the InterpolatedImages (GalSim's default).  An InterpolatedImage
+    # holds its image padded by this factor in each dimension as float64 (8 bytes per
+    # padded pixel), and, once it is drawn, the Fourier transform of the padded image
+    # as complex128 over half of the k-plane (8 bytes per padded pixel again), i.e.
+    # 16*_pad_factor**2 bytes per pixel of the FITS image.  GalSim rounds the padded
+    # size up to a good FFT size, so this is a lower bound.
+    _pad_factor = 4
+
+    def __init__(self, max_bytes=2**30):
+        """
+        @param [in] max_bytes is the (approximate) memory budget of the cache in bytes
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._profiles = OrderedDict()  # key -> (profile, nbytes), least recently used first
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def get(self, file_name, pixel_scale):
+        """
+        Return the galsim.InterpolatedImage profile of a FITS image.
+
+        @param [in] file_name is the name of the FITS file
+
+        @param [in] pixel_scale is the pixel scale of the image in arcseconds
+
+        @param [out] the galsim.InterpolatedImage
+        """
+        file_name = os.path.abspath(file_name)
+        key = (file_name, os.path.getmtime(file_name), pixel_scale)
+
+        if key in self._profiles:
+            self.hits += 1
+            profile, nbytes = self._profiles.pop(key)
+            self._profiles[key] = (profile, nbytes)
+            return profile
+
+        self.misses += 1
+        image = galsim.fits.read(file_name)
+        profile = galsim.InterpolatedImage(image, scale=pixel_scale, pad_factor=self._pad_factor)
+        nbytes = image.array.size*16*self._pad_factor**2
+
+        self._profiles[key] = (profile, nbytes)
+        self.nbytes += nbytes
+        # evict the least recently used profiles, but always keep the newest one
+        while self.nbytes > self.max_bytes and len(self._profiles) > 1:
+            self.nbytes -= self._profiles.popitem(last=False)[1][1]
+
+        return profile
+
+    def clear(self):
+        """
+        Empty the cache
+        """
+        self._profiles.clear()
+        self.nbytes = 0
+
+
+_sersic_footprint_table = None
+_unit_sersic_profiles = {}
+
+
+def _mix64(values):
+    """
+    Return the splitmix64 hash of a numpy array of unsigned 64-bit integers
+    (with wrap-around arithmetic)
+    """
+    values = (values ^ (values >> np.uint64(30)))*np.uint64(0xbf58476d1ce4e5b9)
+    values = (values ^ (values >> np.uint64(27)))*np.uint64(0x94d049bb133111eb)
+    return values ^ (values >> np.uint64(31))
+
+
+def _hashedUniforms(keys, counters):
+    """
+    Return the uniform random numbers in [0, 1) indexed by the counters
+    (numpy arrays of unsigned 64-bit integers) of the streams keyed on keys
+    """
+    bits = _mix64(keys + counters*np.uint64(0x9e3779b97f4a7c15)) >> np.uint64(11)
+    return bits.astype(float)*2.0**-53
+
+
+# log(k!) for k < 7
+_smallLogFactorials = np.log(np.array([1., 1., 2., 6., 24., 120., 720.]))
+
+# the coefficients of the Stirling series of log(Gamma(x)) used by numpy
+_stirlingCoefficients = [8.333333333333333e-02, -2.777777777777778e-03,
+                         7.936507936507937e-04, -5.952380952380952e-04,
+                         8.417508417508418e-04, -1.917526917526918e-03,
+                         6.410256410256410e-03, -2.955065359477124e-02,
+                         1.796443723688307e-01, -1.39243221690590e+00]
+
+
+def _logFactorial(k):
+    """
+    Return log(k!) for a numpy array of non-negative integers k (held as floats)
+    """
+    x = np.maximum(k, 6.0) + 1.0
+    x2 = 1.0/(x*x)
+    series = _stirlingCoefficients[-1]
+    for coefficient in _stirlingCoefficients[-2::-1]:
+        series = series*x2 + coefficient
+    result = series/x + 0.5*np.log(2.0*np.pi) + (x - 0.5)*np.log(x) - x
+    small = k < 7
+    result[small] = _smallLogFactorials[k[small].astype(int)]
+    return result
+
+
+def hashedPoisson(means, keys):
+    """
+    Draw one value from the Poisson distribution of each mean, such that each
+    value only depends on its mean and its key.  The uniform random numbers are
+    obtained by hashing the key with a counter, so that all of the values are
+    drawn at once with numpy, however many keys there are.  The algorithms are
+    those of numpy: multiplication of uniforms for means below 10, and the
+    transformed rejection with squeeze (PTRS) of Hoermann (1993) otherwise.
+
+    @param [in] means is a numpy array of the (non-negative) means
+
+    @param [in] keys is a numpy array of unsigned 64-bit integers (one per mean)
+
+    @param [out] a numpy array of the realized values (as floats)
+    """
+    means = np.asarray(means, dtype=float)
+    keys = np.asarray(keys, dtype=np.uint64)
+    values = np.zeros(means.shape, dtype=float)
+
+    small = np.where((means > 0) & (means < 10))[0]
+    if len(small) > 0:
+        values[small] = _poissonMultiplication(means[small], keys[small])
+    large = np.where(means >= 10)[0]
+    if len(large) > 0:
+        values[large] = _poissonPTRS(means[large], keys[large])
+    return values
+
+
+def _poissonMultiplication(means, keys):
+    """
+    Draw Poisson values for means below 10 by multiplying uniforms until
+    their product falls below exp(-mean) (see hashedPoisson)
+    """
+    counters = np.zeros(len(means), dtype=np.uint64)
+    values = np.zeros(len(means), dtype=float)
+    product = np.ones(len(means), dtype=float)
+    limit = np.exp(-means)
+    active = np.arange(len(means))
+    while len(active) > 0:
+        product[active] *= _hashedUniforms(keys[active], counters[active])
+        counters[active] += np.uint64(1)
+        more = product[active] > limit[active]
+        values[active[more]] += 1.
+        active = active[more]
+    return values
+
+
+def _poissonPTRS(means, keys):
+    """
+    Draw Poisson values for means of at least 10 by transformed rejection
+    with squeeze (see hashedPoisson)
+    """
+    slam = np.sqrt(means)
+    loglam = np.log(means)
+    b = 0.931 + 2.53*slam
+    a = -0.059 + 0.02483*b
+    invalpha = 1.1239 + 1.1328/(b - 3.4)
+    vr = 0.9277 - 3.6224/(b - 2)
+
+    counters = np.zeros(len(means), dtype=np.uint64)
+    values = np.zeros(len(means), dtype=float)
+    active = np.arange(len(means))
+    while len(active) > 0:
+        U = _hashedUniforms(keys[active], counters[active]) - 0.5
+        V = _hashedUniforms(keys[active], counters[active] + np.uint64(1))
+        counters[active] += np.uint64(2)
+        us = 0.5 - np.abs(U)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            k = np.floor((2*a[active]/us + b[active])*U + means[active] + 0.43)
+            accept = (us >= 0.07) & (V <= vr[active])
+            candidate = ~accept & (k >= 0) & ~((us < 0.013) & (V > us))
+            kk = np.where(candidate, k, 0.0)
+            lhs = np.log(V) + np.log(invalpha[active]) - np.log(a[active]/(us*us) + b[active])
+            rhs = -means[active] + kk*loglam[active] - _logFactorial(kk)
+        accept |= candidate & (lhs <= rhs)
+        values[active[accept]] = k[accept]
+        active = active[~accept]
+    return values
+
+
+def unitSersicProfile(sindex, step):
+    """
+    Return a Sersic profile with unit half light radius and unit flux whose
+    index is sindex rounded to a multiple of step (and clipped to the range
+    0.3 to 6.2 supported by GalSim).  The profiles are cached for the life of
+    the process, so that GalSim builds its radial tables once per index.
+
+    Parameters
+    ----------
+    sindex: float
+        The Sersic index
+    step: float
+        The spacing of the grid of Sersic indices
+
+    Returns
+    -------
+    galsim.Sersic
+    """
+    istep = int(np.round(float(sindex)/step))
+    key = (istep, float(step))
+    if key not in _unit_sersic_profiles:
+        nn = min(max(istep*step, 0.3), 6.2)
+        _unit_sersic_profiles[key] = galsim.Sersic(n=nn, half_light_radius=1.)
+    return _unit_sersic_profiles[key]
+
+
+def sersicFootprintFactor(sindex):
+    """
+    Return the size GalSim would choose for the image of a Sersic profile
+    with unit half light radius (i.e. 2*pi/stepk).  The sizes are tabulated
+    on a grid of Sersic indices the first time this function is called and
+    interpolated thereafter.
+
+    Parameters
+    ----------
+    sindex: float or numpy array
+        The Sersic index (clipped to the range 0.3 to 6.2 supported by GalSim)
+
+    Returns
+    -------
+    float or numpy array: the image size in units of the half light radius
+    """
+    global _sersic_footprint_table
+    if _sersic_footprint_table is None:
+        n_grid = np.linspace(0.3, 6.2, 60)
+        # Use a large half light radius so that the rounding of the image
+        # size to an even number of pixels is negligible.
+        hlr = 100.0
+        size_grid = np.array([galsim.Sersic(n=nn, half_light_radius=hlr).getGoodImageSize(1.0)/hlr
+                              for nn in n_grid])
+        _sersic_footprint_table = (n_grid, size_grid)
+
+    n_grid, size_grid = _sersic_footprint_table
+    return np.interp(sindex, n_grid, size_grid)
 
 
 def getGoodPhotImageSize(obj, keep_sb_level, pixel_scale=0.2):
@@ -0,0 +1,176 @@
+"""
+This file defines GalSimObjectSpool, which routes the objects to be drawn by
+a GalSimInterpreter to one region per detector and holds them (in memory or
+spooled to disk) until the detectors are drawn and written one at a time.
+"""
+from __future__ import print_function
+
+from builtins import object
+import os
+import pickle
+import shutil
+import tempfile
+from lsst.sims.GalSimInterface import GalSimInterpreter, GalSimSiliconInterpeter, \
+    GalSimCelestialObject, GalSimCompositeObject
+
+__all__ = ["GalSimObjectSpool"]
+
+
+class GalSimObjectSpool(object):
+    """
+    The regions are the detectors of the GalSimInterpreter, in order of position
+    on the focal plane (along rows of detectors).  Each object is assigned
+    (with GalSimInterpreter.findAllDetectors) to the first region in that order
+    among those of the detectors it illumines.  Its fluxes are realized when it is
+    added and kept with it, so that it is looked up with the same footprint as when
+    it is drawn (see GalSimInterpreter.flux_adaptive_footprints) and never reaches
+    the detector of an earlier region.  Once all of the objects have been
+    added, render draws the objects of each region in turn, after which no more
+    objects can land on the region's detector, so that its FITS files are written
+    and its images freed before moving on to the next region.  At any time, only
+    the images of the detector being drawn (and of those neighbours onto which its
+    objects spill) are held in memory.
+
+    If spool_dir is None, the objects are held in memory.  Otherwise, they are
+    pickled to one file per detector in a new directory within spool_dir, so that
+    only the images are held in memory.
+    """
+
+    def __init__(self, interpreter, spool_dir=None, keep_seds=None):
+        """
+        @param [in] interpreter is the GalSimInterpreter drawing the objects
+
+        @param [in] spool_dir is the directory in which to spool the objects
+        (None to hold them in memory)
+
+        @param [in] keep_seds is a boolean.  If False, the SEDs of the spooled
+        objects are dropped once their fluxes have been computed.  If None, they
+        are kept only if interpreter samples wavelengths from them (as
+        GalSimSiliconInterpeter does).
+        """
+        if not isinstance(interpreter, GalSimInterpreter):
+            raise RuntimeError("GalSimObjectSpool needs a GalSimInterpreter; "
+                               "you passed a %s" % str(type(interpreter)))
+        if keep_seds is None:
+            keep_seds = isinstance(interpreter, GalSimSiliconInterpeter)
+
+        self.interpreter = interpreter
+        self.keep_seds = keep_seds
+        self.nobjects = 0  # the number of objects added to the regions
+
+        # Order the regions along rows of detectors across the focal plane.
+        self.detectors = sorted(interpreter.detectors,
+                                key=lambda dd: (round(dd.yCenterArcsec), dd.xCenterArcsec))
+        self._regionIndex = dict((dd.name, ii) for ii, dd in enumerate(self.detectors))
+
+        if spool_dir is None:
+            self._dir = None
+            self._objects = dict((dd.name, []) for dd in self.detectors)
+        else:
+            self._dir = tempfile.mkdtemp(prefix='galsim_spool_', dir=spool_dir)
+            self._files = {}  # detector name -> spool file open for writing
+
+    def _spoolFileName(self, detector):
+        return os.path.join(self._dir, '%s.pkl' % detector.fileName)
+
+    def add(self, gsObject):
+        """
+        Assign an object to the region of the first detector it illumines
+
+        @param [in] gsObject is a GalSimCelestialObject or GalSimCompositeObject
+
+        @param [out] outputString is a string denoting which detectors the object
+        illumines (see GalSimInterpreter.findAllDetectors)
+        """
+        realized_fluxes = [float(f) for f in self.interpreter._realizeObjectFluxes(gsObject)]
+        if all([f == 0 for f in realized_fluxes]):
+            # there is nothing to draw (see GalSimInterpreter.drawObject)
+            self.interpreter.drawn_objects.add(gsObject.uniqueId)
+            return self.interpreter.findAllDetectors(gsObject, create_object=False)[0]
+
+        # This is the footprint with which drawObject will look the object up.
+        outputString, detectorList, centeredObj = \
+            self.interpreter.findAllDetectors(gsObject, realized_fluxes=realized_fluxes,
+                                              create_object=False)
+        if len(detectorList) == 0:
+            return outputString
+
+        first = min(detectorList, key=lambda dd: self._regionIndex[dd.name])
+        if self._dir is None:
+            self._objects[first.name].append((gsObject, realized_fluxes))
+        else:
+            if first.name not in self._files:
+                self._files[first.name] = open(self._spoolFileName(first), 'wb')
+            pickle.dump((gsObject.spoolRecord(list(self.interpreter.bandpassDict),
+                                              keep_sed=self.keep_seds), realized_fluxes),
+                        self._files[first.name], protocol=pickle.HIGHEST_PROTOCOL)
+        self.nobjects += 1
+        return outputString
+
+    def objects(self, detector):
+        """
+        Iterate over (and forget) the objects assigned to the region of detector,
+        as (gsObject, realized_fluxes) pairs
+        """
+        if self._dir is None:
+            objects = self._objects[detector.name]
+            self._objects[detector.name] = []
+            for item in objects:
+                yield item
+            return
+
+        if detector.name not in self._files:
+            return
+        self._files.pop(detector.name).close()
+        file_name = self._spoolFileName(detector)
+        with open(file_name, 'rb') as input_:
+            while True:
+                try:
+                    record, realized_fluxes = pickle.load(input_)
+                except EOFError:
+                    break
+                if record[0] == 'composite':
+                    gsObject = GalSimCompositeObject.fromSpoolRecord(record, self.interpreter.bandpassDict,
+                                                                     detector.photParams)
+                else:
+                    gsObject = GalSimCelestialObject.fromSpoolRecord(record, self.interpreter.bandpassDict,
+                                                                     detector.photParams)
+                yield gsObject, realized_fluxes
+        os.remove(file_name)
+
+    def render(self, nameRoot=None):
+        """
+        Draw the objects of each region in turn, writing and releasing the
+        images of its detector (see GalSimInterpreter.writeDetectorImages)
+        before moving on to the next region
+
+        @param [in] nameRoot is a string that will be prepended to the names of
+        the output FITS files (see GalSimInterpreter.writeImages)
+
+        @param [out] namesWritten is a list of the names of the FITS files written
+        """
+        namesWritten = []
+        for detector in self.detectors:
+            for gsObject, realized_fluxes in self.objects(detector):
+                self.interpreter.drawObject(gsObject, realized_fluxes=realized_fluxes)
+            namesWritten += self.interpreter.writeDetectorImages(detector, nameRoot=nameRoot)
+
+        if self.interpreter.image_writer is not None:
+            self.interpreter.image_writer.close()
+        self.close()
+        return namesWritten
+
+    def close(self):
+        """
+        Forget the objects which have not been drawn (deleting the spool directory)
+        """
+        if self._dir is None:
+            for name in self._objects:
+                self._objects[name] = []
+            return
+
+        for spool_file in self._files.values():
+            spool_file.close()
+        self._files = {}
+        if os.path.exists(self._dir):
+            shutil.rmtree(self._dir)
@@ -28,8 +28,14 @@ class PSFbase(object):
     See the classes DoubleGaussianPSF and SNRdocumentPSF below for example implementations.
 
     See galSimCompoundGenerator.py and galSimStarGenerator.py for example usages.
+
+    Daughter classes whose _getPSF returns the same PSF at every position should set
+    the class member position_independent to True; the GalSimInterpreter then builds
+    the profile of point sources once and reuses it for all of them.
     """
 
+    position_independent = False
+
     def _getPSF(self, xPupil=None, yPupil=None):
         """
         If it had been implemented, this would return a GalSim PSF instantiation at the
@@ -90,6 +96,8 @@ class DoubleGaussianPSF(PSFbase):
     Double Gaussian PSF.  See the documentation in PSFbase to learn how it is used.
     """
 
+    position_independent = True
+
     def __init__(self, fwhm1=0.6, fwhm2=0.12, wgt1=1.0, wgt2=0.1):
         """
         @param [in] fwhm1 is the Full Width at Half Max of the first Gaussian in arcseconds
@@ -185,6 +193,8 @@ class Kolmogorov_and_Gaussian_PSF(PSFbase):
     (you will need a SLAC Confluence account to access that link)
     """
 
+    position_independent = True
+
     def __init__(self, airmass=1.2, rawSeeing=0.7, band='r', gsparams=None):
         """
         Parameters
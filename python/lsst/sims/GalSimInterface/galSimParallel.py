@@ -0,0 +1,320 @@
+"""
+This file defines GalSimParallelRenderer, which splits the detectors of a
+camera across a pool of worker processes.  Each worker owns a subset of
+the detectors and its own GalSimInterpreter, draws only the objects that
+were routed to its detectors, and writes its own FITS files.
+"""
+from __future__ import print_function
+
+from builtins import range
+from builtins import object
+import os
+import pickle
+import shutil
+import tempfile
+import multiprocessing
+from lsst.sims.GalSimInterface import make_gs_interpreter, GalSimCelestialObject, \
+    GalSimCompositeObject, GalSimImageWriter, GalSimObjectSpool
+
+__all__ = ["GalSimParallelRenderer"]
+
+
+# The renderer whose shards are being drawn.  The worker processes are
+# forked from the parent after this is set, so they inherit the renderer
+# (and the objects routed to each shard) rather than having them pickled;
+# GalSimDetectors carry afw objects which cannot be pickled.
+_active_renderer = None
+
+
+def _render_shard(shard_index):
+    """
+    Draw and write the images of one shard of detectors (this is the
+    function run by each worker process).
+    """
+    return _active_renderer._renderShard(shard_index)
+
+
+class GalSimParallelRenderer(object):
+    """
+    This class provides the object-drawing interface of GalSimInterpreter
+    (drawObject, drawObjects, writeImages), but spreads the rendering of
+    the detectors over nproc worker processes.
+
+    Objects passed to drawObject are only routed to detectors in the
+    parent process (using GalSimInterpreter.findAllDetectors with their
+    realized fluxes).  Nothing is drawn until writeImages is called, at
+    which point each worker process creates a GalSimInterpreter for its
+    shard of detectors, draws the objects routed to that shard and writes
+    the resulting FITS files.
+
+    The random numbers are always seeded object by object (seed_per_object
+    in GalSimInterpreter), so that an object straddling two shards realizes
+    the same fluxes in both, and the images are identical to those drawn by
+    a single GalSimInterpreter with seed_per_object=True.
+
+    Between drawObject and writeImages, the objects are held as compact
+    records without their SEDs (unless the sensor model needs them), in
+    memory, or in files if spool_dir is given.
+
+    Checkpointing is not supported.
+    """
+
+    def __init__(self, obs_metadata=None, detectors=None,
+                 bandpassDict=None, noiseWrapper=None,
+                 epoch=None, seed=None, apply_sensor_model=False,
+                 bf_strength=1, nproc=None, spool_dir=None):
+        """
+        @param [in] obs_metadata, detectors, bandpassDict, noiseWrapper, epoch,
+        seed, apply_sensor_model and bf_strength have the same meaning as in
+        make_gs_interpreter.  seed cannot be None.
+
+        @param [in] nproc is the number of worker processes.  If None, use
+        the number of CPUs of the machine.  Detectors are dealt out to the
+        workers in turn, so neighbouring detectors go to different workers.
+
+        @param [in] spool_dir is a directory in which the objects routed to each
+        shard are spooled until writeImages is called.  Each worker then draws its
+        detectors one at a time with a GalSimObjectSpool in the same directory,
+        writing and releasing the images of each before drawing the next.  If None,
+        the objects are held in memory and each worker holds the images of all of
+        its detectors.
+        """
+        if detectors is None:
+            raise RuntimeError("Will not create images; you passed no detectors to the GalSimParallelRenderer")
+        if seed is None:
+            raise RuntimeError("GalSimParallelRenderer needs a seed; the objects are "
+                               "drawn with random numbers seeded object by object")
+
+        if nproc is None:
+            nproc = multiprocessing.cpu_count()
+        nproc = max(1, min(nproc, len(detectors)))
+
+        self.obs_metadata = obs_metadata
+        self.detectors = detectors
+        self.bandpassDict = bandpassDict
+        self.noiseWrapper = noiseWrapper
+        self.epoch = epoch
+        self.seed = seed
+        self.apply_sensor_model = apply_sensor_model
+        self.bf_strength = bf_strength
+        self.seed_per_object = True
+        self.nproc = nproc
+        self.spool_dir = spool_dir
+        self.PSF = None
+
+        # attributes (e.g. draw_stamps) to be set on the interpreter of each worker;
+        # they are also set on the interpreter routing the objects, so that it finds
+        # the same footprints.  A detector_callback is called in the worker process.
+        self.interpreter_attributes = {}
+
+        # If not None, each worker writes its FITS files with a GalSimImageWriter
+        # with this many threads.
+        self.image_writer_threads = None
+
+        self.shards = [detectors[ishard::nproc] for ishard in range(nproc)]
+        self._shardIndex = {}
+        for ishard, shard in enumerate(self.shards):
+            for detector in shard:
+                self._shardIndex[detector.name] = ishard
+
+        # This interpreter is only used to route objects to detectors
+        # in the parent process; it never draws anything.  The sensor model
+        # does not change the footprints, so it is not needed here.
+        self._router = make_gs_interpreter(obs_metadata, detectors, bandpassDict, None,
+                                           epoch=epoch, seed=seed, seed_per_object=True)
+        self._keepSeds = apply_sensor_model  # the sensor model samples wavelengths from the SEDs
+
+        self._records = []  # the spool records of the objects routed to at least one detector
+        self._shardObjects = [[] for shard in self.shards]  # indices into self._records
+        self._dir = None  # the directory holding the spool files of the shards
+        self._files = {}  # shard index -> spool file open for writing
+
+        self.drawn_objects = set()
+        self.checkpoint_file = None
+        self.nobj_checkpoint = 1000
+
+    def setPSF(self, PSF=None):
+        """
+        Set the PSF wrapper used by the worker interpreters
+
+        @param [in] PSF is an instantiation of a class which inherits from PSFbase and defines _getPSF()
+        """
+        self.PSF = PSF
+        self._router.setPSF(PSF=PSF)
+
+    def drawObject(self, gsObject):
+        """
+        Route an astronomical object to the shards owning the detectors on
+        which it might cast light.  The object is drawn by those shards
+        when writeImages is called.
+
+        @param [in] gsObject is an instantiation of the GalSimCelestialObject
+        class carrying all of the information for the object whose image
+        is to be drawn
+
+        @param [out] outputString is a string denoting which detectors the astronomical
+        object illumines, suitable for output in the GalSim InstanceCatalog
+        """
+        self.drawn_objects.add(gsObject.uniqueId)
+        for name, value in self.interpreter_attributes.items():
+            setattr(self._router, name, value)
+
+        # The fluxes are realized from the generator of the object, so the
+        # workers realize the same ones and find the same footprint.
+        realized_fluxes = self._router._realizeObjectFluxes(gsObject)
+        if all([f == 0 for f in realized_fluxes]):
+            return self._router.findAllDetectors(gsObject, create_object=False)[0]
+
+        outputString, detectorList, centeredObj = \
+            self._router.findAllDetectors(gsObject, realized_fluxes=realized_fluxes,
+                                          create_object=False)
+        if len(detectorList) == 0:
+            return outputString
+
+        record = gsObject.spoolRecord(list(self.bandpassDict), keep_sed=self._keepSeds)
+        shards = sorted(set(self._shardIndex[detector.name] for detector in detectorList))
+        if self.spool_dir is None:
+            for ishard in shards:
+                self._shardObjects[ishard].append(len(self._records))
+            self._records.append(record)
+        else:
+            if self._dir is None:
+                self._dir = tempfile.mkdtemp(prefix='galsim_shards_', dir=self.spool_dir)
+            for ishard in shards:
+                if ishard not in self._files:
+                    self._files[ishard] = open(self._shardFileName(ishard), 'wb')
+                pickle.dump(record, self._files[ishard], protocol=pickle.HIGHEST_PROTOCOL)
+
+        return outputString
+
+    def findAllDetectors(self, gsObject, **kwargs):
+        """
+        Find all of the detectors on which an object might cast light
+        (see GalSimInterpreter.findAllDetectors)
+        """
+        return self._router.findAllDetectors(gsObject, **kwargs)
+
+    def drawObjects(self, gsObjectBatch):
+        """
+        Route a GalSimCelestialObjectBatch of objects to the shards
+        (see drawObject).
+
+        @param [out] outputList is a list of strings (one per object) denoting which
+        detectors each astronomical object illumines
+        """
+        return [self.drawObject(gsObjectBatch[iobj]) for iobj in range(len(gsObjectBatch))]
+
+    def write_checkpoint(self, force=False, object_list=None):
+        if self.checkpoint_file is not None:
+            raise RuntimeError("GalSimParallelRenderer does not support checkpointing")
+
+    def restore_checkpoint(self, camera_wrapper, phot_params, obs_metadata,
+                           epoch=2000.0):
+        if self.checkpoint_file is not None:
+            raise RuntimeError("GalSimParallelRenderer does not support checkpointing")
+
+    def _shardFileName(self, shard_index):
+        return os.path.join(self._dir, 'shard_%d.pkl' % shard_index)
+
+    def _objectsOfShard(self, shard_index, photParams):
+        """
+        Iterate over the objects routed to one shard, recreated from their spool records
+        """
+        if self._dir is None:
+            records = (self._records[iobj] for iobj in self._shardObjects[shard_index])
+        else:
+            records = self._readShardFile(shard_index)
+        for record in records:
+            if record[0] == 'composite':
+                yield GalSimCompositeObject.fromSpoolRecord(record, self.bandpassDict, photParams)
+            else:
+                yield GalSimCelestialObject.fromSpoolRecord(record, self.bandpassDict, photParams)
+
+    def _readShardFile(self, shard_index):
+        """
+        Iterate over the spool records in the file of one shard
+        """
+        file_name = self._shardFileName(shard_index)
+        if not os.path.exists(file_name):
+            return
+        with open(file_name, 'rb') as input_:
+            while True:
+                try:
+                    yield pickle.load(input_)
+                except EOFError:
+                    break
+
+    def _renderShard(self, shard_index):
+        """
+        Draw all of the objects routed to one shard of detectors and write
+        the resulting FITS files.  This is run in a worker process.
+
+        @param [in] shard_index is the index of the shard in self.shards
+
+        @param [out] namesWritten is a list of the names of the FITS files written
+        """
+        shard = self.shards[shard_index]
+        interpreter = make_gs_interpreter(self.obs_metadata, shard,
+                                          self.bandpassDict, self.noiseWrapper,
+                                          epoch=self.epoch, seed=self.seed,
+                                          apply_sensor_model=self.apply_sensor_model,
+                                          bf_strength=self.bf_strength,
+                                          seed_per_object=True)
+        interpreter.setPSF(PSF=self.PSF)
+        for name, value in self.interpreter_attributes.items():
+            setattr(interpreter, name, value)
+        if self.image_writer_threads is not None:
+            interpreter.image_writer = GalSimImageWriter(nthreads=self.image_writer_threads)
+
+        if self.spool_dir is None:
+            for gsObject in self._objectsOfShard(shard_index, shard[0].photParams):
+                interpreter.drawObject(gsObject)
+            return interpreter.writeImages(nameRoot=self._nameRoot)
+
+        spool = GalSimObjectSpool(interpreter, spool_dir=self.spool_dir, keep_seds=self._keepSeds)
+        for gsObject in self._objectsOfShard(shard_index, shard[0].photParams):
+            spool.add(gsObject)
+        return spool.render(nameRoot=self._nameRoot)
+
+    def writeImages(self, nameRoot=None):
+        """
+        Draw the objects on each shard of detectors in a separate worker
+        process and write the FITS files to disk.  The objects are then
+        forgotten.
+
+        @param [in] nameRoot is a string that will be prepended to the names
+        of the output FITS files (see GalSimInterpreter.writeImages)
+
+        @param [out] namesWritten is a list of the names of the FITS files written
+        """
+        global _active_renderer
+
+        try:
+            context = multiprocessing.get_context('fork')
+        except AttributeError:
+            context = multiprocessing
+
+        # The spool files must be complete before the workers read them.
+        for spool_file in self._files.values():
+            spool_file.close()
+        self._files = {}
+
+        self._nameRoot = nameRoot
+        _active_renderer = self
+        pool = context.Pool(processes=self.nproc)
+        try:
+            results = pool.map(_render_shard, range(len(self.shards)))
+        finally:
+            pool.close()
+            pool.join()
+            _active_renderer = None
+            self._records = []
+            self._shardObjects = [[] for shard in self.shards]
+            if self._dir is not None:
+                shutil.rmtree(self._dir)
+                self._dir = None
+
+        namesWritten = []
+        for names in results:
+            namesWritten += names
+        return namesWritten
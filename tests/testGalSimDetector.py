@@ -10,7 +10,7 @@ from lsst.sims.utils import ObservationMetaData
 from lsst.sims.photUtils import PhotometricParameters
 from lsst.sims.coordUtils.utils import ReturnCamera
 from lsst.sims.coordUtils import _raDecFromPixelCoords, pupilCoordsFromPixelCoords
-from lsst.sims.GalSimInterface import GalSimDetector, GalSimCameraWrapper
+from lsst.sims.GalSimInterface import GalSimDetector, GalSimCameraWrapper, GalSimDetectorIndex
 
 
 def setup_module(module):
@@ -161,6 +161,49 @@ class GalSimDetectorTest(unittest.TestCase):
         self.assertEqual(gsdet.wcs.fitsHeader.getScalar('ROTANGLE'),
                          self.obs.rotSkyPos)
 
+    def testDetectorIndex(self):
+        """
+        Test that GalSimDetectorIndex finds the same detectors as a brute
+        force comparison of bounding boxes
+        """
+        photParams = PhotometricParameters()
+        cameraWrapper = GalSimCameraWrapper(self.camera)
+        detectors = [GalSimDetector(det.getName(), cameraWrapper,
+                                    self.obs, self.epoch, photParams=photParams)
+                     for det in self.camera]
+
+        xMinDet = np.array([dd.xMinArcsec for dd in detectors])
+        xMaxDet = np.array([dd.xMaxArcsec for dd in detectors])
+        yMinDet = np.array([dd.yMinArcsec for dd in detectors])
+        yMaxDet = np.array([dd.yMaxArcsec for dd in detectors])
+
+        rng = np.random.RandomState(8812)
+        nobj = 2000
+        xx = rng.uniform(xMinDet.min()-100.0, xMaxDet.max()+100.0, size=nobj)
+        yy = rng.uniform(yMinDet.min()-100.0, yMaxDet.max()+100.0, size=nobj)
+        size = rng.exponential(50.0, size=nobj)
+        size[:3] = 1.0e5  # boxes covering the whole focal plane
+
+        for cell_size in (None, 10.0):
+            index = GalSimDetectorIndex(detectors, cell_size=cell_size)
+            iBox, iDetector = index.findOverlaps(xx-size/2, xx+size/2, yy-size/2, yy+size/2)
+
+            overlaps = ((np.minimum((xx+size/2)[:, None], xMaxDet[None, :]) >
+                         np.maximum((xx-size/2)[:, None], xMinDet[None, :])) &
+                        (np.minimum((yy+size/2)[:, None], yMaxDet[None, :]) >
+                         np.maximum((yy-size/2)[:, None], yMinDet[None, :])))
+            iBoxControl, iDetectorControl = np.where(overlaps)
+            self.assertGreater(len(iBoxControl), 0)
+            np.testing.assert_array_equal(iBox, iBoxControl)
+            np.testing.assert_array_equal(iDetector, iDetectorControl)
+
+            for ii in range(20):
+                np.testing.assert_array_equal(index.findDetectors(xx[ii]-size[ii]/2,
+                                                                  xx[ii]+size[ii]/2,
+                                                                  yy[ii]-size[ii]/2,
+                                                                  yy[ii]+size[ii]/2),
+                                              np.where(overlaps[ii])[0])
+
 
 class MemoryTestClass(lsst.utils.tests.MemoryTestCase):
     pass
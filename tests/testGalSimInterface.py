@@ -7,6 +7,7 @@ import math
 import numpy as np
 import unittest
 import pickle
+import gzip
 import galsim
 import tempfile
 import shutil
@@ -19,6 +20,7 @@ from lsst.sims.photUtils import BandpassDict
 from lsst.sims.utils.CodeUtilities import sims_clean_up
 from lsst.sims.utils import radiansFromArcsec
 from lsst.sims.photUtils import Bandpass, calcSkyCountsPerPixelForM5, LSSTdefaults, PhotometricParameters
+from lsst.sims.photUtils import Sed
 from lsst.sims.coordUtils import pixelCoordsFromPupilCoords
 from lsst.sims.catUtils.utils import makePhoSimTestDB
 from lsst.sims.utils import ObservationMetaData
@@ -29,8 +31,17 @@ from lsst.sims.GalSimInterface import (GalSimGalaxies, GalSimStars, GalSimAgn,
                                        make_galsim_detector,
                                        make_gs_interpreter,
                                        GalSimCelestialObject,
-                                       LSSTCameraWrapper)
-from lsst.sims.GalSimInterface.galSimInterpreter import getGoodPhotImageSize
+                                       LSSTCameraWrapper,
+                                       InterpolatedImageCache,
+                                       GalSimCompositeObject,
+                                       GalSimCatalogMultiplexer,
+                                       GalSimImageWriter,
+                                       GalSimCelestialObjectBatch,
+                                       GalSimParallelRenderer,
+                                       GalSimObjectSpool)
+from lsst.sims.GalSimInterface.galSimInterpreter import (getGoodPhotImageSize, unitSersicProfile,
+                                                             ObjectProfiles, hashedPoisson)
+from lsst.sims.GalSimInterface.galSimImageWriter import _closeRunningWriters, _running_writers
 from lsst.sims.catUtils.utils import (calcADUwrapper, testGalaxyBulgeDBObj, testGalaxyDiskDBObj,
                                       testGalaxyAgnDBObj, testStarsDBObj)
 import lsst.afw.image as afwImage
@@ -749,6 +760,193 @@ class GalSimInterfaceTest(unittest.TestCase):
         if os.path.exists(catName):
             os.unlink(catName)
 
+    def testCatalogMultiplexer(self):
+        """
+        Test that GalSimCatalogMultiplexer draws the same images as a
+        chain of catalogs sharing their GalSimInterpreter
+        """
+        driver = 'sqlite'
+        dbName1 = os.path.join(self.scratch_dir, 'galSimTestMultiplexer1DB.db')
+        if os.path.exists(dbName1):
+            os.unlink(dbName1)
+
+        deltaRA = np.array([72.0/3600.0, 55.0/3600.0, 75.0/3600.0])
+        deltaDec = np.array([0.0, 15.0/3600.0, -15.0/3600.0])
+        obs_metadata1 = makePhoSimTestDB(filename=dbName1, size=1,
+                                         deltaRA=deltaRA, deltaDec=deltaDec,
+                                         bandpass=self.bandpassNameList,
+                                         m5=self.m5, seeing=self.seeing)
+
+        dbName2 = os.path.join(self.scratch_dir, 'galSimTestMultiplexer2DB.db')
+        if os.path.exists(dbName2):
+            os.unlink(dbName2)
+
+        deltaRA = np.array([55.0/3600.0, 60.0/3600.0, 62.0/3600.0])
+        deltaDec = np.array([-3.0/3600.0, 10.0/3600.0, 10.0/3600.0])
+        obs_metadata2 = makePhoSimTestDB(filename=dbName2, size=1,
+                                         deltaRA=deltaRA, deltaDec=deltaDec,
+                                         bandpass=self.bandpassNameList,
+                                         m5=self.m5, seeing=self.seeing)
+
+        def make_catalogs():
+            gals = testGalaxyBulgeDBObj(driver=driver, database=dbName1)
+            cat1 = testGalaxyCatalog(gals, obs_metadata=obs_metadata1)
+            cat1.camera_wrapper = GalSimCameraWrapper(self.camera)
+            stars = testStarsDBObj(driver=driver, database=dbName2)
+            cat2 = testStarCatalog(stars, obs_metadata=obs_metadata2)
+            cat2.camera_wrapper = GalSimCameraWrapper(self.camera)
+            # draw the images independently of the order of the objects
+            for cat in (cat1, cat2):
+                cat.seed_per_object = True
+            return cat1, cat2
+
+        cat1, cat2 = make_catalogs()
+        catName = os.path.join(self.scratch_dir, 'multiplexerCatalog.sav')
+        cat1.write_catalog(catName)
+        cat2.copyGalSimInterpreter(cat1)
+        cat2.write_catalog(catName, write_header=False, write_mode='a')
+        controlNames = cat2.write_images(nameRoot=os.path.join(self.scratch_dir, 'control'))
+
+        multiplexer = GalSimCatalogMultiplexer(list(make_catalogs()))
+        testNames = multiplexer.writeImages(nameRoot=os.path.join(self.scratch_dir, 'multiplexed'),
+                                            chunk_size=2)
+        interpreter = multiplexer.galSimInterpreter
+        self.assertEqual(len(interpreter.detectorImages), 0)
+        self.assertEqual(len(interpreter.released_detectors), len(interpreter.detectors))
+
+        self.assertEqual(sorted([os.path.basename(name).replace('control', '')
+                                 for name in controlNames]),
+                         sorted([os.path.basename(name).replace('multiplexed', '')
+                                 for name in testNames]))
+        for controlName in controlNames:
+            testName = controlName.replace('control', 'multiplexed')
+            np.testing.assert_allclose(afwImage.ImageF(testName).getArray(),
+                                       afwImage.ImageF(controlName).getArray(),
+                                       rtol=1.0e-5, atol=1.0e-3)
+
+        for name in controlNames + testNames + [catName, dbName1, dbName2]:
+            if os.path.exists(name):
+                os.unlink(name)
+
+    def testStreamingMode(self):
+        """
+        Test that spooling the objects of a chain of catalogs and drawing the
+        images one detector at a time draws the same images as drawing the
+        objects as they are read
+        """
+        driver = 'sqlite'
+        dbName1 = os.path.join(self.scratch_dir, 'galSimTestStreaming1DB.db')
+        if os.path.exists(dbName1):
+            os.unlink(dbName1)
+
+        deltaRA = np.array([72.0/3600.0, 55.0/3600.0, 75.0/3600.0])
+        deltaDec = np.array([0.0, 15.0/3600.0, -15.0/3600.0])
+        obs_metadata1 = makePhoSimTestDB(filename=dbName1, size=1,
+                                         deltaRA=deltaRA, deltaDec=deltaDec,
+                                         bandpass=self.bandpassNameList,
+                                         m5=self.m5, seeing=self.seeing)
+
+        dbName2 = os.path.join(self.scratch_dir, 'galSimTestStreaming2DB.db')
+        if os.path.exists(dbName2):
+            os.unlink(dbName2)
+
+        deltaRA = np.array([55.0/3600.0, 60.0/3600.0, 62.0/3600.0])
+        deltaDec = np.array([-3.0/3600.0, 10.0/3600.0, 10.0/3600.0])
+        obs_metadata2 = makePhoSimTestDB(filename=dbName2, size=1,
+                                         deltaRA=deltaRA, deltaDec=deltaDec,
+                                         bandpass=self.bandpassNameList,
+                                         m5=self.m5, seeing=self.seeing)
+
+        catName = os.path.join(self.scratch_dir, 'streamingCatalog.sav')
+        spool_dir = os.path.join(self.scratch_dir, 'streaming_spool')
+        os.mkdir(spool_dir)
+
+        def draw_images(nameRoot, streaming_spool_dir):
+            gals = testGalaxyBulgeDBObj(driver=driver, database=dbName1)
+            cat1 = testGalaxyCatalog(gals, obs_metadata=obs_metadata1)
+            cat1.camera_wrapper = GalSimCameraWrapper(self.camera)
+            stars = testStarsDBObj(driver=driver, database=dbName2)
+            cat2 = testStarCatalog(stars, obs_metadata=obs_metadata2)
+            cat2.camera_wrapper = GalSimCameraWrapper(self.camera)
+            for cat in (cat1, cat2):
+                cat.seed_per_object = True
+                cat.streaming_spool_dir = streaming_spool_dir
+            cat1.write_catalog(catName)
+            cat2.copyGalSimInterpreter(cat1)
+            cat2.write_catalog(catName, write_header=False, write_mode='a')
+            return cat2, cat2.write_images(nameRoot=os.path.join(self.scratch_dir, nameRoot))
+
+        control_cat, controlNames = draw_images('control', None)
+        test_cat, testNames = draw_images('streamed', spool_dir)
+
+        self.assertGreater(test_cat._objectSpool.nobjects, 0)
+        self.assertEqual(len(test_cat.galSimInterpreter.detectorImages), 0)
+        self.assertEqual(os.listdir(spool_dir), [])
+
+        self.assertEqual(sorted([os.path.basename(name).replace('control', '')
+                                 for name in controlNames]),
+                         sorted([os.path.basename(name).replace('streamed', '')
+                                 for name in testNames]))
+        for controlName in controlNames:
+            testName = controlName.replace('control', 'streamed')
+            np.testing.assert_allclose(afwImage.ImageF(testName).getArray(),
+                                       afwImage.ImageF(controlName).getArray(),
+                                       rtol=1.0e-5, atol=1.0e-3)
+
+        for name in controlNames + testNames + [catName, dbName1, dbName2]:
+            if os.path.exists(name):
+                os.unlink(name)
+        os.rmdir(spool_dir)
+
+    def testCompositeGalaxies(self):
+        """
+        Test that the bulge and disk of each galaxy are drawn as one composite
+        galaxy as soon as both of them have been read, and that the fitsFiles
+        column of the disks holds the detectors of their galaxy
+        """
+        catName = os.path.join(self.scratch_dir, 'compositeCatalog.sav')
+        bulges = testGalaxyBulgeDBObj(driver=self.driver, database=self.dbName)
+        cat1 = testGalaxyCatalog(bulges, obs_metadata=self.obs_metadata)
+        cat1.camera_wrapper = GalSimCameraWrapper(self.camera)
+        disks = testGalaxyDiskDBObj(driver=self.driver, database=self.dbName)
+        cat2 = testGalaxyCatalog(disks, obs_metadata=self.obs_metadata)
+        for cat in (cat1, cat2):
+            cat.composite_galaxies = True
+            cat.composite_component_count = 2
+
+        def read_rows():
+            with open(catName, 'r') as input_:
+                return [line.strip().split(', ') for line in input_ if not line.startswith('#')]
+
+        cat1.write_catalog(catName)
+        interpreter = cat1.galSimInterpreter
+        galaxyIds = set(cat1._compositeComponents)
+        self.assertGreater(len(galaxyIds), 0)
+        self.assertEqual(len(interpreter.drawn_objects), 0)
+        self.assertEqual(len(interpreter.detectorImages), 0)
+        nBulges = len(read_rows())
+
+        cat2.copyGalSimInterpreter(cat1)
+        cat2.write_catalog(catName, write_header=False, write_mode='a')
+
+        # the galaxies whose disks were read have been drawn
+        galaxyDetectors = {}
+        for row in read_rows()[nBulges:]:
+            galaxyId = (int(row[1]) >> cat2.composite_id_shift) << cat2.composite_id_shift
+            galaxyDetectors[galaxyId] = row[-1]
+        self.assertGreater(len(galaxyDetectors), 0)
+        self.assertEqual(interpreter.drawn_objects, set(galaxyDetectors))
+        self.assertEqual(set(cat1._compositeComponents), galaxyIds - set(galaxyDetectors))
+        self.assertGreater(len(interpreter.detectorImages), 0)
+        self.assertTrue(any(detectors not in ('', 'None') for detectors in galaxyDetectors.values()))
+
+        # the others are drawn by draw_composite_galaxies
+        self.assertEqual(set(cat2.draw_composite_galaxies()), galaxyIds - set(galaxyDetectors))
+        self.assertEqual(interpreter.drawn_objects, galaxyIds)
+
+        if os.path.exists(catName):
+            os.unlink(catName)
+
     def testCompoundFitsFiles_one_empty(self):
         """
         Test that GalSimInterpreter puts the right number of counts on images
@@ -996,6 +1194,17 @@ class GalSimInterfaceTest(unittest.TestCase):
         self.assertLess(midP1, 0.5*maxValue, msg=msg)
 
 
+class PositionDependentPSF(SNRdocumentPSF):
+    """
+    An SNRdocumentPSF returning a new GalSim profile at each position,
+    as a position-dependent PSF would
+    """
+    position_independent = False
+
+    def _getPSF(self, xPupil=None, yPupil=None, **kwargs):
+        return SNRdocumentPSF._getPSF(self).withFlux(1.0)
+
+
 class GsDetector(object):
     """
     Minimal implementation of an interface-compatible version
@@ -1106,6 +1315,81 @@ class CheckPointingTestCase(unittest.TestCase):
                 self.assertEqual(new_img.wcs.fitsHeader.getScalar(name),
                                  gs_img.wcs.fitsHeader.getScalar(name))
 
+    def test_memmap_checkpointing(self):
+        "Test checkpointing of memory-mapped .detectorImages data."
+        camera = camTestUtils.CameraWrapper().camera
+        camera_wrapper = GalSimCameraWrapper(camera)
+        phot_params = PhotometricParameters()
+        obs_md = ObservationMetaData(pointingRA=23.0,
+                                     pointingDec=12.0,
+                                     rotSkyPos=13.2,
+                                     mjd=59580.0,
+                                     bandpassName='r')
+
+        detectors = [make_galsim_detector(camera_wrapper, dd.getName(),
+                                          phot_params, obs_md)
+                     for dd in camera_wrapper.camera]
+
+        gs_interpreter = GalSimInterpreter(detectors=detectors)
+        gs_interpreter.checkpoint_file = self.cp_file
+        gs_interpreter.image_scratch_dir = self.output_dir
+
+        key = "R00_S00_r.fits"
+        detname = "R:0,0 S:0,0"
+        detector = make_galsim_detector(camera_wrapper, detname,
+                                        phot_params, obs_md)
+        image = gs_interpreter._allocateImage(detector, key)
+        image += 17
+        gs_interpreter.detectorImages[key] = image
+        scratch_file = os.path.join(self.output_dir, 'R00_S00_r.dat')
+        self.assertTrue(os.path.isfile(scratch_file))
+
+        # The checkpoint records a snapshot of the pixels, which is not
+        # changed by what is drawn afterwards.
+        gs_interpreter.drawn_objects.add(1)
+        gs_interpreter.write_checkpoint(force=True)
+        with open(self.cp_file, 'rb') as input_:
+            cp_data = pickle.load(input_)
+        snapshot = cp_data['images'][key]
+        self.assertNotEqual(snapshot, scratch_file)
+        self.assertEqual(os.path.dirname(snapshot), self.output_dir)
+        pixels = np.fromfile(snapshot, dtype=np.float32).reshape(image.array.shape)
+        np.testing.assert_array_equal(pixels, image.array)
+
+        gs_interpreter.detectorImages[key] += 5
+        gs_interpreter.drawn_objects.add(2)
+        pixels = np.fromfile(snapshot, dtype=np.float32).reshape(image.array.shape)
+        np.testing.assert_array_equal(pixels, 17)
+
+        new_interpreter = GalSimInterpreter(detectors=detectors)
+        new_interpreter.checkpoint_file = self.cp_file
+        new_interpreter.image_scratch_dir = self.output_dir
+        new_interpreter.restore_checkpoint(camera_wrapper,
+                                           phot_params,
+                                           obs_md)
+        self.assertEqual(new_interpreter.drawn_objects, set([1]))
+        new_img = new_interpreter.detectorImages[key]
+        np.testing.assert_array_equal(new_img.array, 17)
+        self.assertEqual(new_img.bounds, image.bounds)
+        self.assertEqual(new_interpreter._memmaps[key].filename, scratch_file)
+
+        # Releasing the image deletes its file at once, and its snapshot
+        # once a checkpoint no longer refers to it.  The released detectors
+        # are restored.
+        new_interpreter._releaseImage(key)
+        new_interpreter.released_detectors.add(detname)
+        self.assertFalse(os.path.isfile(scratch_file))
+        self.assertTrue(os.path.isfile(snapshot))
+        new_interpreter.write_checkpoint(force=True)
+        self.assertFalse(os.path.isfile(snapshot))
+
+        restored = GalSimInterpreter(detectors=detectors)
+        restored.checkpoint_file = self.cp_file
+        restored.image_scratch_dir = self.output_dir
+        restored.restore_checkpoint(camera_wrapper, phot_params, obs_md)
+        self.assertEqual(len(restored.detectorImages), 0)
+        self.assertEqual(restored.released_detectors, set([detname]))
+
 
 class GetStampBoundsTestCase(unittest.TestCase):
     """
@@ -1266,6 +1550,1268 @@ class HourAngleTestCase(unittest.TestCase):
                                places=4)
 
 
+class UnitSersicProfileTestCase(unittest.TestCase):
+    """TestCase class for the unitSersicProfile function."""
+
+    def test_unitSersicProfile(self):
+        """
+        Test that Sersic indices are snapped to the grid and that the
+        profiles are cached.
+        """
+        profile = unitSersicProfile(1.23, 0.1)
+        self.assertIs(unitSersicProfile(1.18, 0.1), profile)
+        self.assertIsNot(unitSersicProfile(1.26, 0.1), profile)
+
+        for sindex, control_sindex in ((1.23, 1.2), (0.01, 0.3), (8.0, 6.2)):
+            control = galsim.Sersic(n=control_sindex, half_light_radius=2.5)
+            test = unitSersicProfile(sindex, 0.1).dilate(2.5)
+            for rr in (0.0, 0.5, 2.5, 7.0):
+                self.assertAlmostEqual(test.xValue(rr, 0.)/control.xValue(rr, 0.), 1.0, 6)
+
+
+class InterpolatedImageCacheTestCase(unittest.TestCase):
+    """TestCase class for InterpolatedImageCache."""
+
+    def setUp(self):
+        self.scratch_dir = tempfile.mkdtemp(dir=ROOT, prefix='InterpolatedImageCache')
+
+    def tearDown(self):
+        if os.path.exists(self.scratch_dir):
+            shutil.rmtree(self.scratch_dir)
+
+    def write_image(self, name, value, mtime):
+        file_name = os.path.join(self.scratch_dir, name)
+        image = galsim.ImageD(16, 16)
+        image.array[6:10, 6:10] = value
+        image.write(file_name)
+        os.utime(file_name, (mtime, mtime))
+        return file_name
+
+    def test_cache(self):
+        """
+        Test that profiles are reused, that they are rebuilt when the
+        file or the pixel scale changes, and that the least recently
+        used profiles are evicted.
+        """
+        file_a = self.write_image('a.fits', 1.0, 1000)
+        file_b = self.write_image('b.fits', 2.0, 1000)
+
+        cache = InterpolatedImageCache()
+        profile = cache.get(file_a, 0.2)
+        self.assertIs(cache.get(file_a, 0.2), profile)
+        self.assertIs(cache.get(os.path.relpath(file_a), 0.2), profile)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        control = galsim.InterpolatedImage(file_a, scale=0.2)
+        self.assertAlmostEqual(profile.xValue(0.1, 0.1), control.xValue(0.1, 0.1), 10)
+
+        self.assertIsNot(cache.get(file_a, 0.3), profile)
+        self.assertEqual(len(cache), 2)
+
+        # rewriting the file invalidates its profiles
+        self.write_image('a.fits', 3.0, 2000)
+        profile = cache.get(file_a, 0.2)
+        self.assertAlmostEqual(profile.xValue(0.1, 0.1)/control.xValue(0.1, 0.1), 3.0, 6)
+        self.assertEqual(cache.misses, 3)
+
+        # with room for only one profile, b evicts a
+        nbytes = cache.nbytes//len(cache)
+        cache = InterpolatedImageCache(max_bytes=nbytes)
+        profile = cache.get(file_a, 0.2)
+        cache.get(file_b, 0.2)
+        self.assertEqual(len(cache), 1)
+        self.assertLessEqual(cache.nbytes, nbytes)
+        self.assertIsNot(cache.get(file_a, 0.2), profile)
+        self.assertEqual(cache.misses, 3)
+
+
+class InterpreterTestMixin(object):
+    """
+    Fixtures shared by the TestCases which draw objects with a
+    (non-sensor) GalSimInterpreter onto a single LSST detector.
+    """
+    @classmethod
+    def setUpClass(cls):
+        cls.scratch_dir = tempfile.mkdtemp(dir=ROOT, prefix=cls.__name__)
+        cls.db_name = os.path.join(cls.scratch_dir, 'galsim_test_db')
+        cls.obs_md = makePhoSimTestDB(filename=cls.db_name, size=1,
+                                      deltaRA=np.array([72/3600]),
+                                      deltaDec=np.array([0]),
+                                      bandpass='r', m5=16, seeing=0.5,
+                                      seedVal=100)
+
+    @classmethod
+    def tearDownClass(cls):
+        if os.path.exists(cls.db_name):
+            os.remove(cls.db_name)
+        if os.path.exists(cls.scratch_dir):
+            os.rmdir(cls.scratch_dir)
+
+    def tearDown(self):
+        clean_up_lsst_camera()
+
+    def make_interpreter(self, obs_md, seed=42, seed_per_object=False):
+        """
+        Return a GalSimInterpreter drawing onto a single LSST detector
+        and a GalSimCelestialObject point source located on it.
+        """
+        camera_wrapper = LSSTCameraWrapper()
+        phot_params = PhotometricParameters()
+        detector = make_galsim_detector(camera_wrapper, 'R:2,2 S:1,1',
+                                        phot_params, obs_md)
+        bp_dict = BandpassDict.loadTotalBandpassesFromFiles(bandpassNames=['r'])
+
+        sed = Sed()
+        sed.readSED_flambda(os.path.join(getPackageDir('sims_sed_library'),
+                                         'flatSED', 'sed_flat.txt.gz'))
+        imsimband = Bandpass()
+        imsimband.imsimBandpass()
+        sed.multiplyFluxNorm(sed.calcFluxNorm(20.0, imsimband))
+
+        xPupil = radiansFromArcsec(detector.xCenterArcsec + 10.0)
+        yPupil = radiansFromArcsec(detector.yCenterArcsec - 15.0)
+        gsobject = GalSimCelestialObject('pointSource', xPupil, yPupil,
+                                         1e-7, 1e-7, 1e-7, 0, 1, sed,
+                                         bp_dict, phot_params, 0, '',
+                                         0.01, 0, uniqueId=17)
+
+        gs_interpreter = GalSimInterpreter(obs_metadata=obs_md,
+                                           detectors=[detector],
+                                           bandpassDict=bp_dict,
+                                           seed=seed,
+                                           seed_per_object=seed_per_object)
+        gs_interpreter.setPSF(SNRdocumentPSF())
+        return gs_interpreter, gsobject
+
+    def make_detectors(self, obs_md, names=('R:2,2 S:1,1', 'R:2,2 S:1,2')):
+        """
+        Return a list of the GalSimDetectors of the (neighbouring) LSST detectors names
+        """
+        camera_wrapper = LSSTCameraWrapper()
+        phot_params = PhotometricParameters()
+        return [make_galsim_detector(camera_wrapper, name, phot_params, obs_md)
+                for name in names]
+
+    def make_point_source(self, gs_interpreter, gsobject, xArcsec, yArcsec, uniqueId, flux=None):
+        """
+        Return a point source like gsobject at the pupil coordinates (xArcsec, yArcsec),
+        with the given uniqueId and, optionally, flux (e-) in the r band
+        """
+        return GalSimCelestialObject('pointSource', radiansFromArcsec(xArcsec),
+                                     radiansFromArcsec(yArcsec),
+                                     1e-7, 1e-7, 1e-7, 0, 1, gsobject.sed,
+                                     gs_interpreter.bandpassDict, PhotometricParameters(), 0, '',
+                                     0.01, 0, uniqueId=uniqueId,
+                                     fluxDict=None if flux is None else {'r': flux})
+
+    def make_batch(self, gs_interpreter, gsobject, offsets, fluxes=None):
+        """
+        Return a GalSimCelestialObjectBatch of point sources like gsobject,
+        offset from it by the numpy array offsets (arcsec) along x and
+        against it along y.  fluxes is an optional numpy array of their
+        fluxes (e-) in the r band.
+        """
+        nobj = len(offsets)
+        offsets = radiansFromArcsec(offsets)
+        return GalSimCelestialObjectBatch('pointSource',
+                                          gsobject.xPupilRadians + offsets,
+                                          gsobject.yPupilRadians - offsets,
+                                          1e-7, 1e-7, 1e-7, 0, 1,
+                                          [gsobject.sed]*nobj, gs_interpreter.bandpassDict,
+                                          PhotometricParameters(), 0,
+                                          uniqueId=np.arange(nobj) + 100,
+                                          fluxes=None if fluxes is None else {'r': fluxes})
+
+
+class StampDrawingTestCase(InterpreterTestMixin, unittest.TestCase):
+    """
+    Test the postage stamp drawing mode of the GalSimInterpreter.
+    """
+
+    def test_draw_stamps(self):
+        """
+        Test that drawing onto postage stamps reproduces the full-frame
+        drawing for an isolated object.  The stamp need not contain the
+        photons shot into the far wings of the PSF, so the images are
+        compared through their total flux and centroid.
+        """
+        full_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        full_interpreter.drawObject(gsobject)
+
+        stamp_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        stamp_interpreter.draw_stamps = True
+        stamp_interpreter.drawObject(gsobject)
+
+        self.assertEqual(set(full_interpreter.detectorImages.keys()),
+                         set(stamp_interpreter.detectorImages.keys()))
+        for name in full_interpreter.detectorImages:
+            full_image = full_interpreter.detectorImages[name]
+            stamp_image = stamp_interpreter.detectorImages[name]
+            full_flux = full_image.array.sum()
+            stamp_flux = stamp_image.array.sum()
+            self.assertGreater(full_flux, 0)
+            self.assertLess(np.abs(stamp_flux - full_flux), 0.01*full_flux)
+            yy, xx = np.mgrid[0:full_image.array.shape[0], 0:full_image.array.shape[1]]
+            for coord in (xx, yy):
+                self.assertLess(np.abs((coord*full_image.array).sum()/full_flux -
+                                       (coord*stamp_image.array).sum()/stamp_flux), 0.05)
+
+
+class FootprintSizeTestCase(InterpreterTestMixin, unittest.TestCase):
+    """
+    Test the nominal and flux-adaptive footprint size estimates.
+    """
+
+    def test_estimateFootprintSize(self):
+        """
+        Test that the analytic footprint size estimate matches the size
+        of the PSF-convolved GalSim object.
+        """
+        gs_interpreter, point_source = self.make_interpreter(self.obs_md)
+        self.assertAlmostEqual(gs_interpreter.estimateFootprintSize(point_source),
+                               gs_interpreter.createCenteredObject(point_source).getGoodImageSize(1.0),
+                               10)
+
+        for sindex, hlr, q in ((0.5, 0.3, 1.0), (1.0, 1.2, 0.5), (4.0, 0.8, 0.8), (2.5, 3.0, 0.3)):
+            gsobject = GalSimCelestialObject('sersic', point_source.xPupilRadians,
+                                             point_source.yPupilRadians,
+                                             radiansFromArcsec(hlr),
+                                             radiansFromArcsec(q*hlr), radiansFromArcsec(hlr),
+                                             0.3, sindex, point_source.sed,
+                                             gs_interpreter.bandpassDict, PhotometricParameters(),
+                                             0, '', 0.01, 0, gamma1=0.02, kappa=0.01,
+                                             uniqueId=18)
+            estimate = gs_interpreter.estimateFootprintSize(gsobject)
+            control = gs_interpreter.createCenteredObject(gsobject).getGoodImageSize(1.0)
+            self.assertGreater(estimate, 0.8*control)
+            self.assertLess(estimate, 1.5*control)
+
+        gsobject = GalSimCelestialObject('FitsImage', point_source.xPupilRadians,
+                                         point_source.yPupilRadians,
+                                         1e-7, 1e-7, 1e-7, 0, 1, point_source.sed,
+                                         gs_interpreter.bandpassDict, PhotometricParameters(),
+                                         0, 'image.fits', 0.01, 0, uniqueId=19)
+        self.assertIsNone(gs_interpreter.estimateFootprintSize(gsobject))
+
+    def test_fluxAdaptiveFootprintSize(self):
+        """
+        Test that the flux-adaptive footprint encloses the region where
+        the surface brightness exceeds the requested fraction of the sky noise.
+        """
+        gs_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        gs_interpreter.flux_adaptive_footprints = True
+        gs_interpreter.sky_bg_per_pixel = 1000.
+        pixel_scale = gs_interpreter.detectors[0].photParams.platescale
+        psf = gs_interpreter.PSF._getPSF(xPupil=gsobject.xPupilArcsec,
+                                         yPupil=gsobject.yPupilArcsec)
+
+        nominal = gs_interpreter.estimateFootprintSize(gsobject)
+        faint_size = gs_interpreter.fluxAdaptiveFootprintSize(gsobject, [10.])
+        bright_size = gs_interpreter.fluxAdaptiveFootprintSize(gsobject, [1.0e7])
+        self.assertLess(faint_size, 10.*nominal)
+        self.assertGreater(bright_size, faint_size)
+
+        sb_level = np.sqrt(1000.)/3./pixel_scale**2
+        self.assertLess(1.0e7*psf.xValue(0.51*bright_size, 0.), sb_level)
+        self.assertGreater(1.0e7*psf.xValue(0.4*bright_size, 0.), sb_level)
+
+        # findAllDetectors never uses a footprint smaller than the nominal one
+        size, centeredObj = gs_interpreter._footprintSize(gsobject, 10., [10.])
+        self.assertEqual(size, max(nominal, faint_size))
+
+        # the position-independent PSF is only tabulated once
+        self.assertEqual(len(gs_interpreter._psfProfiles), 1)
+
+
+class FluxRealizationTestCase(InterpreterTestMixin, unittest.TestCase):
+    """
+    Test the realization of the fluxes of the objects.
+    """
+
+    def test_realizeFluxes(self):
+        """
+        Test that realizing the fluxes of a chunk of objects at once gives
+        the same fluxes as realizing them object by object.
+        """
+        fluxes = np.array([[0.0], [0.3], [2.5], [40.0], [1.0e6], [0.01]])
+
+        chunk_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        chunk_fluxes = chunk_interpreter._realizeFluxes(fluxes)
+        self.assertEqual(chunk_fluxes.shape, fluxes.shape)
+        self.assertEqual(chunk_fluxes[0][0], 0.0)
+
+        object_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        for ii in range(len(fluxes)):
+            np.testing.assert_array_equal(object_interpreter._realizeFluxes(fluxes[ii:ii+1]),
+                                          chunk_fluxes[ii:ii+1])
+
+        # with a seed per object, each flux only depends on the uniqueId
+        uniqueIds = np.arange(len(fluxes)) + 17
+        chunk_interpreter, gsobject = self.make_interpreter(self.obs_md, seed_per_object=True)
+        chunk_fluxes = chunk_interpreter._realizeFluxes(fluxes, uniqueIds=uniqueIds)
+        self.assertEqual(chunk_fluxes[0][0], 0.0)
+        for ii in reversed(range(len(fluxes))):
+            np.testing.assert_array_equal(chunk_interpreter._realizeFluxes(fluxes[ii:ii+1],
+                                                                           uniqueIds=uniqueIds[ii:ii+1]),
+                                          chunk_fluxes[ii:ii+1])
+
+        # seeds that only differ by 2**32 realize different fluxes
+        many_fluxes = np.full((100, 1), 40.0)
+        interpreters = [self.make_interpreter(self.obs_md, seed=seed)[0] for seed in (42, 42 + 2**32)]
+        self.assertFalse(np.array_equal(interpreters[0]._realizeFluxes(many_fluxes),
+                                        interpreters[1]._realizeFluxes(many_fluxes)))
+
+    def test_hashedPoisson(self):
+        """
+        Test that hashedPoisson draws values with the mean and variance of
+        the Poisson distribution, and that each value only depends on its key.
+        """
+        keys = np.arange(20000, dtype=np.uint64)*np.uint64(7919)
+        for mean in (0.5, 3.0, 25.0, 1.0e4):
+            means = np.full(len(keys), mean)
+            values = hashedPoisson(means, keys)
+            np.testing.assert_array_equal(values, np.floor(values))
+            self.assertLess(np.abs(values.mean() - mean), 5.0*np.sqrt(mean/len(keys)))
+            self.assertLess(np.abs(values.var()/mean - 1.0), 0.05)
+            np.testing.assert_array_equal(hashedPoisson(means[::-3], keys[::-3]), values[::-3])
+        self.assertEqual(hashedPoisson(np.zeros(3), keys[:3]).sum(), 0.0)
+
+
+class SeedPerObjectTestCase(InterpreterTestMixin, unittest.TestCase):
+    """
+    Test seeding the random numbers of each object (seed_per_object).
+    """
+
+    def test_seed_per_object(self):
+        """
+        Test that, with seed_per_object=True, the image of an object does
+        not depend on the random numbers drawn before it.
+        """
+        control_interpreter, gsobject = self.make_interpreter(self.obs_md, seed_per_object=True)
+        control_interpreter.drawObject(gsobject)
+
+        # advance the interpreter's random number generator, as
+        # drawing other objects first would
+        test_interpreter, gsobject = self.make_interpreter(self.obs_md, seed_per_object=True)
+        for ii in range(10):
+            test_interpreter._rng()
+        test_interpreter.drawObject(gsobject)
+
+        for name in control_interpreter.detectorImages:
+            control_image = control_interpreter.detectorImages[name]
+            test_image = test_interpreter.detectorImages[name]
+            self.assertGreater(control_image.array.sum(), 0)
+            np.testing.assert_array_equal(control_image.array, test_image.array)
+
+        with self.assertRaises(RuntimeError):
+            self.make_interpreter(self.obs_md, seed=None, seed_per_object=True)
+
+
+class FaintObjectTestCase(InterpreterTestMixin, unittest.TestCase):
+    """
+    Test drawing faint objects by placing photons sampled from
+    a table shot from the PSF.
+    """
+
+    def test_local_jacobian(self):
+        """
+        Test that photons are placed with the local WCS jacobian at the position
+        of the object, rather than the one at the center of the detector.
+        """
+        gs_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        detector = gs_interpreter.detectors[0]
+        image = gs_interpreter.blankImage(detector=detector)
+        for image_pos in (galsim.PositionD(30.3, 40.6), image.true_center,
+                          galsim.PositionD(image.xmax - 20.1, image.ymax - 30.8)):
+            image.setZero()
+            gs_interpreter._addPhotons(image, image_pos, detector,
+                                       np.array([10.0]), np.array([-5.0]))
+            expected = detector.wcs.local(image_pos=image_pos).toImage(galsim.PositionD(10.0, -5.0))
+            iy, ix = np.unravel_index(np.argmax(image.array), image.array.shape)
+            self.assertEqual(image.array.sum(), image.array[iy, ix])
+            self.assertLess(np.abs(ix + image.xmin - image_pos.x - expected.x), 0.6)
+            self.assertLess(np.abs(iy + image.ymin - image_pos.y - expected.y), 0.6)
+            jac = detector.wcs.jacobian(image_pos=image_pos).inverse().getMatrix()
+            np.testing.assert_allclose(gs_interpreter._inverseJacobians[
+                (detector.name, int(image_pos.x//gs_interpreter.jacobian_cell_size),
+                 int(image_pos.y//gs_interpreter.jacobian_cell_size))], jac, rtol=1.0e-4)
+
+    def test_faint_objects(self):
+        """
+        Test that drawing an object by sampling the PSF photon table
+        deposits the same photons around the same centroid as GalSim.
+        """
+        control_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        control_interpreter.drawObject(gsobject)
+
+        faint_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        faint_interpreter.faint_flux_threshold = 1.0e10
+        faint_interpreter.drawObject(gsobject)
+        self.assertEqual(faint_interpreter.faint_object_stats['objects'], 1)
+        self.assertGreater(faint_interpreter.faint_object_stats['photons'], 0)
+        self.assertEqual(control_interpreter.faint_object_stats['objects'], 0)
+        report = faint_interpreter.faintObjectReport()
+        self.assertEqual(report['objects'], 1)
+        self.assertEqual(report['photons'], faint_interpreter.faint_object_stats['photons'])
+        self.assertEqual(report['size'], faint_interpreter.faint_photon_table_size)
+        self.assertAlmostEqual(report['reuse'], float(report['photons'])/report['size'], 10)
+        self.assertEqual(control_interpreter.faintObjectReport()['size'], 0)
+
+        for name in control_interpreter.detectorImages:
+            control_image = control_interpreter.detectorImages[name].array
+            faint_image = faint_interpreter.detectorImages[name].array
+            self.assertAlmostEqual(faint_image.sum()/control_image.sum(), 1.0, 5)
+            yy, xx = np.indices(control_image.shape)
+            for image in (control_image, faint_image):
+                image_yy = (image*yy).sum()/image.sum()
+                image_xx = (image*xx).sum()/image.sum()
+                self.assertLess(np.abs(image_xx - (control_image*xx).sum()/control_image.sum()), 0.05)
+                self.assertLess(np.abs(image_yy - (control_image*yy).sum()/control_image.sum()), 0.05)
+
+    def test_faint_objects_position_dependent_psf(self):
+        """
+        Test that faint objects are drawn by GalSim when the PSF depends on
+        position, rather than from a new photon table for each object, and
+        that the photon table of a seeded interpreter is seeded by its seed.
+        """
+        gs_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        gs_interpreter.setPSF(PositionDependentPSF())
+        gs_interpreter.faint_flux_threshold = 1.0e10
+        gs_interpreter.drawObject(gsobject)
+        self.assertEqual(gs_interpreter.faintObjectReport()['objects'], 0)
+        self.assertEqual(gs_interpreter.faintObjectReport()['size'], 0)
+
+        tables = []
+        for seed in (42, 42, 43):
+            gs_interpreter, gsobject = self.make_interpreter(self.obs_md, seed=seed)
+            gs_interpreter.faint_flux_threshold = 1.0e10
+            gs_interpreter.faint_photon_table_size = 1000
+            gs_interpreter.drawObject(gsobject)
+            self.assertEqual(gs_interpreter.faintObjectReport()['objects'], 1)
+            tables.append(list(gs_interpreter._psfPhotonTables.values())[0][1][0])
+        np.testing.assert_array_equal(tables[0], tables[1])
+        self.assertFalse(np.array_equal(tables[0], tables[2]))
+
+
+class BrightObjectTestCase(InterpreterTestMixin, unittest.TestCase):
+    """
+    Test drawing bright objects.
+    """
+
+    def test_bright_objects(self):
+        """
+        Test that drawing a bright object with an FFT and Poisson noise
+        reproduces the flux and centroid of photon shooting.
+        """
+        control_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        control_interpreter.drawObject(gsobject)
+
+        fft_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        fft_interpreter.fft_flux_threshold = 0.
+        fft_interpreter.drawObject(gsobject)
+
+        for name in control_interpreter.detectorImages:
+            control_image = control_interpreter.detectorImages[name].array
+            fft_image = fft_interpreter.detectorImages[name].array
+            self.assertGreaterEqual(fft_image.min(), 0.)
+            self.assertAlmostEqual(fft_image.sum()/control_image.sum(), 1.0, 2)
+            yy, xx = np.indices(control_image.shape)
+            self.assertLess(np.abs((fft_image*xx).sum()/fft_image.sum() -
+                                   (control_image*xx).sum()/control_image.sum()), 0.05)
+            self.assertLess(np.abs((fft_image*yy).sum()/fft_image.sum() -
+                                   (control_image*yy).sum()/control_image.sum()), 0.05)
+
+
+class PointSourceTemplateTestCase(InterpreterTestMixin, unittest.TestCase):
+    """
+    Test drawing point sources from a shared template profile
+    and photon reservoir, and demoting small objects to point sources.
+    """
+
+    def test_point_source_template(self):
+        """
+        Test that point sources drawn with a position-independent PSF share
+        one profile, and that shooting photons from it matches drawImage.
+        """
+        class PositionDependentPSF(SNRdocumentPSF):
+            position_independent = False
+
+        template_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        self.assertTrue(template_interpreter.PSF.position_independent)
+        self.assertIs(template_interpreter.drawPointSource(gsobject),
+                      template_interpreter.drawPointSource(gsobject))
+        template_interpreter.drawObject(gsobject)
+
+        control_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        control_interpreter.setPSF(PositionDependentPSF())
+        control_interpreter.drawPointSource(gsobject)
+        self.assertIsNone(control_interpreter._pointSourceTemplate)
+        control_interpreter.drawObject(gsobject)
+
+        for name in control_interpreter.detectorImages:
+            control_image = control_interpreter.detectorImages[name].array
+            template_image = template_interpreter.detectorImages[name].array
+            self.assertAlmostEqual(template_image.sum()/control_image.sum(), 1.0, 5)
+            yy, xx = np.indices(control_image.shape)
+            self.assertLess(np.abs((template_image*xx).sum()/template_image.sum() -
+                                   (control_image*xx).sum()/control_image.sum()), 0.05)
+            self.assertLess(np.abs((template_image*yy).sum()/template_image.sum() -
+                                   (control_image*yy).sum()/control_image.sum()), 0.05)
+
+    def test_photon_reservoir(self):
+        """
+        Test that drawing point sources from a photon reservoir matches
+        photon shooting and that its use is reported.
+        """
+        control_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        control_interpreter.drawObject(gsobject)
+
+        reservoir_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        reservoir_interpreter.photon_reservoir_size = 1000000
+        reservoir_interpreter.drawObject(gsobject)
+
+        report = reservoir_interpreter.photonReservoirReport()
+        self.assertEqual(list(report.keys()), ['r'])
+        self.assertEqual(report['r']['size'], 1000000)
+        self.assertEqual(report['r']['draws'], 1)
+        self.assertGreater(report['r']['photons'], 0)
+        self.assertAlmostEqual(report['r']['correlation'],
+                               min(report['r']['photons']/1.0e6, 1.0), 10)
+
+        for name in control_interpreter.detectorImages:
+            control_image = control_interpreter.detectorImages[name].array
+            reservoir_image = reservoir_interpreter.detectorImages[name].array
+            self.assertAlmostEqual(reservoir_image.sum()/control_image.sum(), 1.0, 5)
+            yy, xx = np.indices(control_image.shape)
+            self.assertLess(np.abs((reservoir_image*xx).sum()/reservoir_image.sum() -
+                                   (control_image*xx).sum()/control_image.sum()), 0.05)
+            self.assertLess(np.abs((reservoir_image*yy).sum()/reservoir_image.sum() -
+                                   (control_image*yy).sum()/control_image.sum()), 0.05)
+
+    def test_point_source_demotion(self):
+        """
+        Test that galaxies much smaller than the PSF are drawn as point sources.
+        """
+        gs_interpreter, point_source = self.make_interpreter(self.obs_md)
+        gs_interpreter.point_source_hlr_fraction = 0.1
+
+        galaxies = {}
+        for ii, hlr in enumerate((0.01, 1.0)):
+            galaxies[hlr] = GalSimCelestialObject('sersic', point_source.xPupilRadians,
+                                                  point_source.yPupilRadians,
+                                                  radiansFromArcsec(hlr),
+                                                  radiansFromArcsec(0.8*hlr), radiansFromArcsec(hlr),
+                                                  0.3, 1.0, point_source.sed,
+                                                  gs_interpreter.bandpassDict, PhotometricParameters(),
+                                                  0, '', 0.01, 0, uniqueId=18 + ii)
+
+        self.assertIs(gs_interpreter.createCenteredObject(galaxies[0.01]),
+                      gs_interpreter.drawPointSource(point_source))
+        self.assertIsNot(gs_interpreter.createCenteredObject(galaxies[1.0]),
+                         gs_interpreter.drawPointSource(point_source))
+        # the FWHM of the PSF is only computed once
+        self.assertEqual(len(gs_interpreter._psfFWHMs), 1)
+
+        # demoted objects are counted once per object drawn
+        self.assertEqual(gs_interpreter.demoted_object_count, 0)
+        gs_interpreter.drawObject(galaxies[0.01])
+        self.assertEqual(gs_interpreter.demoted_object_count, 1)
+        gs_interpreter.drawObject(galaxies[1.0])
+        self.assertEqual(gs_interpreter.demoted_object_count, 1)
+
+        gs_interpreter.point_source_hlr_fraction = None
+        self.assertIsNot(gs_interpreter.createCenteredObject(galaxies[0.01]),
+                         gs_interpreter.drawPointSource(point_source))
+
+
+class ObjectProfilesTestCase(InterpreterTestMixin, unittest.TestCase):
+    """
+    Test the caching of the GalSim profiles of the objects
+    (ObjectProfiles) and the drawing of composite objects.
+    """
+
+    def test_object_profiles(self):
+        """
+        Test that ObjectProfiles builds the profile of an object once and
+        derives the PSF-convolved profiles from it.
+        """
+        gs_interpreter, point_source = self.make_interpreter(self.obs_md)
+        galaxy = GalSimCelestialObject('sersic', point_source.xPupilRadians,
+                                       point_source.yPupilRadians,
+                                       radiansFromArcsec(1.0),
+                                       radiansFromArcsec(0.8), radiansFromArcsec(1.0),
+                                       0.3, 1.0, point_source.sed,
+                                       gs_interpreter.bandpassDict, PhotometricParameters(),
+                                       0, '', 0.01, 0, uniqueId=18)
+
+        profiles = ObjectProfiles(gs_interpreter, galaxy)
+        intrinsic = profiles.intrinsic
+        self.assertIs(profiles.intrinsic, intrinsic)
+
+        centeredObj = profiles.centeredObject()
+        self.assertIs(profiles.centeredObject(), centeredObj)
+        outputString, detectorList, foundObj = gs_interpreter.findAllDetectors(galaxy,
+                                                                               profiles=profiles)
+        self.assertIs(foundObj, centeredObj)
+
+        psf = SNRdocumentPSF(0.7)
+        sizingObj = profiles.centeredObject(psf=psf)
+        self.assertIsNot(sizingObj, centeredObj)
+        self.assertIs(profiles.intrinsic, intrinsic)
+
+        for test, control in ((centeredObj, gs_interpreter.createCenteredObject(galaxy)),
+                              (sizingObj, gs_interpreter.createCenteredObject(galaxy, psf=psf))):
+            np.testing.assert_allclose(test.drawImage(nx=32, ny=32, scale=0.2).array,
+                                       control.drawImage(nx=32, ny=32, scale=0.2).array,
+                                       rtol=1.0e-6)
+
+        profiles = ObjectProfiles(gs_interpreter, point_source)
+        self.assertIsNone(profiles.intrinsic)
+        self.assertIs(profiles.centeredObject(), gs_interpreter.drawPointSource(point_source))
+
+    def test_composite_objects(self):
+        """
+        Test that a composite galaxy is drawn as the sum of its components,
+        each weighted by its own flux.
+        """
+        gs_interpreter, point_source = self.make_interpreter(self.obs_md)
+        disk_sed = Sed(wavelen=point_source.sed.wavelen, flambda=3.0*point_source.sed.flambda)
+        components = []
+        for hlr, sindex, sed, uniqueId in ((0.5, 4.0, point_source.sed, 1025),
+                                           (1.5, 1.0, disk_sed, 1026)):
+            components.append(GalSimCelestialObject('sersic', point_source.xPupilRadians,
+                                                    point_source.yPupilRadians,
+                                                    radiansFromArcsec(hlr),
+                                                    radiansFromArcsec(0.8*hlr),
+                                                    radiansFromArcsec(hlr),
+                                                    0.3, sindex, sed,
+                                                    gs_interpreter.bandpassDict,
+                                                    PhotometricParameters(),
+                                                    0, '', 0.01, 0, uniqueId=uniqueId))
+        composite = GalSimCompositeObject(components, uniqueId=1024)
+        bulge, disk = components
+
+        self.assertEqual(composite.galSimType, 'composite')
+        self.assertAlmostEqual(composite.flux('r'), bulge.flux('r') + disk.flux('r'), 6)
+        self.assertAlmostEqual(gs_interpreter.estimateFootprintSize(composite),
+                               max(gs_interpreter.estimateFootprintSize(bulge),
+                                   gs_interpreter.estimateFootprintSize(disk)), 6)
+
+        control = galsim.Sum([gs_interpreter.createCenteredObject(bulge).withFlux(bulge.flux('r')),
+                              gs_interpreter.createCenteredObject(disk).withFlux(disk.flux('r'))])
+        test = ObjectProfiles(gs_interpreter, composite).bandObject('r', composite.flux('r'))
+        np.testing.assert_allclose(test.drawImage(nx=64, ny=64, scale=0.2).array,
+                                   control.drawImage(nx=64, ny=64, scale=0.2).array,
+                                   rtol=1.0e-6, atol=1.0e-6*control.flux)
+
+        outputString = gs_interpreter.drawObject(composite)
+        self.assertEqual(outputString, gs_interpreter.detectors[0].name)
+        self.assertIn(1024, gs_interpreter.drawn_objects)
+        gain = gs_interpreter.detectors[0].photParams.gain
+        for name in gs_interpreter.detectorImages:
+            image = gs_interpreter.detectorImages[name].array
+            self.assertLess(np.abs(image.sum()*gain - composite.flux('r')),
+                            5.0*np.sqrt(composite.flux('r')))
+
+
+class BatchDrawingTestCase(InterpreterTestMixin, unittest.TestCase):
+    """
+    Test drawing chunks of objects with drawObjects.
+    """
+
+    def test_draw_objects(self):
+        """
+        Test that drawing a chunk of objects with drawObjects reproduces
+        the output strings and the images of drawObject called on each
+        of its objects in turn.
+        """
+        offsets = np.array([0.0, 20.0, -35.0, 50.0, 3000.0])
+
+        batch_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        batch = self.make_batch(batch_interpreter, gsobject, offsets)
+        batch_output = batch_interpreter.drawObjects(batch)
+
+        object_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        object_output = [object_interpreter.drawObject(batch[ii]) for ii in range(len(batch))]
+
+        self.assertEqual(batch_output, object_output)
+        self.assertIsNone(batch_output[-1])
+        self.assertEqual(batch_interpreter.drawn_objects, object_interpreter.drawn_objects)
+        self.assertEqual(set(batch_interpreter.detectorImages.keys()),
+                         set(object_interpreter.detectorImages.keys()))
+        for name in object_interpreter.detectorImages:
+            self.assertGreater(object_interpreter.detectorImages[name].array.sum(), 0)
+            np.testing.assert_array_equal(batch_interpreter.detectorImages[name].array,
+                                          object_interpreter.detectorImages[name].array)
+
+    def test_draw_faint_objects(self):
+        """
+        Test that drawObjects reproduces a loop of drawObject for a chunk
+        including faint objects (whose photons are sampled from the PSF
+        photon table) and an object without flux, which is not drawn but
+        still reports the detectors of its nominal footprint.
+        """
+        offsets = np.array([0.0, 20.0, -35.0, 50.0])
+        fluxes = np.array([0.0, 300.0, 1.0e4, 40.0])
+
+        batch_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        batch_interpreter.faint_flux_threshold = 1000.
+        batch = self.make_batch(batch_interpreter, gsobject, offsets, fluxes=fluxes)
+        batch_output = batch_interpreter.drawObjects(batch)
+
+        object_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        object_interpreter.faint_flux_threshold = 1000.
+        object_output = [object_interpreter.drawObject(batch[ii]) for ii in range(len(batch))]
+
+        self.assertEqual(batch_output, object_output)
+        self.assertEqual(batch_output[0], batch_interpreter.detectors[0].name)
+        self.assertEqual(batch_interpreter.faint_object_stats, object_interpreter.faint_object_stats)
+        self.assertEqual(batch_interpreter.faint_object_stats['objects'], 2)
+        for name in object_interpreter.detectorImages:
+            np.testing.assert_array_equal(batch_interpreter.detectorImages[name].array,
+                                          object_interpreter.detectorImages[name].array)
+
+
+class TiledImageTestCase(InterpreterTestMixin, unittest.TestCase):
+    """
+    Test drawing onto sparse tiled detector images (GalSimTiledImage).
+    """
+
+    def test_tiled_images(self):
+        """
+        Test that drawing onto tiled images only allocates the tiles under
+        the object, reproduces the (default) full-frame drawing, keeping every
+        photon that lands on the detector, and that the sky background is added
+        to every tile when the image is assembled.
+        """
+        full_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        full_interpreter.drawObject(gsobject)
+
+        tiled_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        tiled_interpreter.tile_size = 128
+        tiled_interpreter.noiseWrapper = ExampleCCDNoise(addNoise=False, seed=42)
+        tiled_interpreter.drawObject(gsobject)
+
+        detector = tiled_interpreter.detectors[0]
+        sky_counts = calcSkyCountsPerPixelForM5(self.obs_md.m5['r'], tiled_interpreter.bandpassDict['r'],
+                                                FWHMeff=self.obs_md.seeing['r'],
+                                                photParams=detector.photParams)
+        for name in full_interpreter.detectorImages:
+            full_image = full_interpreter.detectorImages[name]
+            tiled_image = tiled_interpreter.detectorImages[name]
+            self.assertGreater(len(tiled_image.tiles), 0)
+            self.assertLess(len(tiled_image.tiles), 5)
+            self.assertLess(tiled_image.nbytes, full_image.array.nbytes//100)
+
+            # the sky background is added to every tile
+            tiled_array = tiled_image.toImage().array
+            np.testing.assert_array_almost_equal(tiled_interpreter._finalImage(name).array,
+                                                 tiled_array + sky_counts, decimal=3)
+
+            # the same number of photons land on the detector, around the same center
+            self.assertAlmostEqual(tiled_array.sum(dtype=np.float64)/full_image.array.sum(dtype=np.float64),
+                                   1.0, places=4)
+            yy, xx = np.mgrid[:tiled_array.shape[0], :tiled_array.shape[1]]
+            for coord in (xx, yy):
+                self.assertAlmostEqual((coord*tiled_array).sum()/tiled_array.sum(),
+                                       (coord*full_image.array).sum()/full_image.array.sum(),
+                                       delta=0.05)
+
+        # photons added pixel by pixel (as for faint objects) land on the same pixels
+        faint_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        faint_interpreter.faint_flux_threshold = 1.0e10
+        faint_interpreter.drawObject(gsobject)
+        tiled_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        tiled_interpreter.faint_flux_threshold = 1.0e10
+        tiled_interpreter.tile_size = 128
+        tiled_interpreter.drawObject(gsobject)
+        for name in faint_interpreter.detectorImages:
+            np.testing.assert_array_equal(tiled_interpreter._finalImage(name).array,
+                                          faint_interpreter.detectorImages[name].array)
+
+    def test_silicon_tiled_images(self):
+        """
+        Test that GalSimSiliconInterpeter refuses to draw on tiled images,
+        whose sky background the sensor model would not see.
+        """
+        # the metadata shared by the tests of the class must not be modified
+        obs_md = copy.deepcopy(self.obs_md)
+        obs_md.OpsimMetaData['FWHMgeom'] = 0.7343
+        obs_md.OpsimMetaData['altitude'] = 52.54
+        obs_md.OpsimMetaData['rawSeeing'] = 0.5
+        detector = self.make_detectors(obs_md, names=['R:2,2 S:1,1'])[0]
+        gs_interpreter = make_gs_interpreter(obs_md, [detector],
+                                             BandpassDict.loadTotalBandpassesFromFiles(bandpassNames=['r']),
+                                             None, apply_sensor_model=True)
+        gs_interpreter.tile_size = 128
+        with self.assertRaises(RuntimeError):
+            gs_interpreter._addNoiseAndBackground([detector])
+
+
+class ImageMemoryLimitTestCase(InterpreterTestMixin, unittest.TestCase):
+    """
+    Test the spilling of detector images to disk beyond
+    GalSimInterpreter.image_memory_limit.
+    """
+
+    def test_image_memory_limit(self):
+        """
+        Test that images beyond the memory limit are spilled to disk, least
+        recently drawn first, and are reloaded and written intact.
+        """
+        gs_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        detector_a = gs_interpreter.detectors[0]
+        detector_b = make_galsim_detector(LSSTCameraWrapper(), 'R:2,2 S:1,2',
+                                          PhotometricParameters(), self.obs_md)
+        gs_interpreter.detectors.append(detector_b)
+        name_a = gs_interpreter._getFileName(detector=detector_a, bandpassName='r')
+        name_b = gs_interpreter._getFileName(detector=detector_b, bandpassName='r')
+
+        # only the images being drawn on stay in memory
+        gs_interpreter.image_memory_limit = 0
+        gs_interpreter._addNoiseAndBackground([detector_a])
+        gs_interpreter.detectorImages[name_a].array[5, 7] = 3.0
+        gs_interpreter._addNoiseAndBackground([detector_b])
+        self.assertEqual(set(gs_interpreter.detectorImages), set([name_b]))
+        self.assertEqual(gs_interpreter.image_memory_stats,
+                         {'hits': 0, 'misses': 0, 'spills': 1})
+        spill_dir = gs_interpreter._spillDir
+        spill_file_a = gs_interpreter._spilledImages[name_a][0]
+        self.assertEqual(os.listdir(spill_dir), [os.path.basename(spill_file_a)])
+
+        # reloading an image deletes its scratch file (there is no checkpoint)
+        gs_interpreter._addNoiseAndBackground([detector_a])
+        gs_interpreter._addNoiseAndBackground([detector_a])
+        self.assertEqual(set(gs_interpreter.detectorImages), set([name_a]))
+        self.assertEqual(gs_interpreter.detectorImages[name_a].array[5, 7], 3.0)
+        self.assertEqual(gs_interpreter.image_memory_stats,
+                         {'hits': 1, 'misses': 1, 'spills': 2})
+        self.assertEqual(os.listdir(spill_dir),
+                         [os.path.basename(gs_interpreter._spilledImages[name_b][0])])
+
+        # spilled images are written too, and every image is then released,
+        # whether it was spilled or not
+        names = gs_interpreter.writeImages(nameRoot=os.path.join(self.scratch_dir, 'spill'))
+        self.assertEqual(len(names), 2)
+        for file_name in names:
+            image = galsim.fits.read(file_name)
+            self.assertEqual(image.array[5, 7], 3.0 if file_name.endswith(name_a) else 0.0)
+            os.remove(file_name)
+        self.assertFalse(os.path.exists(spill_dir))
+        self.assertIsNone(gs_interpreter._spillDir)
+        self.assertEqual(gs_interpreter.detectorImages, {})
+        for detector in (detector_a, detector_b):
+            with self.assertRaises(RuntimeError):
+                gs_interpreter._addNoiseAndBackground([detector])
+        self.assertEqual(gs_interpreter.writeImages(nameRoot=os.path.join(self.scratch_dir, 'again')),
+                         [])
+
+    def test_spill_checkpointing(self):
+        """
+        Test that each spill of an image goes to a new scratch file, and that
+        the file a checkpoint refers to is kept until the next checkpoint.
+        """
+        gs_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        detector_a = gs_interpreter.detectors[0]
+        detector_b = make_galsim_detector(LSSTCameraWrapper(), 'R:2,2 S:1,2',
+                                          PhotometricParameters(), self.obs_md)
+        gs_interpreter.detectors.append(detector_b)
+        name_a = gs_interpreter._getFileName(detector=detector_a, bandpassName='r')
+        name_b = gs_interpreter._getFileName(detector=detector_b, bandpassName='r')
+        checkpoint_file = os.path.join(self.scratch_dir, 'checkpoint.pkl')
+        gs_interpreter.checkpoint_file = checkpoint_file
+        gs_interpreter.image_memory_limit = 0
+
+        gs_interpreter._addNoiseAndBackground([detector_a])
+        gs_interpreter.detectorImages[name_a].array[5, 7] = 3.0
+        gs_interpreter._addNoiseAndBackground([detector_b])
+        gs_interpreter.write_checkpoint(force=True)
+        spill_file = gs_interpreter._spilledImages[name_a][0]
+        with open(checkpoint_file, 'rb') as input_:
+            self.assertEqual(pickle.load(input_)['spilled_images'], {name_a: spill_file})
+
+        # drawing on the image after the checkpoint neither changes nor deletes
+        # the file the checkpoint refers to...
+        gs_interpreter._addNoiseAndBackground([detector_a])
+        gs_interpreter.detectorImages[name_a].array[5, 7] = 8.0
+        gs_interpreter._addNoiseAndBackground([detector_b])
+        self.assertNotEqual(gs_interpreter._spilledImages[name_a][0], spill_file)
+        with gzip.open(spill_file, 'rb') as input_:
+            self.assertEqual(pickle.load(input_)[5, 7], 3.0)
+
+        # ...until the next checkpoint
+        gs_interpreter.write_checkpoint(force=True)
+        self.assertFalse(os.path.isfile(spill_file))
+
+        spill_dir = gs_interpreter._spillDir
+        names = gs_interpreter.writeImages(nameRoot=os.path.join(self.scratch_dir, 'spill'))
+        for file_name in names:
+            image = galsim.fits.read(file_name)
+            self.assertEqual(image.array[5, 7], 8.0 if file_name.endswith(name_a) else 0.0)
+            os.remove(file_name)
+        self.assertFalse(os.path.exists(spill_dir))
+        with open(checkpoint_file, 'rb') as input_:
+            cp_data = pickle.load(input_)
+        self.assertEqual(cp_data['spilled_images'], {})
+        self.assertEqual(cp_data['released_images'], set([name_a, name_b]))
+        self.assertEqual(cp_data['images'], {})
+
+        os.remove(checkpoint_file)
+
+
+class FinishDetectorTestCase(InterpreterTestMixin, unittest.TestCase):
+    """
+    Test writing and releasing the images of a detector as soon
+    as it is complete (GalSimInterpreter.finishDetector).
+    """
+
+    def test_finish_detector(self):
+        """
+        Test that finishing a detector writes and releases its images with
+        their deferred noise, and calls the detector callback.
+        """
+        gs_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        gs_interpreter.tile_size = 128
+        gs_interpreter.noiseWrapper = ExampleCCDNoise(addNoise=False, seed=42)
+        finished = []
+        gs_interpreter.detector_callback = lambda detector, names: finished.append((detector, names))
+        gs_interpreter.drawObject(gsobject)
+
+        detector = gs_interpreter.detectors[0]
+        name = gs_interpreter._getFileName(detector=detector, bandpassName='r')
+        control = gs_interpreter._finalImage(name)
+
+        nameRoot = os.path.join(self.scratch_dir, 'finished')
+        names = gs_interpreter.finishDetector(detector.name, nameRoot=nameRoot)
+        self.assertEqual(names, [nameRoot + '_' + name])
+        self.assertEqual(finished, [(detector, names)])
+        self.assertEqual(len(gs_interpreter.detectorImages), 0)
+        self.assertIn(detector.name, gs_interpreter.released_detectors)
+        image = galsim.fits.read(names[0])
+        self.assertGreater(image.array.min(), 0.)
+        np.testing.assert_array_equal(image.array, control.array)
+        os.remove(names[0])
+
+        with self.assertRaises(RuntimeError):
+            gs_interpreter.drawObject(gsobject)
+        with self.assertRaises(RuntimeError):
+            gs_interpreter.finishDetector(detector)
+        with self.assertRaises(RuntimeError):
+            gs_interpreter.finishDetector('not a detector')
+        self.assertEqual(len(finished), 1)
+
+    def test_finish_detector_checkpoint(self):
+        """
+        Test that finishing a detector writes a checkpoint recording it as
+        released, and deletes the memory-mapped files and snapshots of its images.
+        """
+        gs_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        gs_interpreter.image_scratch_dir = self.scratch_dir
+        gs_interpreter.checkpoint_file = os.path.join(self.scratch_dir, 'checkpoint.pkl')
+        gs_interpreter.drawObject(gsobject)
+        gs_interpreter.write_checkpoint(force=True)
+
+        detector = gs_interpreter.detectors[0]
+        nameRoot = os.path.join(self.scratch_dir, 'finished')
+        names = gs_interpreter.finishDetector(detector, nameRoot=nameRoot)
+        with open(gs_interpreter.checkpoint_file, 'rb') as input_:
+            cp_data = pickle.load(input_)
+        self.assertEqual(cp_data['images'], {})
+        self.assertEqual(cp_data['released_detectors'], set([detector.name]))
+        self.assertEqual(cp_data['drawn_objects'], set([gsobject.uniqueId]))
+        self.assertEqual(sorted(os.listdir(self.scratch_dir)),
+                         sorted([os.path.basename(name) for name in names] +
+                                [os.path.basename(self.db_name), 'checkpoint.pkl']))
+        for name in names + [gs_interpreter.checkpoint_file]:
+            os.remove(name)
+
+
+class ImageWriterTestCase(InterpreterTestMixin, unittest.TestCase):
+    """
+    Test writing the FITS files in background threads (GalSimImageWriter),
+    compressed and quantized.
+    """
+
+    def test_image_writer(self):
+        """
+        Test that the FITS files written in background threads match those
+        written synchronously, and that the detector callback is only called
+        once they have been written.
+        """
+        def draw():
+            # the images are released once written, so each one is drawn anew
+            gs_interpreter, gsobject = self.make_interpreter(self.obs_md)
+            gs_interpreter.drawObject(gsobject)
+            return gs_interpreter
+
+        control_names = draw().writeImages(nameRoot=os.path.join(self.scratch_dir, 'sync'))
+
+        gs_interpreter = draw()
+        gs_interpreter.image_writer = GalSimImageWriter(nthreads=2)
+        test_names = gs_interpreter.writeImages(nameRoot=os.path.join(self.scratch_dir, 'threaded'))
+        self.assertEqual(len(test_names), len(control_names))
+        self.assertEqual(gs_interpreter.image_writer.nwritten, len(test_names))
+        for control_name, test_name in zip(control_names, test_names):
+            np.testing.assert_array_equal(galsim.fits.read(test_name).array,
+                                          galsim.fits.read(control_name).array)
+
+        finished = []
+
+        def callback(detector, names):
+            for name in names:
+                self.assertTrue(os.path.exists(name))
+            finished.append(detector)
+
+        gs_interpreter = draw()
+        gs_interpreter.image_writer = GalSimImageWriter(nthreads=2)
+        gs_interpreter.detector_callback = callback
+        detector = gs_interpreter.detectors[0]
+        nameRoot = os.path.join(self.scratch_dir, 'finished')
+        names = gs_interpreter.finishDetector(detector, nameRoot=nameRoot)
+        self.assertEqual(len(names), 1)
+        gs_interpreter.image_writer.close()
+        self.assertEqual(finished, [detector])
+        np.testing.assert_array_equal(galsim.fits.read(names[0]).array,
+                                      galsim.fits.read(control_names[0]).array)
+
+        for name in control_names + test_names + names:
+            os.remove(name)
+
+        with self.assertRaises(RuntimeError):
+            GalSimImageWriter(nthreads=0)
+
+    def test_unclosed_writer(self):
+        """
+        Test that the images still queued on a GalSimImageWriter which was
+        not closed are written by the exit handler, which raises their errors.
+        """
+        gs_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        gs_interpreter.drawObject(gsobject)
+        name = list(gs_interpreter.detectorImages)[0]
+        image = gs_interpreter.detectorImages[name]
+
+        writer = GalSimImageWriter(nthreads=2)
+        file_name = os.path.join(self.scratch_dir, 'unclosed.fits')
+        writer.write(image, file_name)
+        self.assertIn(writer, _running_writers)
+        _closeRunningWriters()
+        self.assertNotIn(writer, _running_writers)
+        self.assertEqual(writer.nwritten, 1)
+        np.testing.assert_array_equal(galsim.fits.read(file_name).array, image.array)
+        os.remove(file_name)
+
+        writer.write(image, os.path.join(self.scratch_dir, 'no_such_dir', 'unclosed.fits'))
+        with self.assertRaises(Exception):
+            _closeRunningWriters()
+        self.assertEqual(len(_running_writers), 0)
+
+    def test_compressed_images(self):
+        """
+        Test that tile-compressed images with pixels quantized to unsigned
+        integers hold the rounded pixels of the uncompressed images.
+        """
+        def draw():
+            # the images are released once written, so each one is drawn anew
+            gs_interpreter, gsobject = self.make_interpreter(self.obs_md)
+            gs_interpreter.drawObject(gsobject)
+            return gs_interpreter
+
+        control_names = draw().writeImages(nameRoot=os.path.join(self.scratch_dir, 'float'))
+        control = galsim.fits.read(control_names[0])
+        self.assertGreater(control.array.max(), 10.)
+
+        for compression, quantization, dtype in (('rice', 'int16', np.uint16),
+                                                 ('gzip', 'int32', np.uint32)):
+            gs_interpreter = draw()
+            gs_interpreter.image_writer = GalSimImageWriter(nthreads=2)
+            gs_interpreter.image_compression = compression
+            gs_interpreter.image_quantization = quantization
+            nameRoot = os.path.join(self.scratch_dir, compression)
+            names = gs_interpreter.writeImages(nameRoot=nameRoot)
+            self.assertEqual(names, [name.replace(os.path.join(self.scratch_dir, 'float'), nameRoot) + '.fz'
+                                     for name in control_names])
+            image = galsim.fits.read(names[0])
+            self.assertEqual(image.array.dtype, dtype)
+            np.testing.assert_array_equal(image.array,
+                                          np.clip(np.rint(control.array), 0, np.iinfo(dtype).max))
+            self.assertLess(os.path.getsize(names[0]), os.path.getsize(control_names[0]))
+            for name in names:
+                os.remove(name)
+
+        for name in control_names:
+            os.remove(name)
+
+        gs_interpreter = draw()
+        gs_interpreter.image_compression = 'bzip2'
+        with self.assertRaises(RuntimeError):
+            gs_interpreter.writeImages(nameRoot=os.path.join(self.scratch_dir, 'bad'))
+
+
+class WideFootprintInterpreter(GalSimInterpreter):
+    """
+    A GalSimInterpreter whose flux-adaptive footprints are 700 arcseconds
+    wide for objects brighter than 1e4 e- (and nominal otherwise)
+    """
+
+    def fluxAdaptiveFootprintSize(self, gsObject, realized_fluxes):
+        if max(realized_fluxes) > 1.0e4:
+            return 700.
+        return None
+
+
+class StubCatalog(object):
+    """
+    Stands in for a GalSimBase catalog driven by a GalSimCatalogMultiplexer:
+    it passes a list of objects to its object_sink, one per chunk.
+    """
+    hasBeenInitialized = True
+
+    def __init__(self, interpreter, objects):
+        self.galSimInterpreter = interpreter
+        self.objects = objects
+        self.object_sink = None
+
+    def copyGalSimInterpreter(self, other):
+        self.galSimInterpreter = other.galSimInterpreter
+
+    def iter_catalog_chunks(self, chunk_size=None):
+        for gsObject in self.objects:
+            yield [self.object_sink(gsObject)]
+
+    def draw_composite_galaxies(self):
+        pass
+
+
+class ObjectSpoolTestCase(InterpreterTestMixin, unittest.TestCase):
+    """
+    Test drawing and writing the detectors one region at a time (GalSimObjectSpool
+    and GalSimCatalogMultiplexer).
+    """
+
+    def make_boundary_star(self, obs_md):
+        """
+        Return a WideFootprintInterpreter drawing on two neighbouring detectors,
+        the names of the detectors in the order of their regions and a bright
+        star on the detector of the second region, 300 arcseconds from its
+        center towards the first.  Its flux-adaptive footprint reaches the
+        detector of the first region; its nominal one does not.
+        """
+        gs_interpreter, gsobject = self.make_interpreter(obs_md)
+        detectors = self.make_detectors(obs_md)
+        interpreter = WideFootprintInterpreter(obs_metadata=obs_md, detectors=detectors,
+                                               bandpassDict=gs_interpreter.bandpassDict,
+                                               seed=42)
+        interpreter.setPSF(SNRdocumentPSF())
+        interpreter.flux_adaptive_footprints = True
+
+        first, second = sorted(detectors,
+                               key=lambda dd: (round(dd.yCenterArcsec), dd.xCenterArcsec))
+        dx = first.xCenterArcsec - second.xCenterArcsec
+        dy = first.yCenterArcsec - second.yCenterArcsec
+        distance = np.sqrt(dx**2 + dy**2)
+        star = self.make_point_source(interpreter, gsobject,
+                                      second.xCenterArcsec + 300.*dx/distance,
+                                      second.yCenterArcsec + 300.*dy/distance,
+                                      200, flux=1.0e5)
+
+        self.assertEqual(interpreter.findAllDetectors(star, create_object=False)[0],
+                         second.name)
+        return interpreter, [first.name, second.name], star
+
+    def test_bright_object_near_boundary(self):
+        """
+        Test that a bright object in a later region whose flux-adaptive footprint
+        reaches the detector of an earlier region is assigned to the earlier region,
+        so that it is drawn before that detector is written and released.
+        """
+        for spool_dir in (None, self.scratch_dir):
+            interpreter, names, star = self.make_boundary_star(self.obs_md)
+            spool = GalSimObjectSpool(interpreter, spool_dir=spool_dir)
+            self.assertEqual([dd.name for dd in spool.detectors], names)
+            self.assertEqual(set(spool.add(star).split('//')), set(names))
+
+            written = spool.render(nameRoot=os.path.join(self.scratch_dir, 'spooled'))
+            self.assertEqual(len(written), 2)
+            self.assertEqual(interpreter.released_detectors, set(names))
+            for name in written:
+                os.remove(name)
+
+    def test_multiplexer_bright_object(self):
+        """
+        Test that GalSimCatalogMultiplexer draws a bright object whose flux-adaptive
+        footprint reaches the detector of an earlier region before that detector
+        is written, whether the objects are spooled to disk or held in memory.
+        """
+        for kwargs in ({'spool_dir': self.scratch_dir}, {'hold_in_memory': True}):
+            interpreter, names, star = self.make_boundary_star(self.obs_md)
+            catalogs = [StubCatalog(interpreter, [star]), StubCatalog(None, [])]
+            multiplexer = GalSimCatalogMultiplexer(catalogs, **kwargs)
+            written = multiplexer.writeImages(nameRoot=os.path.join(self.scratch_dir, 'multiplexed'))
+            self.assertEqual(len(written), 2)
+            self.assertEqual(interpreter.released_detectors, set(names))
+            self.assertIs(catalogs[1].galSimInterpreter, interpreter)
+            for name in written:
+                os.remove(name)
+            # the spool files are gone
+            self.assertEqual([name for name in os.listdir(self.scratch_dir)
+                              if name.startswith('galsim_spool_')], [])
+
+
+class ParallelRendererTestCase(InterpreterTestMixin, unittest.TestCase):
+    """
+    Test drawing the detectors in parallel worker processes (GalSimParallelRenderer).
+    """
+
+    def test_parallel_renderer(self):
+        """
+        Test that the images written by the workers of a GalSimParallelRenderer,
+        including those of an object straddling their shards, are identical to
+        those written by a single GalSimInterpreter with seed_per_object=True.
+        """
+        gs_interpreter, gsobject = self.make_interpreter(self.obs_md)
+        detectors = self.make_detectors(self.obs_md)
+        objects = [self.make_point_source(gs_interpreter, gsobject, detector.xCenterArcsec + 10.0,
+                                          detector.yCenterArcsec - 15.0, 100 + ii)
+                   for ii, detector in enumerate(detectors)]
+        straddler = self.make_point_source(gs_interpreter, gsobject,
+                                           0.5*(detectors[0].xCenterArcsec + detectors[1].xCenterArcsec),
+                                           0.5*(detectors[0].yCenterArcsec + detectors[1].yCenterArcsec),
+                                           102, flux=1.0e5)
+        objects.append(straddler)
+
+        for spool_dir in (None, self.scratch_dir):
+            control = GalSimInterpreter(obs_metadata=self.obs_md, detectors=detectors,
+                                        bandpassDict=gs_interpreter.bandpassDict,
+                                        noiseWrapper=ExampleCCDNoise(seed=42),
+                                        seed=42, seed_per_object=True)
+            control.setPSF(SNRdocumentPSF())
+
+            renderer = GalSimParallelRenderer(obs_metadata=self.obs_md, detectors=detectors,
+                                              bandpassDict=gs_interpreter.bandpassDict,
+                                              noiseWrapper=ExampleCCDNoise(seed=42),
+                                              seed=42, nproc=2, spool_dir=spool_dir)
+            renderer.setPSF(SNRdocumentPSF())
+            self.assertEqual(len(renderer.shards), 2)
+
+            for gso in objects:
+                self.assertEqual(renderer.drawObject(gso), control.drawObject(gso))
+            self.assertEqual(set(renderer.findAllDetectors(straddler)[0].split('//')),
+                             set(detector.name for detector in detectors))
+
+            names = renderer.writeImages(nameRoot=os.path.join(self.scratch_dir, 'parallel'))
+            control_names = control.writeImages(nameRoot=os.path.join(self.scratch_dir, 'serial'))
+            self.assertEqual(sorted(name.replace('parallel', 'serial') for name in names),
+                             sorted(control_names))
+            for name in names:
+                np.testing.assert_array_equal(galsim.fits.read(name).array,
+                                              galsim.fits.read(name.replace('parallel', 'serial')).array)
+            for name in names + control_names:
+                os.remove(name)
+
+        with self.assertRaises(RuntimeError):
+            GalSimParallelRenderer(obs_metadata=self.obs_md, detectors=detectors,
+                                   bandpassDict=gs_interpreter.bandpassDict, seed=None)
+
+
 class MemoryTestClass(lsst.utils.tests.MemoryTestCase):
     pass
 
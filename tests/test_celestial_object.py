@@ -2,7 +2,7 @@ import unittest
 import numpy as np
 import lsst.utils.tests
 from lsst.sims.utils import arcsecFromRadians
-from lsst.sims.GalSimInterface import GalSimCelestialObject
+from lsst.sims.GalSimInterface import GalSimCelestialObject, GalSimCelestialObjectBatch
 from lsst.sims.photUtils import Sed, BandpassDict, Bandpass
 from lsst.sims.photUtils import PhotometricParameters
 
@@ -90,6 +90,68 @@ class GSCOTestCase(unittest.TestCase):
             self.assertTrue(np.isfinite(ff))
             self.assertAlmostEqual(gso.flux(bp_name)/ff, 1.0, 10)
 
+    def test_batch(self):
+        """
+        Verify that the objects served up by a GalSimCelestialObjectBatch
+        match those constructed individually
+        """
+        rng = np.random.RandomState(81)
+        nobj = 5
+        wav = np.arange(0.1, 200.0, 0.17)
+        phot_params = PhotometricParameters()
+
+        bp_list = []
+        bp_name_list = []
+        for bp_name in 'abc':
+            bp_list.append(Bandpass(wavelen=wav, sb=rng.random_sample(len(wav))))
+            bp_name_list.append(bp_name)
+        bp_dict = BandpassDict(bp_list, bp_name_list)
+
+        sed_list = [Sed(wavelen=wav, flambda=rng.random_sample(len(wav)))
+                    for ii in range(nobj)]
+        xpupil_rad = rng.random_sample(nobj)
+        ypupil_rad = rng.random_sample(nobj)
+        hlr = rng.random_sample(nobj)
+        minor_axis_rad = rng.random_sample(nobj)
+        major_axis_rad = 2.0*minor_axis_rad
+        position_angle_rad = rng.random_sample(nobj)
+        sindex = rng.random_sample(nobj)*4.0
+        gamma1 = 0.1*rng.random_sample(nobj)
+        unique_id = np.arange(nobj) + 100
+
+        batch = GalSimCelestialObjectBatch('sersic', xpupil_rad, ypupil_rad,
+                                           hlr, minor_axis_rad, major_axis_rad,
+                                           position_angle_rad, sindex,
+                                           sed_list, bp_dict, phot_params, 0,
+                                           gamma1=gamma1, uniqueId=unique_id,
+                                           fluxes={'a': np.arange(nobj, dtype=float)})
+
+        self.assertEqual(len(batch), nobj)
+        np.testing.assert_array_equal(batch.uniqueId, unique_id)
+        np.testing.assert_array_almost_equal(batch.xPupilArcsec,
+                                             arcsecFromRadians(xpupil_rad), 10)
+        np.testing.assert_array_almost_equal(batch.flux('a'), np.arange(nobj), 10)
+
+        for ii in range(nobj):
+            gso = GalSimCelestialObject('sersic', xpupil_rad[ii], ypupil_rad[ii],
+                                        hlr[ii], minor_axis_rad[ii], major_axis_rad[ii],
+                                        position_angle_rad[ii], sindex[ii],
+                                        sed_list[ii], bp_dict, phot_params, 0,
+                                        None, 0.0, 0.0, gamma1=gamma1[ii],
+                                        uniqueId=unique_id[ii])
+            batch_gso = batch[ii]
+            self.assertEqual(batch_gso.uniqueId, gso.uniqueId)
+            self.assertEqual(batch_gso.galSimType, 'sersic')
+            self.assertAlmostEqual(batch_gso.xPupilRadians, gso.xPupilRadians, 10)
+            self.assertAlmostEqual(batch_gso.yPupilRadians, gso.yPupilRadians, 10)
+            self.assertAlmostEqual(batch_gso.halfLightRadiusArcsec, gso.halfLightRadiusArcsec, 10)
+            self.assertAlmostEqual(batch_gso.sindex, gso.sindex, 10)
+            self.assertAlmostEqual(batch_gso.g1, gso.g1, 10)
+            self.assertAlmostEqual(batch_gso.flux('a'), float(ii), 10)
+            for bp_name in 'bc':
+                self.assertAlmostEqual(batch_gso.flux(bp_name)/gso.flux(bp_name), 1.0, 10)
+                self.assertAlmostEqual(batch.flux(bp_name)[ii]/gso.flux(bp_name), 1.0, 10)
+
 
 class MemoryTestClass(lsst.utils.tests.MemoryTestCase):
     pass